@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Webhook Cold-Start Benchmark
+Times module imports in fresh interpreters for each entry point, and what the deferred agent imports cost
+
+Usage: python benchmarks/import_time.py [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# (label, statement timed in a fresh interpreter)
+CASES = [
+    ("sales_agent (Streamlit front-end)", "import sales_agent"),
+    ("agent_core (currency tools only)", "from agent_core import CurrencyConverter"),
+    ("agent_core + phi/Gemini (first agent)", "import agent_core; agent_core.Agent; agent_core.Gemini"),
+    ("webhook: whatsapp_integration", "import whatsapp_integration"),
+]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+print(elapsed, len(sys.modules), 'streamlit' in sys.modules)
+"""
+
+
+def time_import(statement: str):
+    """(seconds, modules loaded, streamlit loaded) for one cold import"""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement)],
+        cwd=SRC_DIR, capture_output=True, text=True, check=True
+    )
+    elapsed, modules, streamlit = result.stdout.strip().splitlines()[-1].split()
+    return float(elapsed), int(modules), streamlit == "True"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare cold import times")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    print(f"📊 Median of {args.runs} cold imports")
+    print(f"   {'':<38}{'seconds':>9}{'modules':>9}  streamlit")
+    for label, statement in CASES:
+        samples = [time_import(statement) for _ in range(args.runs)]
+        elapsed = statistics.median(sample[0] for sample in samples)
+        _, modules, streamlit = samples[-1]
+        print(f"   {label:<38}{elapsed:>9.3f}{modules:>9}  {'yes' if streamlit else 'no'}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
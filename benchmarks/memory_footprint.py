@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Conversation Memory Footprint Benchmark
+Measures resident bytes per session for the old dataclass messages vs the compact slotted ones
+
+Usage: python benchmarks/memory_footprint.py [--sessions 2000] [--messages 50]
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tracemalloc
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from conversation_memory import ConversationMessage, UserProfile
+
+
+@dataclass
+class LegacyMessage:
+    """ConversationMessage as it was before the compact representation"""
+    timestamp: str
+    role: str
+    content: str
+    message_type: str = "text"
+    metadata: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class LegacyProfile:
+    """UserProfile as it was before the compact representation"""
+    phone_number: str
+    name: Optional[str] = None
+    preferred_currency: str = "USD"
+    interests: List[str] = None
+    last_interaction: Optional[str] = None
+    total_interactions: int = 0
+
+
+SAMPLE_TEXTS = [
+    "Convert 100 USD to EUR",
+    "100 USD = 85.42 EUR at today's rate. Anything else I can help with? 😊",
+    "Show me gaming laptops under 1500",
+    "Here are three gaming laptops under 1,500 USD with RTX graphics...",
+]
+MESSAGE_TYPES = ["text", "currency_conversion", "product_inquiry"]
+
+
+def make_snapshot_json(index: int, messages: int) -> str:
+    """A session serialized as it is stored on disk"""
+    start = datetime(2025, 7, 22, 9, 0, 0)
+    return json.dumps({
+        "user_profile": {
+            "phone_number": f"+1555{index:07d}", "name": None, "preferred_currency": "USD",
+            "interests": ["laptops"], "last_interaction": start.isoformat(), "total_interactions": messages
+        },
+        "messages": [{
+            "timestamp": (start + timedelta(seconds=37 * i, microseconds=1234 * i)).isoformat(),
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)],
+            "message_type": MESSAGE_TYPES[i % len(MESSAGE_TYPES)],
+            "metadata": {"detected_products": ["laptop"]} if i % 10 == 0 else {}
+        } for i in range(messages)]
+    })
+
+
+def measure(build, payloads) -> int:
+    """Bytes retained by the sessions build() loads from the JSON payloads"""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    # Parse inside the traced region so retained strings are counted
+    sessions = [build(json.loads(payload)) for payload in payloads]
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del sessions
+    return retained
+
+
+def build_legacy(data):
+    return (LegacyProfile(**data['user_profile']),
+            [LegacyMessage(**msg) for msg in data['messages']])
+
+
+def build_compact(data):
+    return (UserProfile.from_dict(data['user_profile']),
+            [ConversationMessage.from_dict(msg) for msg in data['messages']])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare resident memory per session")
+    parser.add_argument("--sessions", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    payloads = [make_snapshot_json(i, args.messages) for i in range(args.sessions)]
+
+    print(f"📊 {args.sessions} sessions x {args.messages} messages")
+    results = {}
+    for name, build in (("dataclass (before)", build_legacy), ("slotted (after)", build_compact)):
+        results[name] = measure(build, payloads) / args.sessions
+        print(f"   {name:<20} {results[name]:>10,.0f} bytes/session")
+
+    before, after = results.values()
+    print(f"   {'saving':<20} {100 * (before - after) / before:>9.1f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Session Snapshot Codec Benchmark
+Compares pretty-printed JSON with the binary session_codec format on the sample sessions
+
+Usage: python benchmarks/snapshot_codec.py [--data data/conversations] [--rounds 2000]
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import session_codec
+from conversation_memory import ConversationMessage, UserProfile
+
+
+def load_samples(data_dir: str):
+    samples = []
+    for path in sorted(glob.glob(os.path.join(data_dir, "session_*.json"))):
+        with open(path, encoding='utf-8') as f:
+            samples.append(json.load(f))
+    return samples
+
+
+def json_encode(snapshot) -> bytes:
+    return json.dumps(snapshot, indent=2, ensure_ascii=False).encode('utf-8')
+
+
+def to_session(snapshot):
+    """What _load_session does with a decoded snapshot"""
+    return (UserProfile.from_dict(snapshot['user_profile']),
+            [ConversationMessage.from_dict(msg) for msg in snapshot['messages']])
+
+
+def throughput(func, payloads, rounds: int) -> float:
+    """Snapshots processed per second"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for payload in payloads:
+            func(payload)
+    return rounds * len(payloads) / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark session snapshot encodings")
+    parser.add_argument("--data", default="data/conversations")
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    samples = load_samples(args.data)
+    if not samples:
+        print(f"❌ No session_*.json files in {args.data}")
+        return 1
+
+    json_payloads = [json_encode(s) for s in samples]
+    binary_payloads = [session_codec.encode(s) for s in samples]
+    messages = sum(len(s['messages']) for s in samples)
+
+    print(f"📊 {len(samples)} sample sessions, {messages} messages, {args.rounds} rounds")
+    print(f"   {'':<14}{'size (bytes)':>14}{'save/s':>12}{'decode/s':>12}{'load/s':>12}")
+    rows = (
+        ("json (indent)", json_payloads, json_encode, json.loads),
+        ("binary", binary_payloads, session_codec.encode, session_codec.decode),
+    )
+    for name, payloads, encode, decode in rows:
+        size = sum(len(p) for p in payloads)
+        save_rate = throughput(encode, samples, args.rounds)
+        decode_rate = throughput(decode, payloads, args.rounds)
+        load_rate = throughput(lambda p: to_session(decode(p)), payloads, args.rounds)
+        print(f"   {name:<14}{size:>14,}{save_rate:>12,.0f}{decode_rate:>12,.0f}{load_rate:>12,.0f}")
+    print("   load/s = decode plus building the in-memory session objects")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""
+Sales Agent core: exchange-rate tools, prompts and the agent factory
+Importable without side effects; the Streamlit app (sales_agent.py) and the WhatsApp webhook both build on it
+"""
+from dotenv import load_dotenv
+from tenacity import retry, stop_after_attempt, wait_exponential
+import os
+import sys
+import threading
+import requests
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import http_client
+from lazy_import import lazy_attributes, lazy_dir
+from ttl_cache import TTLCache
+
+# phi and the Gemini SDK take about a second to import; only get_sales_agent() needs them
+_LAZY_IMPORTS = {
+    'Agent': 'phi.agent:Agent',
+    'Gemini': 'phi.model.google:Gemini',
+    'DuckDuckGo': 'phi.tools.duckduckgo:DuckDuckGo',
+    'Toolkit': 'phi.tools:Toolkit',
+}
+__getattr__ = lazy_attributes(__name__, _LAZY_IMPORTS)
+__dir__ = lazy_dir(__name__, _LAZY_IMPORTS)
+_module = sys.modules[__name__]
+
+load_dotenv()
+
+EXCHANGE_RATE_API_URL = "https://api.exchangerate-api.com/v4/latest"
+
+# Single canonical rate table; every other pair is derived by triangulation
+RATE_BASE_CURRENCY = os.getenv('RATE_BASE_CURRENCY', 'USD').upper()
+
+# Exchange rate cache settings (rates only refresh upstream a few times a day)
+RATE_CACHE_TTL_SECONDS = float(os.getenv('RATE_CACHE_TTL_SECONDS', 600))
+RATE_CACHE_MAX_ENTRIES = int(os.getenv('RATE_CACHE_MAX_ENTRIES', 32))
+
+class RateFetchError(Exception):
+    """Raised when the exchange rate API returns a non-200 response"""
+    def __init__(self, status_code: int):
+        super().__init__(f"Status code: {status_code}")
+        self.status_code = status_code
+
+class UnsupportedCurrencyError(Exception):
+    """Raised when a currency is missing from the canonical rate table"""
+    def __init__(self, currency: str):
+        super().__init__(f"Currency '{currency}' not supported")
+        self.currency = currency
+
+# Currency Conversion Tool
+class CurrencyConverter:
+    """Exchange-rate tools; plain Python until as_toolkit() hands them to the agent"""
+
+    name = "currency_converter"
+
+    def __init__(self, cache_ttl: Optional[float] = None, cache_size: Optional[int] = None,
+                 base_currency: str = RATE_BASE_CURRENCY):
+        self.base_currency = base_currency.upper()
+        # Rate tables keyed by base currency, shared by all conversion tools
+        self.rate_cache = TTLCache(
+            ttl_seconds=RATE_CACHE_TTL_SECONDS if cache_ttl is None else cache_ttl,
+            max_entries=RATE_CACHE_MAX_ENTRIES if cache_size is None else cache_size
+        )
+        self.tools = [
+            self.convert_currency,
+            self.convert_to_currencies,
+            self.convert_currency_batch,
+            self.get_exchange_rates,
+            self.get_supported_currencies,
+        ]
+
+    def as_toolkit(self):
+        """Wrap the tools in a phi Toolkit (imports phi on first call)"""
+        toolkit = _module.Toolkit(name=self.name)
+        for tool in self.tools:
+            toolkit.register(tool)
+        return toolkit
+
+    def _get_rates(self) -> dict:
+        """Get the canonical rate table, served from cache while fresh"""
+        data = self.rate_cache.get(self.base_currency)
+        if data is None:
+            # Using exchangerate-api.com (free tier)
+            response = http_client.get(f"{EXCHANGE_RATE_API_URL}/{self.base_currency}")
+            if response.status_code != 200:
+                raise RateFetchError(response.status_code)
+            data = response.json()
+            self.rate_cache.set(self.base_currency, data)
+        return data
+
+    def _cross_rate(self, rates: dict, from_currency: str, to_currency: str) -> float:
+        """Derive from->to rate from the canonical table (1 FROM = x TO)"""
+        def base_rate(code: str) -> float:
+            if code == self.base_currency:
+                return 1.0
+            if code not in rates:
+                raise UnsupportedCurrencyError(code)
+            return rates[code]
+
+        to_rate = base_rate(to_currency)
+        return to_rate / base_rate(from_currency)
+
+    def convert_currency(self, amount: float, from_currency: str, to_currency: str) -> str:
+        """
+        Convert an amount from one currency to another using real-time exchange rates.
+
+        Args:
+            amount: The amount to convert
+            from_currency: Source currency code (e.g., 'USD', 'EUR', 'GBP')
+            to_currency: Target currency code (e.g., 'USD', 'EUR', 'GBP')
+
+        Returns:
+            Formatted conversion result with exchange rate information
+        """
+        try:
+            data = self._get_rates()
+            exchange_rate = self._cross_rate(data['rates'], from_currency.upper(), to_currency.upper())
+            converted_amount = amount * exchange_rate
+
+            return f"""
+**Currency Conversion Result:**
+- **Amount**: {amount:,.2f} {from_currency.upper()}
+- **Converts to**: {converted_amount:,.2f} {to_currency.upper()}
+- **Exchange Rate**: 1 {from_currency.upper()} = {exchange_rate:.4f} {to_currency.upper()}
+- **Last Updated**: {data.get('date', 'N/A')}
+
+*Note: Rates are indicative and may vary from actual transaction rates.*
+            """
+
+        except UnsupportedCurrencyError as e:
+            return f"❌ Currency '{e.currency}' not supported. Use get_supported_currencies() to see available options."
+        except RateFetchError as e:
+            return f"❌ Error fetching exchange rates. Status code: {e.status_code}"
+        except requests.exceptions.RequestException as e:
+            return f"❌ Network error: {str(e)}"
+        except Exception as e:
+            return f"❌ Conversion error: {str(e)}"
+
+    def _convert_rows(self, rows: List[tuple]) -> str:
+        """Convert (amount, from, to) rows against one rate table snapshot"""
+        try:
+            data = self._get_rates()
+            rates = data['rates']
+
+            # Resolve each distinct currency once, then price every row from that lookup
+            base_rates = {}
+            for code in {code for _, from_code, to_code in rows for code in (from_code, to_code)}:
+                try:
+                    base_rates[code] = self._cross_rate(rates, self.base_currency, code)
+                except UnsupportedCurrencyError:
+                    base_rates[code] = None
+
+            result = "**Batch Currency Conversion:**\n\n"
+            result += "| Amount | Converts to | Rate |\n|--------|-------------|------|\n"
+
+            for amount, from_code, to_code in rows:
+                missing = [code for code in (from_code, to_code) if base_rates[code] is None]
+                if missing:
+                    result += f"| {amount:,.2f} {from_code} | ❌ '{missing[0]}' not supported | - |\n"
+                    continue
+
+                exchange_rate = base_rates[to_code] / base_rates[from_code]
+                result += (f"| {amount:,.2f} {from_code} | {amount * exchange_rate:,.2f} {to_code} | "
+                           f"1 {from_code} = {exchange_rate:.4f} {to_code} |\n")
+
+            result += f"\n*Last Updated: {data.get('date', 'N/A')}*"
+            result += "\n*Note: Rates are indicative and may vary from actual transaction rates.*"
+            return result
+
+        except RateFetchError as e:
+            return f"❌ Error fetching exchange rates. Status code: {e.status_code}"
+        except requests.exceptions.RequestException as e:
+            return f"❌ Network error: {str(e)}"
+        except Exception as e:
+            return f"❌ Conversion error: {str(e)}"
+
+    def convert_to_currencies(self, amount: float, from_currency: str, to_currencies: List[str]) -> str:
+        """
+        Convert one amount into several currencies in a single call.
+        Use this instead of repeated convert_currency calls for multi-currency price lists.
+
+        Args:
+            amount: The amount to convert
+            from_currency: Source currency code (e.g., 'USD')
+            to_currencies: Target currency codes (e.g., ['EUR', 'GBP', 'INR'])
+
+        Returns:
+            Formatted table with one row per target currency
+        """
+        if not to_currencies:
+            return "❌ No target currencies given."
+
+        from_code = from_currency.upper()
+        return self._convert_rows([(amount, from_code, code.upper()) for code in to_currencies])
+
+    def convert_currency_batch(self, conversions: List[Dict[str, Any]]) -> str:
+        """
+        Convert several amounts between currencies in a single call.
+
+        Args:
+            conversions: List of conversions, each with 'amount', 'from_currency' and 'to_currency'
+                (e.g., [{'amount': 1200, 'from_currency': 'USD', 'to_currency': 'EUR'}])
+
+        Returns:
+            Formatted table with one row per conversion
+        """
+        if not conversions:
+            return "❌ No conversions given."
+
+        try:
+            rows = [self._as_row(item) for item in conversions]
+        except (KeyError, TypeError, ValueError) as e:
+            return f"❌ Invalid conversion entry: {str(e)}"
+
+        return self._convert_rows(rows)
+
+    @staticmethod
+    def _as_row(item: Union[Dict[str, Any], Sequence]) -> tuple:
+        """Normalize a conversion dict or (amount, from, to) tuple"""
+        if isinstance(item, dict):
+            amount, from_code, to_code = item['amount'], item['from_currency'], item['to_currency']
+        else:
+            amount, from_code, to_code = item
+        return float(amount), str(from_code).upper(), str(to_code).upper()
+
+    def get_exchange_rates(self, base_currency: str = "USD") -> str:
+        """
+        Get current exchange rates for a base currency against major currencies.
+
+        Args:
+            base_currency: Base currency code (default: 'USD')
+
+        Returns:
+            Formatted table of exchange rates
+        """
+        try:
+            base_currency = base_currency.upper()
+            data = self._get_rates()
+            rates = data['rates']
+
+            # Major currencies to display
+            major_currencies = ['EUR', 'GBP', 'JPY', 'AUD', 'CAD', 'CHF', 'CNY', 'INR']
+
+            result = f"**Exchange Rates (Base: {base_currency})**\n\n"
+            result += "| Currency | Rate | \n|----------|------|\n"
+
+            for currency in major_currencies:
+                if currency != base_currency and (currency in rates or currency == self.base_currency):
+                    result += f"| {currency} | {self._cross_rate(rates, base_currency, currency):.4f} |\n"
+
+            result += f"\n*Last Updated: {data.get('date', 'N/A')}*"
+            return result
+
+        except UnsupportedCurrencyError as e:
+            return f"❌ Currency '{e.currency}' not supported. Use get_supported_currencies() to see available options."
+        except RateFetchError as e:
+            return f"❌ Error fetching exchange rates. Status code: {e.status_code}"
+        except Exception as e:
+            return f"❌ Error getting exchange rates: {str(e)}"
+
+    def get_supported_currencies(self) -> str:
+        """
+        Get list of supported currency codes.
+
+        Returns:
+            List of supported currencies with their full names
+        """
+        # Common currencies with full names
+        currencies = {
+            'USD': 'US Dollar', 'EUR': 'Euro', 'GBP': 'British Pound', 'JPY': 'Japanese Yen',
+            'AUD': 'Australian Dollar', 'CAD': 'Canadian Dollar', 'CHF': 'Swiss Franc',
+            'CNY': 'Chinese Yuan', 'INR': 'Indian Rupee', 'KRW': 'South Korean Won',
+            'SGD': 'Singapore Dollar', 'HKD': 'Hong Kong Dollar', 'NOK': 'Norwegian Krone',
+            'SEK': 'Swedish Krona', 'DKK': 'Danish Krone', 'PLN': 'Polish Zloty',
+            'CZK': 'Czech Koruna', 'HUF': 'Hungarian Forint', 'RUB': 'Russian Ruble',
+            'BRL': 'Brazilian Real', 'MXN': 'Mexican Peso', 'ZAR': 'South African Rand',
+            'TRY': 'Turkish Lira', 'NZD': 'New Zealand Dollar', 'THB': 'Thai Baht',
+            'MYR': 'Malaysian Ringgit', 'PHP': 'Philippine Peso', 'IDR': 'Indonesian Rupiah'
+        }
+
+        result = "**Supported Currencies:**\n\n"
+        result += "| Code | Currency Name |\n|------|---------------|\n"
+
+        for code, name in currencies.items():
+            result += f"| {code} | {name} |\n"
+
+        result += "\n*Note: Many more currencies are supported. These are the most commonly used ones.*"
+        return result
+
+# Expanded Product Catalog
+PRODUCT_CATALOG = """
+**Available Products:**
+- Premium Laptops: Gaming (RTX 4080, i7), Business (ThinkPad, MacBook Pro), Ultrabooks  
+- Smartphones: iPhone 15 Pro, Samsung Galaxy S24, Google Pixel 8
+- Accessories: Wireless chargers, Premium headphones, Protective cases
+- Software: Office 365, Adobe Creative Suite, Antivirus solutions
+"""
+
+# System prompt with enhanced instructions
+SALES_SYSTEM_PROMPT = f"""
+**Role**: Senior Sales Analyst | Date: {datetime.now().strftime('%Y-%m-%d')}
+
+**Core Capabilities**:
+1. Real-time Market Analysis (via web search)
+2. Inventory Management & Stock Checks
+3. Product Comparisons & Alternatives
+4. Technical Specifications Breakdown
+5. Price Tracking & Competitor Monitoring
+6. Trend Identification & Forecasting
+7. **Currency Conversion & International Pricing** (NEW!)
+
+**Product Catalog**:
+{PRODUCT_CATALOG}
+
+**Operational Guidelines**:
+1. Always first check 'stock' field before recommendations
+2. Use web search for latest market trends when needed
+3. Compare minimum 3 products for any comparison request
+4. Highlight 'trend_score' when > 4.5/5.0
+5. Mention competitor alternatives with pricing
+6. Provide warranty & return policy information
+7. **Currency Conversion**: When customers ask about prices in different currencies, use convert_currency() tool; for several currencies or several prices at once, use convert_to_currencies() or convert_currency_batch() in a single call
+8. **International Sales**: Automatically offer currency conversion for international customers
+9. Format responses with:
+   - Bullet points for features
+   - Tables for comparisons
+   - Bold headers for sections
+   - Currency conversions when relevant
+
+**Error Handling**:
+- If stock < 5: "Low stock alert: Only X remaining"
+- If no data: "Let me research that..."
+- For pricing: "Current promotion: [details]"
+- For currency conversion errors: "Let me get the latest exchange rates..."
+- Never invent specifications or exchange rates
+"""
+
+_agent = None
+_agent_lock = threading.Lock()
+
+def get_sales_agent():
+    """Return the process-wide Sales Agent, creating it on first use"""
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                # Resolved through the module so the deferred imports (and test patches) apply
+                _agent = _module.Agent(
+                    model=_module.Gemini(
+                        id="gemini-2.0-flash-exp",
+                        temperature=0.3,
+                        max_tokens=1024
+                    ),
+                    system_prompt=SALES_SYSTEM_PROMPT,
+                    tools=[_module.DuckDuckGo(), CurrencyConverter().as_toolkit()],
+                    markdown=True
+                )
+    return _agent
+
+def reset_sales_agent():
+    """Drop the cached agent so the next call builds a fresh one"""
+    global _agent
+    with _agent_lock:
+        _agent = None
+
+# Retry logic for API calls
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+def get_ai_response(prompt):
+    return get_sales_agent().run(prompt)
@@ -0,0 +1,209 @@
+"""
+Incrementally maintained user analytics
+Aggregates are updated as sessions change, so /analytics/users never walks the session store
+"""
+import bisect
+import heapq
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+BUCKET_SECONDS = 3600  # Active-user buckets are one hour wide
+ACTIVE_WINDOW_SECONDS = 24 * 3600
+
+
+def to_seconds(timestamp: Optional[str]) -> Optional[float]:
+    """ISO timestamp -> local epoch seconds (None if missing or unparseable)"""
+    if not timestamp:
+        return None
+    try:
+        dt = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is not None:
+        dt = dt.astimezone().replace(tzinfo=None)
+    return dt.timestamp()
+
+
+class AnalyticsIndex:
+    """Per-user summary rows plus running aggregates over them
+
+    update() replaces a user's previous contribution, so it is idempotent and
+    can be called after every change. The index is seeded from the session
+    store on first read (bootstrap), and rebuilt when older than max_age if
+    one is set (e.g. when other workers write to a shared store). A rebuild
+    fills a separate index and swaps it in at once, so readers never see a
+    partial one.
+    """
+
+    def __init__(self, max_age: Optional[float] = None):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._order: List[str] = []  # Row keys, sorted, for cursor pagination
+        self._seen: Dict[str, Optional[float]] = {}  # key -> last interaction (epoch seconds)
+        self._buckets: Dict[int, Set[str]] = {}  # hour bucket -> keys last active in it
+        self._interests: Counter = Counter()
+        self._total_interactions = 0
+        self._built_at: Optional[float] = None
+        self._rebuild_lock = threading.Lock()  # One storage walk at a time
+        self._pending: Optional[Dict[str, Optional[Dict[str, Any]]]] = None  # Changes made during a rebuild
+
+    @property
+    def ready(self) -> bool:
+        if self._built_at is None:
+            return False
+        return self.max_age is None or time.monotonic() - self._built_at < self.max_age
+
+    def update(self, key: str, summary: Dict[str, Any]):
+        """Insert or replace the summary row for one user"""
+        with self._lock:
+            if self._pending is not None:
+                self._pending[key] = summary
+            self._put(key, summary)
+
+    def remove(self, key: str):
+        with self._lock:
+            if self._pending is not None:
+                self._pending[key] = None
+            self._discard(key)
+
+    def _put(self, key: str, summary: Dict[str, Any]):
+        """Add a user's contribution, replacing any previous one (caller holds self._lock)"""
+        row = dict(summary, interests=list(summary.get('interests') or []))
+        seen = to_seconds(row.get('last_interaction'))
+        if key in self._rows:
+            self._discard(key, keep_order=True)
+        else:
+            bisect.insort(self._order, key)
+        self._rows[key] = row
+        self._seen[key] = seen
+        if seen is not None:
+            self._buckets.setdefault(int(seen // BUCKET_SECONDS), set()).add(key)
+        self._interests.update(row['interests'])
+        self._total_interactions += row.get('total_interactions') or 0
+
+    def _discard(self, key: str, keep_order: bool = False):
+        """Subtract a user's contribution (caller holds self._lock)"""
+        row = self._rows.pop(key, None)
+        if row is None:
+            return
+        if not keep_order:
+            del self._order[bisect.bisect_left(self._order, key)]
+        seen = self._seen.pop(key)
+        if seen is not None:
+            bucket = int(seen // BUCKET_SECONDS)
+            members = self._buckets[bucket]
+            members.discard(key)
+            if not members:
+                del self._buckets[bucket]
+        self._interests.subtract(row['interests'])
+        for interest in row['interests']:
+            if self._interests[interest] <= 0:
+                del self._interests[interest]
+        self._total_interactions -= row.get('total_interactions') or 0
+
+    def rebuild(self, rows: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Reseed from (key, summary) pairs, e.g. a walk over the session store
+
+        The current index keeps serving reads until the new one is complete.
+        Changes made while rows are read are replayed on top of the new index.
+        """
+        fresh = AnalyticsIndex()
+        with self._lock:
+            self._pending = {}
+        try:
+            for key, summary in rows:
+                fresh._put(key, summary)
+        except BaseException:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self._rows, self._order, self._seen = fresh._rows, fresh._order, fresh._seen
+            self._buckets, self._interests = fresh._buckets, fresh._interests
+            self._total_interactions = fresh._total_interactions
+            for key, summary in pending.items():
+                if summary is None:
+                    self._discard(key)
+                else:
+                    self._put(key, summary)
+            self._built_at = time.monotonic()
+
+    def ensure_ready(self, rows: Callable[[], Iterable[Tuple[str, Dict[str, Any]]]]):
+        """Bootstrap (or refresh) from rows() unless the index is current
+
+        Concurrent callers share one rebuild instead of each walking the store.
+        Only the first bootstrap is waited for; once built, a stale index keeps
+        serving while a background thread refreshes it.
+        """
+        if self.ready:
+            return
+        if self._built_at is not None:
+            if self._rebuild_lock.acquire(blocking=False):
+                threading.Thread(target=self._refresh, args=(rows,), name="analytics-refresh", daemon=True).start()
+            return
+        with self._rebuild_lock:
+            if not self.ready:
+                self.rebuild(rows())
+
+    def _refresh(self, rows: Callable[[], Iterable[Tuple[str, Dict[str, Any]]]]):
+        """Background rebuild (runs holding self._rebuild_lock)"""
+        try:
+            self.rebuild(rows())
+        except Exception as e:
+            logger.error(f"Error refreshing analytics index: {e}")
+        finally:
+            self._rebuild_lock.release()
+
+    def active_users(self, window_seconds: float = ACTIVE_WINDOW_SECONDS, now: Optional[float] = None) -> int:
+        """Users whose last interaction is within the window
+
+        Whole hour buckets are counted by size; only the bucket straddling the
+        window start is checked user by user.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - window_seconds
+        first = int(cutoff // BUCKET_SECONDS)
+        last = int(now // BUCKET_SECONDS)
+        with self._lock:
+            count = sum(1 for key in self._buckets.get(first, ()) if self._seen[key] > cutoff)
+            for bucket in range(first + 1, last + 1):
+                count += len(self._buckets.get(bucket, ()))
+        return count
+
+    def top_interests(self, limit: int = 5) -> List[Tuple[str, int]]:
+        """Most common interests, ties broken alphabetically"""
+        with self._lock:
+            return heapq.nsmallest(limit, self._interests.items(), key=lambda item: (-item[1], item[0]))
+
+    def users(self) -> List[Dict[str, Any]]:
+        """Summary rows ordered by session key"""
+        with self._lock:
+            return [self._rows[key] for key in self._order]
+
+    def page(self, after: Optional[str] = None, limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Up to limit rows with keys after `after`, plus the key to continue from (None at the end)"""
+        with self._lock:
+            start = bisect.bisect_right(self._order, after) if after is not None else 0
+            keys = self._order[start:start + limit]
+            rows = [self._rows[key] for key in keys]
+            more = start + limit < len(self._order)
+        return rows, keys[-1] if more and keys else None
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            total_users = len(self._rows)
+            total_interactions = self._total_interactions
+        return {
+            "total_users": total_users,
+            "total_interactions": total_interactions,
+            "active_users_24h": self.active_users(),
+            "top_interests": self.top_interests()
+        }
@@ -2,37 +2,130 @@
 Conversation Memory System for WhatsApp Sales Agent
 Handles user conversation history and context-aware responses
 """
-import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass, asdict
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Any, Iterator, Tuple, Union
+from dataclasses import dataclass, field
 import logging
 
+from analytics_index import AnalyticsIndex, to_seconds
+from retention import ExpiryIndex, RetentionSweeper
+from session_archive import MEMORY_ARCHIVE_DIR, SessionArchive
+from session_codec import to_epoch_us, from_epoch_us
+from session_storage import SessionStorage, create_storage
+
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Sessions kept in memory at once; others are loaded from storage on demand
+MAX_RESIDENT_SESSIONS = int(os.getenv('MEMORY_MAX_RESIDENT_SESSIONS', 1000))
+# Write-behind: buffered changes are flushed at least this often (0 = write-through)
+FLUSH_INTERVAL_SECONDS = float(os.getenv('MEMORY_FLUSH_INTERVAL_SECONDS', 1.0))
+# Buffered change records that trigger an early flush
+FLUSH_MAX_PENDING = int(os.getenv('MEMORY_FLUSH_MAX_PENDING', 200))
+# Shared stores only: rebuild the analytics index from storage after this many seconds
+ANALYTICS_REFRESH_SECONDS = float(os.getenv('MEMORY_ANALYTICS_REFRESH_SECONDS', 60))
+# Background expiry of sessions idle for this many days (0 = only on cleanup_old_sessions())
+RETENTION_DAYS = float(os.getenv('MEMORY_RETENTION_DAYS', 0))
+RETENTION_SWEEP_INTERVAL_SECONDS = float(os.getenv('MEMORY_RETENTION_SWEEP_INTERVAL_SECONDS', 3600))
+RETENTION_BATCH_SIZE = int(os.getenv('MEMORY_RETENTION_BATCH_SIZE', 100))
+
 class ConversationMessage:
-    """Single message in conversation"""
-    timestamp: str
-    role: str  # 'user' or 'assistant'
-    content: str
-    message_type: str = "text"  # text, currency_conversion, product_inquiry
-    metadata: Optional[Dict[str, Any]] = None
+    """Single message in conversation
+    
+    Kept compact because every resident session holds up to 50 of these:
+    slotted, timestamp stored as epoch microseconds, role/message_type
+    interned, and the metadata dict only allocated when it is used.
+    """
+    __slots__ = ('_timestamp', 'role', 'content', 'message_type', '_metadata')
+    
+    def __init__(self, timestamp: Union[str, int], role: str, content: str,
+                 message_type: str = "text", metadata: Optional[Dict[str, Any]] = None):
+        self._timestamp = to_epoch_us(timestamp)
+        self.role = sys.intern(role)  # 'user' or 'assistant'
+        self.content = content
+        self.message_type = sys.intern(message_type)  # text, currency_conversion, product_inquiry
+        self._metadata = metadata or None
+    
+    @property
+    def timestamp(self) -> str:
+        """ISO timestamp, exactly as it was created"""
+        if isinstance(self._timestamp, int):
+            return from_epoch_us(self._timestamp).isoformat()
+        return self._timestamp
+    
+    @property
+    def time(self) -> datetime:
+        if isinstance(self._timestamp, int):
+            return from_epoch_us(self._timestamp)
+        return datetime.fromisoformat(self._timestamp)
+    
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        if self._metadata is None:
+            self._metadata = {}
+        return self._metadata
+    
+    @metadata.setter
+    def metadata(self, value: Optional[Dict[str, Any]]):
+        self._metadata = value or None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to the JSON session schema"""
+        return {
+            'timestamp': self.timestamp,
+            'role': self.role,
+            'content': self.content,
+            'message_type': self.message_type,
+            'metadata': self._metadata or {}
+        }
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConversationMessage":
+        return cls(**data)
+    
+    def __eq__(self, other):
+        if not isinstance(other, ConversationMessage):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+    
+    def __repr__(self):
+        return f"ConversationMessage({self.timestamp!r}, {self.role!r}, {self.content[:30]!r})"
 
-@dataclass
 class UserProfile:
     """User profile and preferences"""
-    phone_number: str
-    name: Optional[str] = None
-    preferred_currency: str = "USD"
-    interests: List[str] = None
-    last_interaction: Optional[str] = None
-    total_interactions: int = 0
+    __slots__ = ('phone_number', 'name', 'preferred_currency', 'interests',
+                 'last_interaction', 'total_interactions')
     
-    def __post_init__(self):
-        if self.interests is None:
-            self.interests = []
+    def __init__(self, phone_number: str, name: Optional[str] = None, preferred_currency: str = "USD",
+                 interests: Optional[List[str]] = None, last_interaction: Optional[str] = None,
+                 total_interactions: int = 0):
+        self.phone_number = phone_number
+        self.name = name
+        self.preferred_currency = sys.intern(preferred_currency)
+        self.interests = interests if interests is not None else []
+        self.last_interaction = last_interaction
+        self.total_interactions = total_interactions
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert to the JSON session schema"""
+        return {field_name: getattr(self, field_name) for field_name in self.__slots__}
+    
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "UserProfile":
+        return cls(**data)
+    
+    def __eq__(self, other):
+        if not isinstance(other, UserProfile):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+    
+    def __repr__(self):
+        return f"UserProfile({self.phone_number!r}, name={self.name!r})"
 
 @dataclass
 class ConversationSession:
@@ -42,6 +135,9 @@ class ConversationSession:
     session_summary: Optional[str] = None
     created_at: Optional[str] = None
     updated_at: Optional[str] = None
+    journal_seq: int = 0  # Sequence number of the last change record applied
+    # Rendered prompt context (see get_conversation_context); in memory only
+    context_cache: Optional[Dict[str, Any]] = field(default=None, repr=False, compare=False)
     
     def __post_init__(self):
         if self.created_at is None:
@@ -49,204 +145,649 @@ class ConversationSession:
         self.updated_at = datetime.now().isoformat()
 
 class ConversationMemory:
-    """Manages conversation memory and context"""
+    """Manages conversation memory and context
+
+    Safe for concurrent use: each phone number has its own lock, so different
+    users never wait on each other. A short structural lock guards the LRU
+    and the lock table only, never I/O.
+    """
     
-    def __init__(self, storage_dir: str = "data/conversations"):
+    def __init__(self, storage_dir: str = "data/conversations", max_resident_sessions: int = MAX_RESIDENT_SESSIONS,
+                 storage: Optional[SessionStorage] = None, flush_interval: float = FLUSH_INTERVAL_SECONDS,
+                 flush_max_pending: int = FLUSH_MAX_PENDING, retention_days: float = RETENTION_DAYS,
+                 archive: Optional[SessionArchive] = None):
         self.storage_dir = storage_dir
-        self.sessions: Dict[str, ConversationSession] = {}
+        # Backend chosen by MEMORY_BACKEND unless one is passed in
+        self.storage = storage if storage is not None else create_storage(storage_dir=storage_dir)
+        # LRU working set: sessions are loaded on first access, least recently used evicted
+        self.sessions: "OrderedDict[str, ConversationSession]" = OrderedDict()
+        self.max_resident_sessions = max_resident_sessions
         self.max_messages_per_session = 50  # Keep last 50 messages
         self.session_timeout_hours = 24  # Reset context after 24 hours
+        self.journal_compact_threshold = 100  # Journal records before rewriting the snapshot
+        self._journal_lengths: Dict[str, int] = {}
+        
+        # Per-session locks, kept only while some thread holds or waits for them
+        self._lock = threading.Lock()  # Guards self.sessions and self._session_locks
+        self._session_locks: Dict[str, List[Any]] = {}  # key -> [RLock, users]
+        
+        # Write-behind buffer: dirty session key -> change records not yet persisted
+        # Shared stores are written through so other workers see changes at once
+        self.flush_interval = 0 if self.storage.shared else flush_interval
+        self.flush_max_pending = flush_max_pending
+        self._dirty: "OrderedDict[str, List[Dict[str, Any]]]" = OrderedDict()
+        self._dirty_count = 0
+        self._buffer_lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # Keeps flushes in order
+        self._flush_wakeup = threading.Condition(self._buffer_lock)
+        self._flusher: Optional[threading.Thread] = None
+        self._closed = False
+        
+        # Running analytics aggregates, seeded from storage on first read
+        self.analytics = AnalyticsIndex(max_age=ANALYTICS_REFRESH_SECONDS if self.storage.shared else None)
         
-        # Create storage directory
-        os.makedirs(storage_dir, exist_ok=True)
+        # Cold tier: expired sessions move here and come back when the user writes again
+        if archive is None and MEMORY_ARCHIVE_DIR:
+            archive = SessionArchive(MEMORY_ARCHIVE_DIR)
+        self.archive = archive
         
-        # Load existing sessions
-        self._load_sessions()
+        # Sessions ordered by last interaction, so expiry never scans the whole store
+        self.retention = ExpiryIndex()
+        self.retention_batch_size = RETENTION_BATCH_SIZE
+        self._sweeper: Optional[RetentionSweeper] = None
+        if retention_days > 0:
+            self._sweeper = RetentionSweeper(self.expire_sessions, retention_days,
+                                             interval=RETENTION_SWEEP_INTERVAL_SECONDS,
+                                             batch_size=RETENTION_BATCH_SIZE)
+            self._sweeper.start()
     
-    def _get_session_file(self, phone_number: str) -> str:
-        """Get file path for user session"""
-        safe_number = phone_number.replace("+", "").replace("-", "").replace(" ", "")
-        return os.path.join(self.storage_dir, f"session_{safe_number}.json")
+    @staticmethod
+    def _session_key(phone_number: str) -> str:
+        """Normalize phone number so '+1 234' and '1234' share one session"""
+        return phone_number.replace("+", "").replace("-", "").replace(" ", "")
     
-    def _load_sessions(self):
-        """Load all existing sessions from storage"""
+    def _register_lock(self, key: str) -> List[Any]:
+        """Get or create the lock entry for a session (caller holds self._lock)"""
+        entry = self._session_locks.get(key)
+        if entry is None:
+            entry = self._session_locks[key] = [threading.RLock(), 0]
+        entry[1] += 1
+        return entry
+    
+    @contextmanager
+    def _hold_lock(self, key: str, entry: List[Any]):
+        """Hold a registered session lock, dropping the entry once nobody needs it"""
+        entry[0].acquire()
         try:
-            for filename in os.listdir(self.storage_dir):
-                if filename.startswith("session_") and filename.endswith(".json"):
-                    phone_number = filename.replace("session_", "").replace(".json", "")
-                    phone_number = f"+{phone_number}"  # Add + back
-                    self._load_session(phone_number)
-        except Exception as e:
-            logger.error(f"Error loading sessions: {e}")
+            yield
+        finally:
+            entry[0].release()
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._session_locks[key]
+                    if self.storage.shared:
+                        # Other workers may change this user next; reload on the next request
+                        self.sessions.pop(key, None)
+                        self._journal_lengths.pop(key, None)
+    
+    @contextmanager
+    def _session_lock(self, phone_number: str):
+        """Serialize all access to one user's session"""
+        key = self._session_key(phone_number)
+        with self._lock:
+            entry = self._register_lock(key)
+        with self._hold_lock(key, entry):
+            yield
+    
+    def _iter_all_sessions(self) -> Iterator[Tuple[str, ConversationSession]]:
+        """Iterate resident and stored sessions without growing the working set
+
+        Each session is yielded while its lock is held.
+        """
+        with self._lock:
+            resident = set(self.sessions.keys())
+        keys = set(self.storage.list_keys()) | resident
+        for key in sorted(keys):
+            with self._session_lock(key):
+                session = self.sessions.get(key)
+                if session is None:
+                    session, _ = self._load_session(key)
+                if session is not None:
+                    yield key, session
     
-    def _load_session(self, phone_number: str):
-        """Load specific user session"""
+    def _load_session(self, phone_number: str) -> Tuple[Optional[ConversationSession], int]:
+        """Load specific user session (snapshot plus journal replay)
+
+        Returns the session (or None if nothing is stored) and its journal length.
+        """
+        key = self._session_key(phone_number)
         try:
-            session_file = self._get_session_file(phone_number)
-            if os.path.exists(session_file):
-                with open(session_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # Convert dict back to dataclasses
-                user_profile = UserProfile(**data['user_profile'])
-                messages = [ConversationMessage(**msg) for msg in data['messages']]
-                
+            session = None
+            data, records = self.storage.load(key, self.max_messages_per_session)
+            if data is not None:
+                session = self._session_from_snapshot(data)
+            
+            if records and session is None:
                 session = ConversationSession(
-                    user_profile=user_profile,
-                    messages=messages,
-                    session_summary=data.get('session_summary'),
-                    created_at=data.get('created_at'),
-                    updated_at=data.get('updated_at')
+                    user_profile=UserProfile(phone_number=phone_number),
+                    messages=[]
                 )
-                
-                self.sessions[phone_number] = session
-                logger.info(f"Loaded session for {phone_number} with {len(messages)} messages")
+            
+            for record in records:
+                # Records already folded into the snapshot are skipped
+                if record['seq'] > session.journal_seq:
+                    self._apply_record(session, record)
+            
+            if session is not None:
+                logger.debug(f"Loaded session for {phone_number} with {len(session.messages)} messages")
+            return session, len(records)
                 
         except Exception as e:
             logger.error(f"Error loading session for {phone_number}: {e}")
+            return None, 0
+    
+    @staticmethod
+    def _session_from_snapshot(data: Dict[str, Any]) -> ConversationSession:
+        """Convert a stored snapshot dict back to a session"""
+        return ConversationSession(
+            user_profile=UserProfile.from_dict(data['user_profile']),
+            messages=[ConversationMessage.from_dict(msg) for msg in data['messages']],
+            session_summary=data.get('session_summary'),
+            created_at=data.get('created_at'),
+            updated_at=data.get('updated_at'),
+            journal_seq=data.get('journal_seq', 0)
+        )
+    
+    def _rehydrate_session(self, phone_number: str) -> Optional[ConversationSession]:
+        """Move an archived session back into the hot store (None if it is not archived)"""
+        key = self._session_key(phone_number)
+        if self.archive is None or key not in self.archive:
+            return None
+        try:
+            session = self._session_from_snapshot(self.archive.restore(key))
+            session.journal_seq = 0  # The hot store starts a fresh journal
+            # Hot copy first: after a crash in between, the hot store wins over the archive
+            self.storage.save(key, self._snapshot(session))
+            self.archive.discard(key)
+            self.analytics.update(key, self._summarize(session.user_profile.phone_number, session))
+            self.retention.touch(key, session.user_profile.last_interaction)
+            logger.info(f"Restored archived session for {phone_number}")
+            return session
+        except Exception as e:
+            logger.error(f"Error restoring archived session for {phone_number}: {e}")
+            return None
+    
+    def _apply_message(self, session: ConversationSession, message: ConversationMessage):
+        """Append message to session and update interaction counters"""
+        session.messages.append(message)
+        session.user_profile.total_interactions += 1
+        session.user_profile.last_interaction = message.timestamp
+        
+        # Keep only recent messages
+        if len(session.messages) > self.max_messages_per_session:
+            session.messages = session.messages[-self.max_messages_per_session:]
+        
+        # Slide the rendered context window by one line instead of re-rendering it
+        cache = session.context_cache
+        if cache is not None:
+            cache['lines'].append(self._render_context_line(message))
+            cache['text'] = None
+    
+    def _apply_record(self, session: ConversationSession, record: Dict[str, Any]):
+        """Replay one journal record onto a session"""
+        if record['op'] == 'message':
+            self._apply_message(session, ConversationMessage.from_dict(record['message']))
+        elif record['op'] == 'profile':
+            session.user_profile = UserProfile.from_dict(record['profile'])
+            self._invalidate_context(session)
+        
+        if 'created_at' in record:
+            session.created_at = record['created_at']
+        session.updated_at = record['updated_at']
+        session.journal_seq = record['seq']
+    
+    def _append_record(self, phone_number: str, record: Dict[str, Any]):
+        """Append one change record to the session journal, compacting when it grows"""
+        key = self._session_key(phone_number)
+        try:
+            session = self.sessions[key]
+            self._invalidate_context(session)  # Profile header may have changed
+            if session.journal_seq == 0:
+                record['created_at'] = session.created_at
+            record['seq'] = session.journal_seq + 1
+            record['updated_at'] = datetime.now().isoformat()
+            
+            self._buffer_record(key, record)
+            
+            session.journal_seq = record['seq']
+            session.updated_at = record['updated_at']
+            self.analytics.update(key, self._summarize(session.user_profile.phone_number, session))
+            self.retention.touch(key, session.user_profile.last_interaction)
+            if self.storage.compacts_journal:
+                self._journal_lengths[key] = self._journal_lengths.get(key, 0) + 1
+                if self._journal_lengths[key] >= self.journal_compact_threshold:
+                    self._save_session(phone_number)
+                
+        except Exception as e:
+            logger.error(f"Error appending journal for {phone_number}: {e}")
+    
+    def _buffer_record(self, key: str, record: Dict[str, Any]):
+        """Queue a change record for the next flush (or write it now in write-through mode)"""
+        if self.flush_interval <= 0 or self._closed:
+            self.storage.append(key, record)
+            return
+        
+        with self._buffer_lock:
+            self._dirty.setdefault(key, []).append(record)
+            self._dirty_count += 1
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name="memory-flusher", daemon=True)
+                self._flusher.start()
+            if self._dirty_count >= self.flush_max_pending:
+                self._flush_wakeup.notify()
+    
+    def _run_flusher(self):
+        """Background loop: flush on the interval, or early once the buffer is full"""
+        while True:
+            with self._buffer_lock:
+                if self._dirty_count < self.flush_max_pending and not self._closed:
+                    self._flush_wakeup.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self.flush()
+    
+    def flush(self):
+        """Persist all buffered change records, one batched write per flush"""
+        with self._flush_lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        """Persist the buffer (caller holds self._flush_lock)"""
+        with self._buffer_lock:
+            if not self._dirty:
+                return
+            batch, self._dirty = self._dirty, OrderedDict()
+            self._dirty_count = 0
+        
+        try:
+            self.storage.append_many(
+                (key, record) for key, records in batch.items() for record in records
+            )
+            logger.debug(f"Flushed {len(batch)} dirty sessions")
+        except Exception as e:
+            logger.error(f"Error flushing sessions, will retry: {e}")
+            with self._buffer_lock:
+                # Put the batch back ahead of anything buffered since
+                for key, records in self._dirty.items():
+                    batch.setdefault(key, []).extend(records)
+                self._dirty = batch
+                self._dirty_count = sum(len(records) for records in batch.values())
+    
+    @staticmethod
+    def _snapshot(session: ConversationSession) -> Dict[str, Any]:
+        """Convert session to its plain-dict storage form"""
+        return {
+            'user_profile': session.user_profile.to_dict(),
+            'messages': [msg.to_dict() for msg in session.messages],
+            'session_summary': session.session_summary,
+            'created_at': session.created_at,
+            'updated_at': session.updated_at,
+            'journal_seq': session.journal_seq
+        }
     
     def _save_session(self, phone_number: str):
-        """Save user session to storage"""
+        """Write full session snapshot and truncate its journal (compaction)"""
+        key = self._session_key(phone_number)
         try:
-            if phone_number not in self.sessions:
+            if key not in self.sessions:
                 return
             
-            session = self.sessions[phone_number]
-            session.updated_at = datetime.now().isoformat()
-            
-            # Convert to dict for JSON serialization
-            data = {
-                'user_profile': asdict(session.user_profile),
-                'messages': [asdict(msg) for msg in session.messages],
-                'session_summary': session.session_summary,
-                'created_at': session.created_at,
-                'updated_at': session.updated_at
-            }
-            
-            session_file = self._get_session_file(phone_number)
-            with open(session_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
+            self.storage.save(key, self._snapshot(self.sessions[key]))
+            self._journal_lengths[key] = 0
+            if self.storage.compacts_journal:
+                # Buffered records are already folded into the snapshot
+                with self._buffer_lock:
+                    self._dirty_count -= len(self._dirty.pop(key, []))
                 
-            logger.debug(f"Saved session for {phone_number}")
+            logger.debug(f"Saved session snapshot for {phone_number}")
             
         except Exception as e:
             logger.error(f"Error saving session for {phone_number}: {e}")
     
     def get_or_create_session(self, phone_number: str) -> ConversationSession:
         """Get existing session or create new one"""
-        if phone_number not in self.sessions:
-            # Create new session
-            user_profile = UserProfile(phone_number=phone_number)
-            session = ConversationSession(
-                user_profile=user_profile,
-                messages=[]
-            )
-            self.sessions[phone_number] = session
-            logger.info(f"Created new session for {phone_number}")
+        key = self._session_key(phone_number)
+        with self._session_lock(key):
+            with self._lock:
+                session = self.sessions.get(key)
+                if session is not None:
+                    self.sessions.move_to_end(key)
+                    return session
+            
+            # Not resident: load from storage on first access (only this user waits)
+            session, journal_length = self._load_session(phone_number)
+            if session is None:
+                session = self._rehydrate_session(phone_number)
+            if session is None:
+                # Create new session
+                user_profile = UserProfile(phone_number=phone_number)
+                session = ConversationSession(
+                    user_profile=user_profile,
+                    messages=[]
+                )
+                logger.info(f"Created new session for {phone_number}")
+            
+            with self._lock:
+                self.sessions[key] = session
+            self._journal_lengths[key] = journal_length
         
-        return self.sessions[phone_number]
+        self._evict_sessions()
+        return session
+    
+    def _evict_sessions(self):
+        """Evict least recently used sessions beyond the working-set size
+
+        Sessions whose lock is held or awaited are skipped, so eviction never
+        blocks on (or pulls a session out from under) an active request.
+        """
+        with self._lock:
+            excess = len(self.sessions) - self.max_resident_sessions
+            victims = []
+            for key in self.sessions:
+                if len(victims) >= excess:
+                    break
+                if key not in self._session_locks:
+                    victims.append((key, self._register_lock(key)))
+        
+        for key, entry in victims:
+            with self._hold_lock(key, entry), self._flush_lock:
+                # Write back: fold any journal into the snapshot so the next load is one read.
+                # The flush lock also waits out a flush that has taken this session's records
+                # from the buffer but not yet written them
+                if self._journal_lengths.get(key):
+                    self._save_session(key)
+                if key in self._dirty:
+                    # Never drop a session whose changes are only in the buffer
+                    self._flush_locked()
+                with self._lock:
+                    self.sessions.pop(key, None)
+                self._journal_lengths.pop(key, None)
+            logger.debug(f"Evicted session {key} from memory")
     
     def add_message(self, phone_number: str, role: str, content: str, 
                    message_type: str = "text", metadata: Optional[Dict] = None):
         """Add message to conversation history"""
-        session = self.get_or_create_session(phone_number)
-        
-        message = ConversationMessage(
-            timestamp=datetime.now().isoformat(),
-            role=role,
-            content=content,
-            message_type=message_type,
-            metadata=metadata or {}
-        )
-        
-        session.messages.append(message)
-        session.user_profile.total_interactions += 1
-        session.user_profile.last_interaction = message.timestamp
-        
-        # Keep only recent messages
-        if len(session.messages) > self.max_messages_per_session:
-            session.messages = session.messages[-self.max_messages_per_session:]
-        
-        # Save to storage
-        self._save_session(phone_number)
-        
-        logger.debug(f"Added {role} message for {phone_number}: {content[:50]}...")
+        with self._session_lock(phone_number):
+            session = self.get_or_create_session(phone_number)
+            
+            message = ConversationMessage(
+                timestamp=datetime.now().isoformat(),
+                role=role,
+                content=content,
+                message_type=message_type,
+                metadata=metadata or {}
+            )
+            
+            self._apply_message(session, message)
+            
+            # Save to storage
+            self._append_record(phone_number, {'op': 'message', 'message': message.to_dict(),
+                                               'phone_number': session.user_profile.phone_number})
+            
+            logger.debug(f"Added {role} message for {phone_number}: {content[:50]}...")
     
     def get_conversation_context(self, phone_number: str, last_n_messages: int = 10) -> str:
-        """Get conversation context for AI prompt"""
-        session = self.get_or_create_session(phone_number)
+        """Get conversation context for AI prompt
         
-        if not session.messages:
-            return "This is a new conversation with the user."
-        
-        # Get recent messages
-        recent_messages = session.messages[-last_n_messages:]
-        
-        context_parts = [
-            f"User Profile: {session.user_profile.name or 'Unknown'} ({phone_number})",
-            f"Preferred Currency: {session.user_profile.preferred_currency}",
-            f"Total Interactions: {session.user_profile.total_interactions}",
-            f"Interests: {', '.join(session.user_profile.interests) if session.user_profile.interests else 'None yet'}",
-            "",
-            "Recent Conversation History:"
-        ]
-        
-        for msg in recent_messages:
-            timestamp = datetime.fromisoformat(msg.timestamp).strftime("%H:%M")
-            context_parts.append(f"[{timestamp}] {msg.role.upper()}: {msg.content}")
+        The rendered text is cached on the session: message lines are rendered
+        once as messages arrive, and the block is only re-joined after a change.
+        """
+        with self._session_lock(phone_number):
+            session = self.get_or_create_session(phone_number)
+            
+            if not session.messages:
+                return "This is a new conversation with the user."
+            
+            cache = session.context_cache
+            if cache is None or cache['lines'].maxlen != last_n_messages:
+                # Get recent messages
+                recent_messages = session.messages[-last_n_messages:]
+                cache = session.context_cache = {
+                    'lines': deque((self._render_context_line(msg) for msg in recent_messages),
+                                   maxlen=last_n_messages),
+                    'phone_number': None,
+                    'text': None
+                }
+            
+            if cache['text'] is None or cache['phone_number'] != phone_number:
+                context_parts = [
+                    f"User Profile: {session.user_profile.name or 'Unknown'} ({phone_number})",
+                    f"Preferred Currency: {session.user_profile.preferred_currency}",
+                    f"Total Interactions: {session.user_profile.total_interactions}",
+                    f"Interests: {', '.join(session.user_profile.interests) if session.user_profile.interests else 'None yet'}",
+                    "",
+                    "Recent Conversation History:"
+                ]
+                context_parts.extend(cache['lines'])
+                cache['phone_number'] = phone_number
+                cache['text'] = "\n".join(context_parts)
+            
+            return cache['text']
+    
+    @staticmethod
+    def _render_context_line(msg: ConversationMessage) -> str:
+        """Render one message as a context line"""
+        timestamp = msg.time.strftime("%H:%M")
+        return f"[{timestamp}] {msg.role.upper()}: {msg.content}"
+    
+    @staticmethod
+    def _invalidate_context(session: ConversationSession):
+        """Force the context block to be re-joined on next use"""
+        if session.context_cache is not None:
+            session.context_cache['text'] = None
+    
+    def get_messages_page(self, phone_number: str, before: Optional[str] = None,
+                          limit: int = 20) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Up to limit messages older than the `before` position, oldest first
+
+        A position is "<timestamp>#<n>": the n-th message (from 0) carrying
+        that timestamp, so messages sharing a timestamp are never skipped at a
+        page boundary. Returns the messages and the position to continue from
+        (None when no older messages are kept). Raises ValueError for a
+        malformed position.
+        """
+        timestamp, ordinal = None, 0
+        if before is not None:
+            timestamp, _, ordinal = before.partition('#')
+            try:
+                ordinal = int(ordinal or 0)
+            except ValueError:
+                raise ValueError("Invalid cursor")
         
-        return "\n".join(context_parts)
+        with self._session_lock(phone_number):
+            session = self.get_or_create_session(phone_number)
+            messages = session.messages
+            end = len(messages)
+            if timestamp is not None:
+                while end and messages[end - 1].timestamp > timestamp:
+                    end -= 1
+                first = end  # Start of the run of messages sharing the cursor timestamp
+                while first and messages[first - 1].timestamp == timestamp:
+                    first -= 1
+                end = min(first + ordinal, end)
+            start = max(end - limit, 0)
+            page = [msg.to_dict() for msg in messages[start:end]]
+            next_before = None
+            if start > 0:
+                first = start
+                while first and messages[first - 1].timestamp == page[0]['timestamp']:
+                    first -= 1
+                next_before = f"{page[0]['timestamp']}#{start - first}"
+        return page, next_before
     
     def update_user_preferences(self, phone_number: str, **kwargs):
         """Update user preferences"""
-        session = self.get_or_create_session(phone_number)
-        
-        for key, value in kwargs.items():
-            if hasattr(session.user_profile, key):
-                setattr(session.user_profile, key, value)
-                logger.info(f"Updated {key} for {phone_number}: {value}")
-        
-        self._save_session(phone_number)
+        with self._session_lock(phone_number):
+            session = self.get_or_create_session(phone_number)
+            
+            for key, value in kwargs.items():
+                if hasattr(session.user_profile, key):
+                    setattr(session.user_profile, key, value)
+                    logger.info(f"Updated {key} for {phone_number}: {value}")
+            
+            self._append_record(phone_number, {'op': 'profile', 'profile': session.user_profile.to_dict()})
     
     def add_user_interest(self, phone_number: str, interest: str):
         """Add user interest"""
-        session = self.get_or_create_session(phone_number)
-        
-        if interest.lower() not in [i.lower() for i in session.user_profile.interests]:
-            session.user_profile.interests.append(interest)
-            self._save_session(phone_number)
-            logger.info(f"Added interest '{interest}' for {phone_number}")
+        with self._session_lock(phone_number):
+            session = self.get_or_create_session(phone_number)
+            
+            if interest.lower() not in [i.lower() for i in session.user_profile.interests]:
+                session.user_profile.interests.append(interest)
+                self._append_record(phone_number, {'op': 'profile', 'profile': session.user_profile.to_dict()})
+                logger.info(f"Added interest '{interest}' for {phone_number}")
     
     def get_user_summary(self, phone_number: str) -> Dict[str, Any]:
         """Get user summary for analytics"""
-        session = self.get_or_create_session(phone_number)
-        
+        with self._session_lock(phone_number):
+            session = self.get_or_create_session(phone_number)
+            return self._summarize(phone_number, session)
+    
+    def _summarize(self, phone_number: str, session: ConversationSession) -> Dict[str, Any]:
+        """Build analytics summary for a session"""
+        return self._summary_row(phone_number, session.user_profile, len(session.messages), session.created_at)
+    
+    @staticmethod
+    def _summary_row(phone_number: str, profile: UserProfile, total_messages: int,
+                     created_at: Optional[str]) -> Dict[str, Any]:
         return {
             "phone_number": phone_number,
-            "name": session.user_profile.name,
-            "total_interactions": session.user_profile.total_interactions,
-            "preferred_currency": session.user_profile.preferred_currency,
-            "interests": session.user_profile.interests,
-            "last_interaction": session.user_profile.last_interaction,
-            "total_messages": len(session.messages),
-            "session_created": session.created_at
+            "name": profile.name,
+            "total_interactions": profile.total_interactions,
+            "preferred_currency": profile.preferred_currency,
+            "interests": profile.interests,
+            "last_interaction": profile.last_interaction,
+            "total_messages": total_messages,
+            "session_created": created_at
         }
     
-    def cleanup_old_sessions(self, days_old: int = 30):
-        """Clean up old inactive sessions"""
-        cutoff_date = datetime.now() - timedelta(days=days_old)
-        
-        for phone_number, session in list(self.sessions.items()):
-            if session.user_profile.last_interaction:
-                last_interaction = datetime.fromisoformat(session.user_profile.last_interaction)
-                if last_interaction < cutoff_date:
-                    # Archive or delete old session
-                    session_file = self._get_session_file(phone_number)
-                    if os.path.exists(session_file):
-                        os.remove(session_file)
-                    del self.sessions[phone_number]
-                    logger.info(f"Cleaned up old session for {phone_number}")
+    def cleanup_old_sessions(self, days_old: int = 30) -> int:
+        """Clean up old inactive sessions, returning how many were removed
+
+        With an archive configured, removed sessions are archived rather than deleted.
+        """
+        cutoff = time.time() - days_old * 86400
+        removed = 0
+        while True:
+            checked, expired = self.expire_sessions(cutoff, self.retention_batch_size)
+            removed += expired
+            if checked < self.retention_batch_size:
+                return removed
+    
+    def expire_sessions(self, cutoff: float, limit: int) -> Tuple[int, int]:
+        """Archive or delete up to limit sessions last active before cutoff (epoch seconds)
+
+        Candidates come from the expiry index, oldest first; each is re-checked
+        under its lock. Returns (candidates checked, sessions deleted).
+        """
+        self.retention.ensure_ready(self._iter_last_interactions)
+        candidates = self.retention.pop_expired(cutoff, limit)
+        expired = 0
+        for key in candidates:
+            with self._session_lock(key):
+                if key in self.retention:
+                    continue  # Active again since it was picked
+                session = self.sessions.get(key)
+                if session is None:
+                    session, _ = self._load_session(key)
+                if session is None:
+                    continue
+                last_interaction = session.user_profile.last_interaction
+                last_seen = to_seconds(last_interaction)
+                if last_seen is None or last_seen >= cutoff:
+                    # Another worker sharing the store saw this user more recently
+                    self.retention.touch(key, last_interaction)
+                    continue
+                
+                # Archive or delete old session
+                if self.archive is not None:
+                    self.archive.archive(key, self._snapshot(session))
+                self._delete_session(key)
+                expired += 1
+                logger.info(f"Cleaned up old session for {session.user_profile.phone_number}")
+        return len(candidates), expired
+    
+    def _delete_session(self, key: str):
+        """Remove a session from storage, the working set and the indexes (caller holds its lock)"""
+        with self._flush_lock:
+            # Holding the flush lock means no in-flight flush can resurrect the session
+            with self._buffer_lock:
+                self._dirty_count -= len(self._dirty.pop(key, []))
+            self.storage.delete(key)
+        with self._lock:
+            self.sessions.pop(key, None)
+        self._journal_lengths.pop(key, None)
+        self.analytics.remove(key)
+        self.retention.remove(key)
+    
+    def _iter_last_interactions(self) -> Iterator[Tuple[str, Optional[str]]]:
+        for key, session in self._iter_all_sessions():
+            yield key, session.user_profile.last_interaction
     
     def get_all_users_summary(self) -> List[Dict[str, Any]]:
         """Get summary of all users"""
-        return [self.get_user_summary(phone) for phone in self.sessions.keys()]
+        return [self._summarize(session.user_profile.phone_number, session)
+                for _, session in self._iter_all_sessions()]
+    
+    def get_users_analytics(self) -> Dict[str, Any]:
+        """Users plus aggregate analytics, served from the incrementally maintained index"""
+        analytics = self.get_analytics_summary()
+        analytics["users"] = self.analytics.users()
+        return analytics
+    
+    def get_analytics_summary(self) -> Dict[str, Any]:
+        """Aggregate analytics without the per-user rows"""
+        self.analytics.ensure_ready(self._iter_summaries)
+        summary = self.analytics.summary()
+        return {"total_users": summary.pop("total_users"), "summary": summary}
+    
+    def get_users_page(self, after: Optional[str] = None,
+                       limit: int = 100) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """One page of user summaries ordered by session key, plus the key to continue after"""
+        self.analytics.ensure_ready(self._iter_summaries)
+        return self.analytics.page(after, limit)
+    
+    def _iter_summaries(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        if self.storage.shared:
+            # Periodic refresh: profile hashes and list lengths only, never the message histories
+            for key, snapshot in self.storage.iter_profiles():
+                profile = UserProfile.from_dict(snapshot['user_profile'])
+                total_messages = min(snapshot['message_count'], self.max_messages_per_session)
+                yield key, self._summary_row(profile.phone_number, profile, total_messages, snapshot['created_at'])
+            return
+        for key, session in self._iter_all_sessions():
+            yield key, self._summarize(session.user_profile.phone_number, session)
+    
+    def iter_snapshots(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Yield (session key, snapshot dict) for every session, e.g. for migration"""
+        for key, session in self._iter_all_sessions():
+            yield key, self._snapshot(session)
+    
+    def close(self):
+        """Flush buffered changes, write back journaled sessions and release the storage backend"""
+        if self._sweeper is not None:
+            self._sweeper.stop()
+        with self._buffer_lock:
+            self._closed = True
+            self._flush_wakeup.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+        self.flush()
+        with self._lock:
+            resident = list(self.sessions)
+        for key in resident:
+            with self._session_lock(key):
+                if self._journal_lengths.get(key):
+                    self._save_session(key)
+        self.storage.close()
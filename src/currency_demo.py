@@ -9,7 +9,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from sales_agent import CurrencyConverter
+from agent_core import CurrencyConverter
 
 def main():
     print("🚀 Currency Conversion Demo")
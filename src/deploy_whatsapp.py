@@ -55,7 +55,7 @@ def test_sales_agent():
     print("\n🤖 Testing Sales Agent...")
     
     try:
-        from sales_agent import get_sales_agent
+        from agent_core import get_sales_agent
         agent = get_sales_agent()
         print("✅ Sales Agent loaded successfully")
         return True
@@ -0,0 +1,140 @@
+"""
+In-process stand-in for the Redis commands used by the session store
+Lets the Redis storage backend run in tests and local development without a server
+"""
+import threading
+from typing import Any, Dict, List, Optional
+
+
+class FakeRedis:
+    """Thread-safe, dict-backed subset of the redis-py client API
+
+    Values are returned as str, like a client created with decode_responses=True.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._lock = threading.RLock()
+
+    # Hashes
+
+    def hset(self, name: str, key: Optional[str] = None, value: Any = None,
+             mapping: Optional[Dict[str, Any]] = None) -> int:
+        with self._lock:
+            hash_ = self._data.setdefault(name, {})
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = sum(1 for field in items if field not in hash_)
+            hash_.update({field: str(v) for field, v in items.items()})
+            return added
+
+    def hsetnx(self, name: str, key: str, value: Any) -> int:
+        with self._lock:
+            hash_ = self._data.setdefault(name, {})
+            if key in hash_:
+                return 0
+            hash_[key] = str(value)
+            return 1
+
+    def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        with self._lock:
+            hash_ = self._data.setdefault(name, {})
+            value = int(hash_.get(key, 0)) + amount
+            hash_[key] = str(value)
+            return value
+
+    def hgetall(self, name: str) -> Dict[str, str]:
+        with self._lock:
+            return dict(self._data.get(name, {}))
+
+    # Lists
+
+    def rpush(self, name: str, *values: Any) -> int:
+        with self._lock:
+            list_ = self._data.setdefault(name, [])
+            list_.extend(str(v) for v in values)
+            return len(list_)
+
+    def llen(self, name: str) -> int:
+        with self._lock:
+            return len(self._data.get(name, []))
+
+    def ltrim(self, name: str, start: int, end: int) -> bool:
+        with self._lock:
+            if name in self._data:
+                self._data[name] = self._data[name][self._slice(len(self._data[name]), start, end)]
+            return True
+
+    def lrange(self, name: str, start: int, end: int) -> List[str]:
+        with self._lock:
+            list_ = self._data.get(name, [])
+            return list_[self._slice(len(list_), start, end)]
+
+    @staticmethod
+    def _slice(length: int, start: int, end: int) -> slice:
+        """Redis ranges are inclusive and accept negative indexes"""
+        if start < 0:
+            start = max(length + start, 0)
+        if end < 0:
+            end = length + end
+        return slice(start, end + 1)
+
+    # Sorted sets (scores are kept but ordering is lexicographic, as used here)
+
+    def zadd(self, name: str, mapping: Dict[str, float]) -> int:
+        with self._lock:
+            zset = self._data.setdefault(name, {})
+            added = sum(1 for member in mapping if member not in zset)
+            zset.update(mapping)
+            return added
+
+    def zrem(self, name: str, *members: str) -> int:
+        with self._lock:
+            zset = self._data.get(name, {})
+            return sum(1 for member in members if zset.pop(member, None) is not None)
+
+    def zrange(self, name: str, start: int, end: int) -> List[str]:
+        with self._lock:
+            members = sorted(self._data.get(name, {}))
+            return members[self._slice(len(members), start, end)]
+
+    # Keys
+
+    def delete(self, *names: str) -> int:
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def pipeline(self, transaction: bool = True) -> "FakePipeline":
+        return FakePipeline(self)
+
+    def close(self):
+        pass
+
+
+class FakePipeline:
+    """Buffers commands and runs them atomically on execute()"""
+
+    def __init__(self, client: FakeRedis):
+        self._client = client
+        self._commands: List[Any] = []
+
+    def __getattr__(self, name: str):
+        method = getattr(self._client, name)
+
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self) -> List[Any]:
+        with self._client._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._commands]
+        self._commands = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._commands = []
@@ -0,0 +1,41 @@
+"""
+Deferred imports for heavy optional dependencies
+A module lists names it wants from other packages; each is imported the first time it is used
+"""
+import importlib
+import sys
+import threading
+from typing import Any, Callable, Dict, List
+
+_lock = threading.RLock()
+
+
+def lazy_attributes(module_name: str, targets: Dict[str, str]) -> Callable[[str], Any]:
+    """Build a module-level __getattr__ (PEP 562) resolving names on first access
+
+    targets maps an attribute name to "package.module:attribute". The
+    resolved object is stored in the module's globals, so later lookups are
+    plain attribute reads and unittest.mock.patch works as usual. Code in
+    the module itself should read the names through its module object
+    (sys.modules[__name__].Name), since bare global lookups bypass __getattr__.
+    """
+    def __getattr__(name: str) -> Any:
+        target = targets.get(name)
+        if target is None:
+            raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+        namespace = vars(sys.modules[module_name])
+        with _lock:
+            if name not in namespace:
+                source, _, attribute = target.partition(":")
+                namespace[name] = getattr(importlib.import_module(source), attribute)
+        return namespace[name]
+
+    return __getattr__
+
+
+def lazy_dir(module_name: str, targets: Dict[str, str]) -> Callable[[], List[str]]:
+    """Module-level __dir__ that lists lazy names alongside loaded ones"""
+    def __dir__() -> List[str]:
+        return sorted(set(vars(sys.modules[module_name])) | set(targets))
+
+    return __dir__
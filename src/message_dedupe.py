@@ -0,0 +1,110 @@
+"""
+Idempotent webhook handling for WhatsApp Sales Agent
+Remembers processed WhatsApp message IDs so Meta redeliveries are ignored
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteDedupeStore:
+    """Persistent message-ID index shared across restarts and worker processes"""
+
+    PURGE_EVERY = 1000  # Inserts between sweeps of expired rows
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._inserts = 0
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS processed_messages ("
+            "message_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def mark_if_new(self, message_id: str, ttl_seconds: float) -> bool:
+        """Record message ID; return False if it was already recorded and unexpired"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM processed_messages WHERE message_id = ? AND seen_at < ?",
+                (message_id, now - ttl_seconds)
+            )
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO processed_messages (message_id, seen_at) VALUES (?, ?)",
+                (message_id, now)
+            )
+            is_new = cursor.rowcount == 1
+
+            self._inserts += 1
+            if self._inserts % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM processed_messages WHERE seen_at < ?", (now - ttl_seconds,))
+
+        return is_new
+
+    def forget(self, message_id: str):
+        """Remove a message ID so a redelivery is processed again"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM processed_messages WHERE message_id = ?", (message_id,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class MessageDeduplicator:
+    """Bounded, time-expiring index of processed WhatsApp message IDs
+
+    Lookups hit an in-memory LRU first; the optional persistent store
+    catches duplicates seen by another worker process or before a restart.
+    """
+
+    def __init__(self, ttl_seconds: float = 86400, max_entries: int = 100000,
+                 store: Optional[SQLiteDedupeStore] = None):
+        self.ttl_seconds = ttl_seconds
+        self.store = store
+        self._seen = TTLCache(ttl_seconds=ttl_seconds, max_entries=max_entries)
+        self._lock = threading.Lock()
+        self.duplicates = 0
+
+    def check_and_mark(self, message_id: str) -> bool:
+        """Return True the first time a message ID is seen, False for duplicates"""
+        with self._lock:
+            if message_id in self._seen:
+                self.duplicates += 1
+                return False
+
+            is_new = True
+            if self.store is not None:
+                try:
+                    is_new = self.store.mark_if_new(message_id, self.ttl_seconds)
+                except sqlite3.Error as e:
+                    # Fall back to in-memory dedupe rather than dropping the message
+                    logger.error(f"Dedupe store error for {message_id}: {e}")
+
+            self._seen.set(message_id, True)
+            if not is_new:
+                self.duplicates += 1
+            return is_new
+
+    def forget(self, message_id: str):
+        """Unmark a message ID (e.g. when it could not be queued)"""
+        with self._lock:
+            self._seen.invalidate(message_id)
+            if self.store is not None:
+                try:
+                    self.store.forget(message_id)
+                except sqlite3.Error as e:
+                    logger.error(f"Dedupe store error for {message_id}: {e}")
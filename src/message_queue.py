@@ -0,0 +1,129 @@
+"""
+Background processing queue for inbound WhatsApp messages
+Lets the webhook acknowledge Meta immediately while workers generate and send replies
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MessageWorkerPool:
+    """Fixed pool of worker threads draining per-user message lanes
+
+    Each phone number gets its own FIFO lane. Different users are processed
+    in parallel, but a lane is only ever held by one worker at a time, so
+    messages from the same user are handled strictly in arrival order.
+    """
+
+    def __init__(self, handler: Callable[[str, str], None], num_workers: int = 4,
+                 max_queue_size: int = 0):
+        self.handler = handler
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self._lanes: Dict[str, Deque[str]] = {}  # Lanes that are queued or being processed
+        self._ready: "queue.Queue" = queue.Queue()  # Phone numbers whose lane has work
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._workers: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """Start worker threads (called lazily on first submit)"""
+        with self._start_lock:
+            if self._workers or self.num_workers <= 0:
+                return
+            for i in range(self.num_workers):
+                worker = threading.Thread(target=self._run, name=f"message-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+            logger.info(f"Started {self.num_workers} message workers")
+
+    def submit(self, phone_number: str, message: str):
+        """Queue a message for background processing
+
+        Raises queue.Full if the queue is bounded and saturated.
+        With num_workers=0 the handler runs inline (useful for debugging).
+        """
+        if self.num_workers <= 0:
+            self._handle(phone_number, message)
+            return
+
+        if not self._workers:
+            self.start()
+
+        with self._lock:
+            if self.max_queue_size > 0 and self._pending >= self.max_queue_size:
+                raise queue.Full
+            self._pending += 1
+
+            lane = self._lanes.get(phone_number)
+            if lane is None:
+                self._lanes[phone_number] = deque([message])
+                self._ready.put(phone_number)
+            else:
+                # Lane already scheduled; its worker will pick this up in order
+                lane.append(message)
+
+    def pending(self) -> int:
+        """Number of queued or in-progress messages"""
+        return self._pending
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """Wait until every submitted message has been handled
+
+        Returns False if the timeout expired first.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def shutdown(self, wait: bool = True, timeout: Optional[float] = None):
+        """Stop workers, optionally draining queued messages first"""
+        if wait:
+            self.join(timeout)
+        for _ in self._workers:
+            self._ready.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
+        self._workers = []
+
+    def _run(self):
+        """Worker loop: take one message from a ready lane, then requeue the lane"""
+        while True:
+            phone_number = self._ready.get()
+            if phone_number is None:
+                return
+
+            with self._lock:
+                message = self._lanes[phone_number].popleft()
+
+            try:
+                self._handle(phone_number, message)
+            finally:
+                with self._lock:
+                    if self._lanes[phone_number]:
+                        # Back of the ready queue so one busy user can't starve the others
+                        self._ready.put(phone_number)
+                    else:
+                        del self._lanes[phone_number]
+                    self._pending -= 1
+                    if not self._pending:
+                        self._idle.notify_all()
+
+    def _handle(self, phone_number: str, message: str):
+        """Run the handler, never letting one failure kill the worker"""
+        try:
+            self.handler(phone_number, message)
+        except Exception as e:
+            logger.error(f"Error processing queued message from {phone_number}: {str(e)}")
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Conversation Session Migration Tool
+Imports file-based sessions (data/conversations/session_*.json + journals) into SQLite
+"""
+import argparse
+import os
+import sys
+
+from conversation_memory import ConversationMemory
+from session_storage import JsonFileStorage, SQLiteStorage, MEMORY_SQLITE_PATH
+
+
+def migrate(source_dir: str, db_path: str, batch_size: int = 500) -> int:
+    """Copy every session from source_dir into the SQLite database at db_path
+
+    Journals are replayed before import, so each user lands as one consistent
+    snapshot. Sessions are written batch_size at a time, one transaction per
+    batch. Returns the number of sessions migrated.
+    """
+    # Read-only pass over the source: no retention sweeper or write-behind flusher
+    source = ConversationMemory(storage=JsonFileStorage(source_dir), max_resident_sessions=0,
+                                retention_days=0, flush_interval=0)
+    target = SQLiteStorage(db_path)
+
+    migrated = 0
+    batch = []
+    try:
+        for key, snapshot in source.iter_snapshots():
+            batch.append((key, snapshot))
+            if len(batch) >= batch_size:
+                target.save_many(batch)
+                migrated += len(batch)
+                batch = []
+        if batch:
+            target.save_many(batch)
+            migrated += len(batch)
+    finally:
+        source.close()
+        target.close()
+
+    return migrated
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import JSON conversation sessions into SQLite")
+    parser.add_argument("--source", default="data/conversations",
+                        help="Directory containing session_*.json files")
+    parser.add_argument("--target", default=None,
+                        help="SQLite database path (default: MEMORY_SQLITE_PATH or <source>/sessions.db)")
+    parser.add_argument("--batch-size", type=int, default=500,
+                        help="Sessions written per transaction")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.source):
+        print(f"❌ Source directory not found: {args.source}")
+        return 1
+
+    target = args.target or MEMORY_SQLITE_PATH or os.path.join(args.source, "sessions.db")
+    print(f"📦 Migrating sessions from {args.source} to {target}...")
+    count = migrate(args.source, target, args.batch_size)
+    print(f"✅ Migrated {count} sessions")
+    print("   Set MEMORY_BACKEND=sqlite (and MEMORY_SQLITE_PATH if needed) to use the database")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
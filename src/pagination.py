@@ -0,0 +1,85 @@
+"""
+Cursor pagination, field selection and NDJSON streaming for list endpoints
+Keeps response time and memory proportional to the page, not the data set
+"""
+import base64
+import binascii
+import json
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+FORMATS = ("json", "ndjson")
+
+
+class PageRequest:
+    """Validated ?cursor=&limit=&fields=&format= query parameters"""
+
+    def __init__(self, cursor: Optional[str], limit: Optional[int], fields: Optional[List[str]], format: str):
+        self.cursor = cursor
+        self.limit = limit
+        self.fields = fields
+        self.format = format
+
+    @property
+    def streamed(self) -> bool:
+        return self.format == "ndjson"
+
+    @classmethod
+    def from_args(cls, args, default_limit: int, max_limit: int, allowed_fields: Iterable[str],
+                  unbounded_stream: bool = False) -> "PageRequest":
+        """Parse request.args, raising ValueError with a client-facing message
+
+        With unbounded_stream, format=ndjson and no limit means "everything
+        from the cursor on", streamed in chunks of max_limit.
+        """
+        format = args.get("format", "json")
+        if format not in FORMATS:
+            raise ValueError(f"format must be one of: {', '.join(FORMATS)}")
+
+        limit = args.get("limit")
+        if limit is None:
+            limit = None if unbounded_stream and format == "ndjson" else default_limit
+        else:
+            try:
+                limit = int(limit)
+            except ValueError:
+                raise ValueError("limit must be an integer")
+            if not 1 <= limit <= max_limit:
+                raise ValueError(f"limit must be between 1 and {max_limit}")
+
+        fields = None
+        if args.get("fields"):
+            fields = [name.strip() for name in args["fields"].split(",") if name.strip()]
+            unknown = sorted(set(fields) - set(allowed_fields))
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+        return cls(decode_cursor(args.get("cursor")), limit, fields, format)
+
+    def select(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        if self.fields is None:
+            return row
+        return {name: row.get(name) for name in self.fields}
+
+
+def encode_cursor(position: Optional[str]) -> Optional[str]:
+    """Opaque, URL-safe cursor for a position (None at the end of the data)"""
+    if position is None:
+        return None
+    return base64.urlsafe_b64encode(position.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[str]:
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return base64.b64decode(padded, altchars=b"-_", validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def ndjson_lines(rows: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """One compact JSON document per line"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n"
@@ -0,0 +1,123 @@
+"""
+Response cache for repeated customer questions
+Identical FAQs from different customers are answered from memory instead of another LLM round trip
+"""
+import os
+import re
+import unicodedata
+from typing import Any, Dict, Hashable, Iterable, Optional
+
+from ttl_cache import TTLCache
+
+# Cached replies live this long (0 disables the cache) and at most this many are kept
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', 300))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+
+# Replies to these message types depend on who is asking (e.g. greetings welcome users back by name)
+BYPASS_MESSAGE_TYPES = frozenset({"greeting"})
+
+# Questions whose answer depends on this user's history or on the moment they are asked
+PERSONAL_PATTERN = re.compile(
+    r"\b(my|mine|im|i am|ive|i have|call me|remember|last time|earlier|before|again|you said|previous)\b"
+)
+TIME_SENSITIVE_PATTERN = re.compile(r"\b(today|tonight|tomorrow|yesterday|right now|this week|news)\b")
+# Follow-ups only make sense with the conversation so far ("yes", "the first one", "tell me more")
+FOLLOW_UP_PATTERN = re.compile(
+    r"\b(it|that|those|these|them|this one|the first|the second|the last|same|more|yes|no|ok|okay|sure)\b"
+)
+MIN_CACHEABLE_WORDS = 3
+
+_PUNCTUATION = re.compile(r"[^\w\s$€£¥₹.]|(?<!\d)\.|\.(?!\d)")
+_APOSTROPHES = re.compile(r"['’]")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(message: str) -> str:
+    """Canonical form of a question: case, width, punctuation and spacing folded
+
+    Decimal points inside numbers and currency symbols are kept, since
+    "1.5 USD" and "15 USD" are different questions.
+    """
+    text = unicodedata.normalize("NFKC", message).casefold()
+    text = _APOSTROPHES.sub("", text)  # "what's" -> "whats", "I'm" -> "im"
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+class ResponseCache:
+    """TTL- and size-bounded cache of formatted replies
+
+    Keys combine the normalized question with the profile fields that shape
+    the answer (preferred currency and interests), so users with different
+    preferences never share a reply.
+    """
+
+    def __init__(self, ttl_seconds: float = RESPONSE_CACHE_TTL_SECONDS,
+                 max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.enabled = ttl_seconds > 0
+        self.cache = TTLCache(ttl_seconds=ttl_seconds, max_entries=max(max_entries, 1))
+        self.bypassed = 0
+        self.rejected = 0
+
+    @staticmethod
+    def make_key(message: str, preferred_currency: Optional[str] = None,
+                 interests: Iterable[str] = ()) -> Hashable:
+        return (
+            normalize_prompt(message),
+            (preferred_currency or "").upper(),
+            tuple(sorted({interest.casefold() for interest in interests or ()}))
+        )
+
+    def bypass_reason(self, message: str, message_type: str = "general") -> Optional[str]:
+        """Why this message must go to the model (None if it may be served from cache)"""
+        if not self.enabled:
+            return "disabled"
+        return self.uncacheable_reason(message, message_type)
+
+    @staticmethod
+    def uncacheable_reason(message: str, message_type: str = "general") -> Optional[str]:
+        """Why no other customer may share this message's reply (None if one may), cache on or off"""
+        if message_type in BYPASS_MESSAGE_TYPES:
+            return message_type
+        normalized = normalize_prompt(message)
+        if len(normalized.split()) < MIN_CACHEABLE_WORDS:
+            return "follow_up"
+        if PERSONAL_PATTERN.search(normalized):
+            return "personal"
+        if TIME_SENSITIVE_PATTERN.search(normalized):
+            return "time_sensitive"
+        if FOLLOW_UP_PATTERN.search(normalized):
+            return "follow_up"
+        return None
+
+    def get(self, key: Hashable) -> Optional[str]:
+        if not self.enabled:
+            return None
+        return self.cache.get(key)
+
+    def store(self, key: Hashable, response: str, profile: Optional[Dict[str, Any]] = None) -> bool:
+        """Cache a reply unless it mentions the user it was written for
+
+        Returns whether the reply may be shared with other customers, which
+        is checked even when the cache is disabled.
+        """
+        profile = profile or {}
+        folded = response.casefold()
+        for identifier in (profile.get("name"), profile.get("phone_number")):
+            if identifier and str(identifier).casefold() in folded:
+                self.rejected += 1
+                return False
+        if self.enabled:
+            self.cache.set(key, response)
+        return True
+
+    def note_bypass(self):
+        self.bypassed += 1
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self) -> Dict[str, int]:
+        stats = self.cache.stats()
+        stats.update(bypassed=self.bypassed, rejected=self.rejected)
+        return stats
@@ -0,0 +1,126 @@
+"""
+Session retention: an expiry index ordered by last interaction, and a background sweeper
+Finding stale sessions costs O(expired log n) instead of a scan over every session
+"""
+import heapq
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from analytics_index import to_seconds
+
+logger = logging.getLogger(__name__)
+
+
+class ExpiryIndex:
+    """Min-heap of (last interaction, session key) with lazy deletion
+
+    touch() pushes a new entry and leaves the old one in place; entries that
+    no longer match a key's latest time are skipped when popped. The heap is
+    rebuilt once stale entries outnumber live ones.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._heap: List[Tuple[float, str]] = []
+        self._latest: Dict[str, float] = {}
+        self._ready = False
+
+    @property
+    def ready(self) -> bool:
+        return self._ready
+
+    def __len__(self) -> int:
+        return len(self._latest)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._latest
+
+    def touch(self, key: str, last_interaction: Optional[str]):
+        """Record a session's latest interaction (ISO timestamp)"""
+        seen = to_seconds(last_interaction)
+        if seen is None:
+            return
+        with self._lock:
+            if self._latest.get(key) == seen:
+                return
+            self._latest[key] = seen
+            heapq.heappush(self._heap, (seen, key))
+            if len(self._heap) > 2 * len(self._latest) + 64:
+                self._compact()
+
+    def remove(self, key: str):
+        with self._lock:
+            self._latest.pop(key, None)
+
+    def _compact(self):
+        """Drop stale heap entries (caller holds self._lock)"""
+        self._heap = [(seen, key) for key, seen in self._latest.items()]
+        heapq.heapify(self._heap)
+
+    def pop_expired(self, cutoff: float, limit: int) -> List[str]:
+        """Remove and return up to limit keys last seen before cutoff, oldest first"""
+        expired = []
+        with self._lock:
+            while self._heap and len(expired) < limit and self._heap[0][0] < cutoff:
+                seen, key = heapq.heappop(self._heap)
+                if self._latest.get(key) == seen:
+                    del self._latest[key]
+                    expired.append(key)
+        return expired
+
+    def ensure_ready(self, rows: Callable[[], Iterable[Tuple[str, Optional[str]]]]):
+        """Seed from (key, last_interaction) pairs once, e.g. a walk over the session store"""
+        if self._ready:
+            return
+        for key, last_interaction in rows():
+            self.touch(key, last_interaction)
+        self._ready = True
+
+
+class RetentionSweeper:
+    """Background thread expiring sessions older than max_age_days in small batches
+
+    The first sweep runs one interval after start(), so startup is not slowed
+    by seeding the expiry index.
+    """
+
+    def __init__(self, expire: Callable[[float, int], Tuple[int, int]], max_age_days: float,
+                 interval: float = 3600, batch_size: int = 100):
+        self.expire = expire  # (cutoff epoch seconds, batch size) -> (candidates checked, sessions expired)
+        self.max_age_days = max_age_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="retention-sweeper", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {e}")
+
+    def sweep(self) -> int:
+        """Expire everything past the cutoff, one batch at a time"""
+        cutoff = time.time() - self.max_age_days * 86400
+        total = 0
+        while not self._stop.is_set():
+            checked, expired = self.expire(cutoff, self.batch_size)
+            total += expired
+            if checked < self.batch_size:
+                break
+        if total:
+            logger.info(f"Retention sweep expired {total} sessions")
+        return total
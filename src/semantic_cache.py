@@ -0,0 +1,286 @@
+"""
+Semantic cache for paraphrased customer questions
+Questions are embedded with a hashed n-gram vectorizer and matched against past answers by cosine similarity
+"""
+import os
+import re
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, Dict, Hashable, List, Optional
+
+from response_cache import normalize_prompt
+
+# Reuse a past answer when its question is at least this similar (cosine, 0-1); a TTL of 0 disables the cache
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv('SEMANTIC_CACHE_THRESHOLD', 0.82))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv('SEMANTIC_CACHE_TTL_SECONDS', 3600))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv('SEMANTIC_CACHE_MAX_ENTRIES', 2000))
+SEMANTIC_CACHE_DIMENSIONS = int(os.getenv('SEMANTIC_CACHE_DIMENSIONS', 2048))
+
+# Words that carry no meaning for matching ("what is the price of a laptop" ~ "laptop price")
+STOPWORDS = frozenset(
+    "a an and are can could do does for from have how i in is me of on or please the to "
+    "what whats which would you your".split()
+)
+# Word variants that still count as the same word ("laptop" ~ "laptops", "price" ~ "prices")
+_MAX_SUFFIX_LENGTH = 2
+_MIN_STEM_LENGTH = 4
+# Amounts are never paraphrases of each other: "100 USD to EUR" must not answer "200 USD to EUR"
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_INITIAL_ROWS = 64
+
+
+class LatencyStats:
+    """Rolling latency samples summarised as count, mean and percentiles (milliseconds)"""
+
+    def __init__(self, window: int = 1000):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds * 1000)
+            self.count += 1
+
+    def summary(self) -> Dict[str, float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return {"count": self.count, "avg": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+        return {
+            "count": self.count,
+            "avg": round(sum(samples) / len(samples), 3),
+            "p50": round(samples[(len(samples) - 1) // 2], 3),
+            "p95": round(samples[int(0.95 * (len(samples) - 1))], 3),
+            "max": round(samples[-1], 3),
+        }
+
+
+class HashedNgramVectorizer:
+    """Stateless text embedding: word, word-pair and character n-gram counts hashed into a fixed-size vector
+
+    Needs no model download or training, so every process embeds the same
+    text identically. Character n-grams make typos and inflections
+    ("laptops", "lapto") land close to the original word; word pairs keep
+    some order ("usd eur" vs "eur usd").
+    """
+
+    def __init__(self, dimensions: int = SEMANTIC_CACHE_DIMENSIONS, ngram_sizes=(3, 4, 5)):
+        self.dimensions = dimensions
+        self.ngram_sizes = tuple(ngram_sizes)
+
+    @staticmethod
+    def words(text: str) -> List[str]:
+        """Content words of a question, in order"""
+        return [word for word in normalize_prompt(text).split() if word not in STOPWORDS]
+
+    def features(self, text: str) -> List[str]:
+        words = self.words(text)
+        features = [f"w:{word}" for word in words]
+        features.extend(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+        for word in words:
+            padded = f" {word} "
+            for size in self.ngram_sizes:
+                features.extend(padded[i:i + size] for i in range(len(padded) - size + 1))
+        return features
+
+    def transform(self, text: str):
+        """Unit-length float32 vector (all zeros when the text has no features)"""
+        import numpy as np
+
+        hashes = np.fromiter((zlib.crc32(feature.encode("utf-8")) for feature in self.features(text)),
+                             dtype=np.uint32)
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        # The top hash bit picks a sign so colliding features tend to cancel rather than add up
+        signs = np.where(hashes >> 31, -1.0, 1.0).astype(np.float32)
+        np.add.at(vector, hashes % self.dimensions, signs)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def _same_word(first: str, second: str) -> bool:
+    if first == second:
+        return True
+    shorter, longer = sorted((first, second), key=len)
+    return (len(shorter) >= _MIN_STEM_LENGTH and len(longer) - len(shorter) <= _MAX_SUFFIX_LENGTH
+            and longer.startswith(shorter))
+
+
+def same_content_words(first: frozenset, second: frozenset) -> bool:
+    """True when every content word of each question has a match in the other
+
+    Similar vectors are not enough: "macbook pro" and "macbook air", or
+    "iphone 15" and "iphone 15 pro", differ by the one word that names
+    the product.
+    """
+    return (all(any(_same_word(word, other) for other in second) for word in first - second)
+            and all(any(_same_word(word, other) for other in first) for word in second - first))
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of answered questions, scoped by who is asking
+
+    Embeddings live in one NumPy matrix, so a lookup is a single
+    matrix-vector product over every cached question. Matches only count
+    within the same scope (the caller's profile and extracted currencies
+    and products), with the same numbers in the question, and when neither
+    question has a content word the other lacks. When the index
+    is full, the entry closest to expiry is replaced. NumPy is imported on
+    first use.
+    """
+
+    def __init__(self, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS,
+                 max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+                 vectorizer: Optional[HashedNgramVectorizer] = None,
+                 clock=time.monotonic):
+        self.enabled = ttl_seconds > 0 and threshold <= 1
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(max_entries, 1)
+        self.vectorizer = vectorizer or HashedNgramVectorizer()
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._scope_ids: Dict[Hashable, int] = {}
+        self._next_scope_id = 0
+        self._vectors = None  # (rows, dimensions) float32, allocated on first store
+        self._scopes = None  # Scope id per row
+        self._expires = None  # Monotonic expiry time per row
+        self._answers: List[str] = []
+        self._words: List[frozenset] = []  # Content words of the question per row
+        self._size = 0
+        self.latency = LatencyStats()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.refreshed = 0
+        self.evictions = 0
+
+    def _scope_id(self, message: str, scope: Hashable, create: bool) -> Optional[int]:
+        """Id for a scope plus the numbers in the message (caller holds self._lock)"""
+        key = (scope, tuple(_NUMBER.findall(normalize_prompt(message))))
+        scope_id = self._scope_ids.get(key)
+        if scope_id is None and create:
+            if len(self._scope_ids) >= 2 * self.max_entries:
+                self._prune_scopes()
+            scope_id = self._scope_ids[key] = self._next_scope_id
+            self._next_scope_id += 1
+        return scope_id
+
+    def _prune_scopes(self):
+        """Forget scopes no cached row uses any more (caller holds self._lock)"""
+        used = set(self._scopes[:self._size].tolist()) if self._size else set()
+        self._scope_ids = {key: scope_id for key, scope_id in self._scope_ids.items() if scope_id in used}
+
+    def _nearest(self, vector, words: frozenset, scope_id: int, now: float) -> Optional[int]:
+        """Row of the most similar live match in scope with the same content words,
+        if similar enough (caller holds self._lock)"""
+        import numpy as np
+
+        if not self._size or not vector.any():
+            return None
+        rows = slice(0, self._size)
+        scores = self._vectors[rows] @ vector
+        live = (self._scopes[rows] == scope_id) & (self._expires[rows] > now)
+        candidates = np.flatnonzero(live & (scores >= self.threshold))
+        for row in candidates[np.argsort(-scores[candidates], kind="stable")]:
+            if same_content_words(words, self._words[row]):
+                return int(row)
+        return None
+
+    def lookup(self, message: str, scope: Hashable = ()) -> Optional[str]:
+        """Cached answer to the closest past question in scope, if similar enough"""
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        vector = self.vectorizer.transform(message)
+        words = frozenset(self.vectorizer.words(message))
+        answer = None
+        with self._lock:
+            scope_id = self._scope_id(message, scope, create=False)
+            if scope_id is not None:
+                row = self._nearest(vector, words, scope_id, self._clock())
+                if row is not None:
+                    answer = self._answers[row]
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        self.latency.record(time.perf_counter() - started)
+        return answer
+
+    def store(self, message: str, answer: str, scope: Hashable = ()):
+        """Index an answered question; a near-duplicate of an existing entry refreshes it instead"""
+        if not self.enabled:
+            return
+        vector = self.vectorizer.transform(message)
+        if not vector.any():
+            return
+        words = frozenset(self.vectorizer.words(message))
+        with self._lock:
+            now = self._clock()
+            scope_id = self._scope_id(message, scope, create=True)
+            row = self._nearest(vector, words, scope_id, now)
+            if row is not None:
+                self.refreshed += 1
+            else:
+                row = self._free_row(now)
+                self._vectors[row] = vector
+                self._scopes[row] = scope_id
+                self._words[row] = words
+                self.stores += 1
+            self._answers[row] = answer
+            self._expires[row] = now + self.ttl_seconds
+
+    def _free_row(self, now: float) -> int:
+        """Row for a new entry: append, growing the matrix, or replace the entry closest to expiry"""
+        import numpy as np
+
+        if self._vectors is None:
+            rows = min(_INITIAL_ROWS, self.max_entries)
+            self._vectors = np.zeros((rows, self.vectorizer.dimensions), dtype=np.float32)
+            self._scopes = np.full(rows, -1, dtype=np.int64)
+            self._expires = np.zeros(rows, dtype=np.float64)
+        if self._size < self.max_entries:
+            if self._size == len(self._vectors):
+                rows = min(2 * len(self._vectors), self.max_entries)
+                self._vectors = np.resize(self._vectors, (rows, self._vectors.shape[1]))
+                self._scopes = np.resize(self._scopes, rows)
+                self._expires = np.resize(self._expires, rows)
+            self._answers.append("")
+            self._words.append(frozenset())
+            self._size += 1
+            return self._size - 1
+        row = int(np.argmin(self._expires[:self._size]))
+        if self._expires[row] > now:
+            self.evictions += 1
+        return row
+
+    def clear(self):
+        with self._lock:
+            self._scope_ids.clear()
+            self._vectors = self._scopes = self._expires = None
+            self._answers = []
+            self._words = []
+            self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": self._size,
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "lookups": lookups,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "stores": self.stores,
+            "refreshed": self.refreshed,
+            "evictions": self.evictions,
+            "lookup_latency_ms": self.latency.summary(),
+        }
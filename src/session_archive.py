@@ -0,0 +1,125 @@
+"""
+Cold-storage archive for inactive conversation sessions
+Sessions are appended to one compressed segment file per day and found again through an index by phone key
+"""
+import gzip
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+import session_codec
+
+logger = logging.getLogger(__name__)
+
+# Archive directory; when unset, expired sessions are deleted instead of archived
+MEMORY_ARCHIVE_DIR = os.getenv('MEMORY_ARCHIVE_DIR')
+
+
+class SessionArchive:
+    """Append-only, gzip-compressed session segments with an index by session key
+
+    Each archived session is one gzip member (a session_codec snapshot)
+    appended to sessions-YYYY-MM-DD.gz, so segments are never rewritten and
+    any entry can be read back with a single seek. index.jsonl records
+    where each key's latest copy lives, or a tombstone once the session has
+    been restored to the hot store; the last line for a key wins.
+    """
+
+    def __init__(self, archive_dir: str):
+        self.archive_dir = archive_dir
+        os.makedirs(archive_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._index: Dict[str, Tuple[str, int, int]] = {}  # key -> (segment, offset, length)
+        self._index_lines = 0
+        self._load_index()
+
+    def _index_file(self) -> str:
+        return os.path.join(self.archive_dir, "index.jsonl")
+
+    def _segment_file(self, segment: str) -> str:
+        return os.path.join(self.archive_dir, segment)
+
+    def _load_index(self):
+        index_file = self._index_file()
+        if not os.path.exists(index_file):
+            return
+        with open(index_file, 'r+b') as f:
+            offset = 0
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete entry")
+                    entry = json.loads(line)
+                except ValueError:
+                    logger.warning(f"Truncating damaged archive index at byte {offset}")
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+                self._index_lines += 1
+                if entry.get('deleted'):
+                    self._index.pop(entry['key'], None)
+                else:
+                    self._index[entry['key']] = (entry['segment'], entry['offset'], entry['length'])
+
+    def _append_index(self, entry: Dict[str, Any]):
+        """Write one index line (caller holds self._lock)"""
+        with open(self._index_file(), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + "\n")
+        self._index_lines += 1
+        if self._index_lines > 2 * len(self._index) + 1000:
+            self._compact_index()
+
+    def _compact_index(self):
+        """Rewrite the index with live entries only (caller holds self._lock)"""
+        tmp_file = self._index_file() + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            for key, (segment, offset, length) in self._index.items():
+                f.write(json.dumps({'key': key, 'segment': segment, 'offset': offset, 'length': length}) + "\n")
+        os.replace(tmp_file, self._index_file())
+        self._index_lines = len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def keys(self) -> List[str]:
+        with self._lock:
+            return sorted(self._index)
+
+    def archive(self, key: str, snapshot: Dict[str, Any]):
+        """Append a session snapshot to today's segment and index it"""
+        member = gzip.compress(session_codec.encode(snapshot))
+        segment = f"sessions-{datetime.now():%Y-%m-%d}.gz"
+        with self._lock:
+            with open(self._segment_file(segment), 'ab') as f:
+                offset = f.tell()
+                f.write(member)
+                f.flush()
+                os.fsync(f.fileno())
+            # A crash before this line leaves unindexed bytes in the segment, never a dangling entry.
+            # The in-memory entry goes first so a compaction triggered by the append keeps it
+            self._index[key] = (segment, offset, len(member))
+            self._append_index({'key': key, 'segment': segment, 'offset': offset, 'length': len(member),
+                                'archived_at': datetime.now().isoformat()})
+
+    def restore(self, key: str) -> Optional[Dict[str, Any]]:
+        """Read an archived snapshot back (None if the key is not archived)"""
+        with self._lock:
+            location = self._index.get(key)
+        if location is None:
+            return None
+        segment, offset, length = location
+        with open(self._segment_file(segment), 'rb') as f:
+            f.seek(offset)
+            return session_codec.decode(gzip.decompress(f.read(length)))
+
+    def discard(self, key: str):
+        """Tombstone a key, e.g. once it is back in the hot store (segments are never rewritten)"""
+        with self._lock:
+            if self._index.pop(key, None) is not None:
+                self._append_index({'key': key, 'deleted': True})
@@ -0,0 +1,156 @@
+"""
+Compact binary encoding for conversation session snapshots
+Column-oriented and length-prefixed, so loading a session is a handful of struct unpacks
+"""
+import json
+import struct
+from datetime import datetime, timedelta
+from typing import Any, Dict, List
+
+MAGIC = b"WSAS"
+VERSION = 1
+
+_HEADER = struct.Struct("<4sB")
+_LENGTH = struct.Struct("<I")
+_STRING_TIMESTAMP = -(2 ** 63)  # Marks a timestamp kept verbatim in the header
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+class SnapshotFormatError(ValueError):
+    """Raised when bytes are not a snapshot this version can read"""
+
+
+def to_epoch_us(timestamp: Any) -> Any:
+    """ISO timestamp -> integer microseconds since the epoch
+
+    Integers pass through. Timestamps that would not round-trip exactly
+    (UTC offsets, unusual formats) are kept as the original string.
+    """
+    if isinstance(timestamp, int):
+        return timestamp
+    try:
+        dt = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        return timestamp
+    if dt.tzinfo is not None or dt.isoformat() != timestamp:
+        return timestamp
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+def from_epoch_us(timestamp: int) -> datetime:
+    """Integer microseconds since the epoch -> naive datetime"""
+    return _EPOCH + timestamp * _MICROSECOND
+
+
+def is_binary(data: bytes) -> bool:
+    return data[:len(MAGIC)] == MAGIC
+
+
+def encode(snapshot: Dict[str, Any]) -> bytes:
+    """Encode a session snapshot dict
+
+    Layout after the magic/version header, each section prefixed with its
+    byte length: header JSON (profile, session fields, symbol table and the
+    rare per-message extras), int64 timestamps, uint16 role/type symbol
+    codes, uint32 content lengths, then the UTF-8 content blob.
+    """
+    messages = snapshot['messages']
+    symbols: Dict[str, int] = {}
+    timestamps: List[int] = []
+    codes: List[int] = []
+    lengths: List[int] = []
+    contents: List[bytes] = []
+    string_timestamps: Dict[str, str] = {}
+    metadata: Dict[str, Any] = {}
+
+    for i, message in enumerate(messages):
+        timestamp = to_epoch_us(message['timestamp'])
+        if isinstance(timestamp, int):
+            timestamps.append(timestamp)
+        else:
+            timestamps.append(_STRING_TIMESTAMP)
+            string_timestamps[str(i)] = timestamp
+        codes.append(symbols.setdefault(message['role'], len(symbols)))
+        codes.append(symbols.setdefault(message.get('message_type', 'text'), len(symbols)))
+        content = message['content'].encode('utf-8')
+        lengths.append(len(content))
+        contents.append(content)
+        if message.get('metadata'):
+            metadata[str(i)] = message['metadata']
+
+    header = {key: value for key, value in snapshot.items() if key != 'messages'}
+    header['symbols'] = list(symbols)
+    if string_timestamps:
+        header['string_timestamps'] = string_timestamps
+    if metadata:
+        header['metadata'] = metadata
+
+    count = len(messages)
+    sections = [
+        json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+        struct.pack(f"<{count}q", *timestamps),
+        struct.pack(f"<{2 * count}H", *codes),
+        struct.pack(f"<{count}I", *lengths),
+        b"".join(contents),
+    ]
+    parts = [_HEADER.pack(MAGIC, VERSION)]
+    for section in sections:
+        parts.append(_LENGTH.pack(len(section)))
+        parts.append(section)
+    return b"".join(parts)
+
+
+def decode(data: bytes) -> Dict[str, Any]:
+    """Decode bytes produced by encode()
+
+    Message timestamps come back as epoch microseconds (ConversationMessage
+    accepts them directly), or as the original string where one was kept.
+    """
+    if len(data) < _HEADER.size or not is_binary(data):
+        raise SnapshotFormatError("Not a binary session snapshot")
+    _, version = _HEADER.unpack_from(data)
+    if version != VERSION:
+        raise SnapshotFormatError(f"Unsupported session snapshot version {version}")
+
+    sections = []
+    offset = _HEADER.size
+    try:
+        for _ in range(5):
+            (length,) = _LENGTH.unpack_from(data, offset)
+            offset += _LENGTH.size
+            if offset + length > len(data):
+                raise SnapshotFormatError("Truncated session snapshot")
+            sections.append(data[offset:offset + length])
+            offset += length
+    except struct.error:
+        raise SnapshotFormatError("Truncated session snapshot")
+    header_bytes, timestamp_bytes, code_bytes, length_bytes, blob = sections
+
+    snapshot = json.loads(header_bytes)
+    symbols = snapshot.pop('symbols')
+    string_timestamps = snapshot.pop('string_timestamps', {})
+    metadata = snapshot.pop('metadata', {})
+
+    count = len(timestamp_bytes) // 8
+    timestamps = struct.unpack(f"<{count}q", timestamp_bytes)
+    codes = struct.unpack(f"<{2 * count}H", code_bytes)
+    lengths = struct.unpack(f"<{count}I", length_bytes)
+
+    messages = []
+    position = 0
+    for i in range(count):
+        end = position + lengths[i]
+        timestamp = timestamps[i]
+        messages.append({
+            'timestamp': timestamp if timestamp != _STRING_TIMESTAMP else string_timestamps[str(i)],
+            'role': symbols[codes[2 * i]],
+            'content': blob[position:end].decode('utf-8'),
+            'message_type': symbols[codes[2 * i + 1]],
+            'metadata': metadata.get(str(i), {})
+        })
+        position = end
+
+    snapshot['messages'] = messages
+    return snapshot
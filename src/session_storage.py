@@ -0,0 +1,519 @@
+"""
+Storage backends for the Conversation Memory System
+ConversationMemory talks to one of these instead of touching files directly
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+import logging
+
+import session_codec
+
+logger = logging.getLogger(__name__)
+
+# Backend selection: "json" (file per user), "sqlite" or "redis"
+MEMORY_BACKEND = os.getenv('MEMORY_BACKEND', 'json').lower()
+# Snapshot encoding for the file backend: "json" or "binary" (both are always readable)
+MEMORY_SNAPSHOT_FORMAT = os.getenv('MEMORY_SNAPSHOT_FORMAT', 'json').lower()
+# SQLite database path; defaults to sessions.db inside the storage directory
+MEMORY_SQLITE_PATH = os.getenv('MEMORY_SQLITE_PATH')
+# Redis server shared by all workers, key prefix and per-user history cap
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+MEMORY_REDIS_PREFIX = os.getenv('MEMORY_REDIS_PREFIX', 'wsa:')
+MEMORY_REDIS_HISTORY = int(os.getenv('MEMORY_REDIS_HISTORY', 200))
+# Profiles fetched per pipeline when walking every Redis session
+MEMORY_REDIS_SCAN_BATCH = int(os.getenv('MEMORY_REDIS_SCAN_BATCH', 500))
+
+
+class SessionStorage:
+    """Interface implemented by conversation storage backends
+
+    Sessions are addressed by their normalized phone key. A snapshot is the
+    plain-dict form of a ConversationSession (message timestamps may come back
+    as ISO strings or epoch microseconds); a record is one change
+    ({'op': 'message' | 'profile', 'seq': ..., 'updated_at': ...}); message
+    records also carry the phone number as the user wrote it.
+    """
+
+    # True if appended records pile up until save() folds them into the snapshot
+    compacts_journal = False
+    # True if other processes write the same sessions, so local copies go stale
+    shared = False
+
+    def load(self, key: str, max_messages: int) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Return (snapshot or None, change records not yet folded into it)"""
+        raise NotImplementedError
+
+    def iter_profiles(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """(key, snapshot with a message_count in place of messages) for every session
+
+        Never reads message bodies. Implemented by shared backends, whose
+        analytics are refreshed from storage periodically.
+        """
+        raise NotImplementedError
+
+    def append(self, key: str, record: Dict[str, Any]):
+        """Persist one change record"""
+        raise NotImplementedError
+
+    def append_many(self, entries: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Persist several change records, as one transaction where supported"""
+        for key, record in entries:
+            self.append(key, record)
+
+    def save(self, key: str, snapshot: Dict[str, Any]):
+        """Replace the stored session with a full snapshot"""
+        raise NotImplementedError
+
+    def save_many(self, entries: Iterable[Tuple[str, Dict[str, Any]]]):
+        """Write several snapshots, as one transaction where supported"""
+        for key, snapshot in entries:
+            self.save(key, snapshot)
+
+    def delete(self, key: str):
+        """Remove everything stored for a session"""
+        raise NotImplementedError
+
+    def list_keys(self) -> List[str]:
+        """Keys of all stored sessions, sorted"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonFileStorage(SessionStorage):
+    """One snapshot plus one append-only JSONL journal per user
+
+    Snapshots are written as pretty-printed JSON (session_<key>.json) or, with
+    snapshot_format="binary", in the compact session_codec format
+    (session_<key>.bin). Either kind is read regardless of the setting, so
+    switching formats needs no migration.
+    """
+
+    compacts_journal = True
+
+    def __init__(self, storage_dir: str = "data/conversations", snapshot_format: str = MEMORY_SNAPSHOT_FORMAT):
+        if snapshot_format not in ('json', 'binary'):
+            raise ValueError(f"Unknown snapshot format: {snapshot_format}")
+        self.storage_dir = storage_dir
+        self.snapshot_format = snapshot_format
+        os.makedirs(storage_dir, exist_ok=True)
+
+    def _get_session_file(self, key: str) -> str:
+        """Get JSON snapshot file path for user session"""
+        return os.path.join(self.storage_dir, f"session_{key}.json")
+
+    def _get_binary_file(self, key: str) -> str:
+        """Get binary snapshot file path for user session"""
+        return os.path.join(self.storage_dir, f"session_{key}.bin")
+
+    def _get_journal_file(self, key: str) -> str:
+        """Get append-only journal file path for user session"""
+        return self._get_session_file(key) + "l"
+
+    def load(self, key: str, max_messages: int) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        snapshots = [self._read_snapshot(path)
+                     for path in (self._get_binary_file(key), self._get_session_file(key))
+                     if os.path.exists(path)]
+        # Both exist only after a crash mid format switch: the newer one wins
+        snapshot = max(snapshots, key=lambda data: data.get('journal_seq', 0), default=None)
+        return snapshot, self._read_journal(key)
+
+    @staticmethod
+    def _read_snapshot(path: str) -> Dict[str, Any]:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if session_codec.is_binary(data):
+            return session_codec.decode(data)
+        return json.loads(data)
+
+    def _read_journal(self, key: str) -> List[Dict[str, Any]]:
+        """Read journal records, cutting off a torn trailing write left by a crash"""
+        journal_file = self._get_journal_file(key)
+        if not os.path.exists(journal_file):
+            return []
+
+        records = []
+        with open(journal_file, 'r+b') as f:
+            offset = 0
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Truncating damaged journal for {key} at byte {offset}")
+                    f.truncate(offset)
+                    break
+                offset += len(line)
+
+        return records
+
+    def append(self, key: str, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with open(self._get_journal_file(key), 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def append_many(self, entries: Iterable[Tuple[str, Dict[str, Any]]]):
+        # One write per journal, however many records each session collected
+        lines: Dict[str, List[str]] = {}
+        for key, record in entries:
+            lines.setdefault(key, []).append(json.dumps(record, ensure_ascii=False) + "\n")
+        for key, key_lines in lines.items():
+            with open(self._get_journal_file(key), 'a', encoding='utf-8') as f:
+                f.write("".join(key_lines))
+
+    def save(self, key: str, snapshot: Dict[str, Any]):
+        if self.snapshot_format == 'binary':
+            session_file, stale_file = self._get_binary_file(key), self._get_session_file(key)
+            data = session_codec.encode(snapshot)
+        else:
+            session_file, stale_file = self._get_session_file(key), self._get_binary_file(key)
+            data = json.dumps(snapshot, indent=2, ensure_ascii=False).encode('utf-8')
+
+        # Write-then-rename so a crash never leaves a half-written snapshot
+        tmp_file = session_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, session_file)
+
+        # Journal records up to journal_seq now live in the snapshot
+        for path in (stale_file, self._get_journal_file(key)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def delete(self, key: str):
+        for path in (self._get_session_file(key), self._get_binary_file(key), self._get_journal_file(key)):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def list_keys(self) -> List[str]:
+        keys = set()
+        try:
+            for filename in os.listdir(self.storage_dir):
+                if filename.startswith("session_") and filename.endswith((".json", ".jsonl", ".bin")):
+                    keys.add(filename[len("session_"):].split(".")[0])
+        except Exception as e:
+            logger.error(f"Error listing sessions: {e}")
+        return sorted(keys)
+
+
+class SQLiteStorage(SessionStorage):
+    """Profiles and messages in indexed SQLite tables
+
+    Each append is applied in place, so there is no journal to compact.
+    Full message history is kept; load() reads only the most recent messages
+    through the (phone_key, timestamp) index.
+    """
+
+    PROFILE_FIELDS = ('phone_number', 'name', 'preferred_currency', 'interests',
+                      'last_interaction', 'total_interactions')
+
+    def __init__(self, db_path: str):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS profiles ("
+                "phone_key TEXT PRIMARY KEY, phone_number TEXT NOT NULL, name TEXT, "
+                "preferred_currency TEXT NOT NULL DEFAULT 'USD', interests TEXT NOT NULL DEFAULT '[]', "
+                "last_interaction TEXT, total_interactions INTEGER NOT NULL DEFAULT 0, "
+                "session_summary TEXT, created_at TEXT, updated_at TEXT, "
+                "journal_seq INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, phone_key TEXT NOT NULL, "
+                "timestamp TEXT NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL, "
+                "message_type TEXT NOT NULL DEFAULT 'text', metadata TEXT)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_phone_time ON messages (phone_key, timestamp)"
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_profiles_last_interaction ON profiles (last_interaction)"
+            )
+
+    def load(self, key: str, max_messages: int) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT phone_number, name, preferred_currency, interests, last_interaction, "
+                "total_interactions, session_summary, created_at, updated_at, journal_seq "
+                "FROM profiles WHERE phone_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None, []
+            rows = self._conn.execute(
+                "SELECT timestamp, role, content, message_type, metadata FROM messages "
+                "WHERE phone_key = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
+                (key, max_messages)
+            ).fetchall()
+
+        profile = dict(zip(self.PROFILE_FIELDS, row[:6]))
+        profile['interests'] = json.loads(profile['interests'])
+        messages = [{
+            'timestamp': timestamp, 'role': role, 'content': content,
+            'message_type': message_type,
+            'metadata': json.loads(metadata) if metadata else {}
+        } for timestamp, role, content, message_type, metadata in reversed(rows)]
+
+        snapshot = {
+            'user_profile': profile,
+            'messages': messages,
+            'session_summary': row[6],
+            'created_at': row[7],
+            'updated_at': row[8],
+            'journal_seq': row[9]
+        }
+        return snapshot, []
+
+    def append(self, key: str, record: Dict[str, Any]):
+        self.append_many([(key, record)])
+
+    def append_many(self, entries: Iterable[Tuple[str, Dict[str, Any]]]):
+        with self._lock, self._conn:
+            for key, record in entries:
+                self._apply(key, record)
+
+    def _apply(self, key: str, record: Dict[str, Any]):
+        """Apply one change record inside the caller's transaction"""
+        created_at = record.get('created_at', record['updated_at'])
+        if record['op'] == 'message':
+            message = record['message']
+            self._insert_messages(key, [message])
+            self._conn.execute(
+                "INSERT INTO profiles (phone_key, phone_number, last_interaction, total_interactions, "
+                "created_at, updated_at, journal_seq) VALUES (?, ?, ?, 1, ?, ?, ?) "
+                "ON CONFLICT(phone_key) DO UPDATE SET "
+                "total_interactions = total_interactions + 1, last_interaction = excluded.last_interaction, "
+                "updated_at = excluded.updated_at, journal_seq = excluded.journal_seq",
+                (key, record.get('phone_number', key), message['timestamp'], created_at,
+                 record['updated_at'], record['seq'])
+            )
+        elif record['op'] == 'profile':
+            self._upsert_profile(key, record['profile'], None, created_at,
+                                 record['updated_at'], record['seq'], keep_summary=True)
+
+    def _upsert_profile(self, key: str, profile: Dict[str, Any], session_summary: Optional[str],
+                        created_at: Optional[str], updated_at: Optional[str], journal_seq: int,
+                        keep_summary: bool = False):
+        self._conn.execute(
+            "INSERT INTO profiles (phone_key, phone_number, name, preferred_currency, interests, "
+            "last_interaction, total_interactions, session_summary, created_at, updated_at, journal_seq) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(phone_key) DO UPDATE SET "
+            "phone_number = excluded.phone_number, name = excluded.name, "
+            "preferred_currency = excluded.preferred_currency, interests = excluded.interests, "
+            "last_interaction = excluded.last_interaction, total_interactions = excluded.total_interactions, "
+            + ("" if keep_summary else "session_summary = excluded.session_summary, created_at = excluded.created_at, ")
+            + "updated_at = excluded.updated_at, journal_seq = excluded.journal_seq",
+            (key, profile['phone_number'], profile.get('name'), profile.get('preferred_currency', 'USD'),
+             json.dumps(profile.get('interests') or [], ensure_ascii=False), profile.get('last_interaction'),
+             profile.get('total_interactions', 0), session_summary, created_at, updated_at, journal_seq)
+        )
+
+    def _insert_messages(self, key: str, messages: List[Dict[str, Any]]):
+        self._conn.executemany(
+            "INSERT INTO messages (phone_key, timestamp, role, content, message_type, metadata) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            [(key, m['timestamp'], m['role'], m['content'], m.get('message_type', 'text'),
+              json.dumps(m.get('metadata') or {}, ensure_ascii=False)) for m in messages]
+        )
+
+    def save(self, key: str, snapshot: Dict[str, Any]):
+        self.save_many([(key, snapshot)])
+
+    def save_many(self, entries: Iterable[Tuple[str, Dict[str, Any]]]):
+        with self._lock, self._conn:
+            for key, snapshot in entries:
+                self._upsert_profile(key, snapshot['user_profile'], snapshot.get('session_summary'),
+                                     snapshot.get('created_at'), snapshot.get('updated_at'),
+                                     snapshot.get('journal_seq', 0))
+                self._conn.execute("DELETE FROM messages WHERE phone_key = ?", (key,))
+                self._insert_messages(key, snapshot['messages'])
+
+    def delete(self, key: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM messages WHERE phone_key = ?", (key,))
+            self._conn.execute("DELETE FROM profiles WHERE phone_key = ?", (key,))
+
+    def list_keys(self) -> List[str]:
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT phone_key FROM profiles ORDER BY phone_key")]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisStorage(SessionStorage):
+    """Profiles and capped message histories in Redis, shared by every worker
+
+    Per user: a profile hash and a message list trimmed to history_limit,
+    plus one sorted set indexing all session keys. Every change is sent as a
+    single MULTI/EXEC pipeline, and counters use HINCRBY so concurrent
+    workers never overwrite each other's interaction counts.
+    """
+
+    shared = True
+
+    PROFILE_FIELDS = ('phone_number', 'name', 'preferred_currency', 'interests')
+
+    def __init__(self, client, prefix: str = MEMORY_REDIS_PREFIX, history_limit: int = MEMORY_REDIS_HISTORY):
+        self.client = client
+        self.prefix = prefix
+        self.history_limit = history_limit
+        self._index_key = f"{prefix}sessions"
+
+    @classmethod
+    def from_url(cls, url: str = REDIS_URL, **kwargs) -> "RedisStorage":
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("MEMORY_BACKEND=redis requires the redis package (pip install redis)")
+        return cls(redis.Redis.from_url(url, decode_responses=True), **kwargs)
+
+    def _profile_key(self, key: str) -> str:
+        return f"{self.prefix}profile:{key}"
+
+    def _messages_key(self, key: str) -> str:
+        return f"{self.prefix}messages:{key}"
+
+    def load(self, key: str, max_messages: int) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+        pipe = self.client.pipeline(transaction=True)
+        pipe.hgetall(self._profile_key(key))
+        pipe.lrange(self._messages_key(key), -max_messages, -1)
+        fields, messages = pipe.execute()
+        if not fields:
+            return None, []
+
+        snapshot = self._snapshot_from_fields(key, fields)
+        snapshot['messages'] = [json.loads(message) for message in messages]
+        return snapshot, []
+
+    def iter_profiles(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """Profile hashes and message list lengths, one pipeline per batch of sessions"""
+        keys = self.list_keys()
+        for start in range(0, len(keys), MEMORY_REDIS_SCAN_BATCH):
+            batch = keys[start:start + MEMORY_REDIS_SCAN_BATCH]
+            pipe = self.client.pipeline(transaction=False)
+            for key in batch:
+                pipe.hgetall(self._profile_key(key))
+                pipe.llen(self._messages_key(key))
+            results = pipe.execute()
+            for key, fields, message_count in zip(batch, results[::2], results[1::2]):
+                if fields:
+                    snapshot = self._snapshot_from_fields(key, fields)
+                    snapshot['message_count'] = message_count
+                    yield key, snapshot
+
+    @staticmethod
+    def _snapshot_from_fields(key: str, fields: Dict[str, str]) -> Dict[str, Any]:
+        """Snapshot (without messages) from a profile hash"""
+        profile = {
+            'phone_number': fields.get('phone_number', key),
+            'name': fields.get('name') or None,
+            'preferred_currency': fields.get('preferred_currency', 'USD'),
+            'interests': json.loads(fields.get('interests', '[]')),
+            'last_interaction': fields.get('last_interaction') or None,
+            'total_interactions': int(fields.get('total_interactions', 0))
+        }
+        return {
+            'user_profile': profile,
+            'session_summary': fields.get('session_summary') or None,
+            'created_at': fields.get('created_at'),
+            'updated_at': fields.get('updated_at'),
+            'journal_seq': int(fields.get('journal_seq', 0))
+        }
+
+    def append(self, key: str, record: Dict[str, Any]):
+        self.append_many([(key, record)])
+
+    def append_many(self, entries: Iterable[Tuple[str, Dict[str, Any]]]):
+        pipe = self.client.pipeline(transaction=True)
+        for key, record in entries:
+            self._queue_record(pipe, key, record)
+        pipe.execute()
+
+    def _queue_record(self, pipe, key: str, record: Dict[str, Any]):
+        """Queue the commands for one change record on a pipeline"""
+        profile_key = self._profile_key(key)
+        pipe.hsetnx(profile_key, 'phone_number', record.get('phone_number', key))
+        pipe.hsetnx(profile_key, 'created_at', record.get('created_at', record['updated_at']))
+        pipe.hset(profile_key, mapping={'updated_at': record['updated_at'], 'journal_seq': record['seq']})
+        pipe.zadd(self._index_key, {key: 0})
+
+        if record['op'] == 'message':
+            message = record['message']
+            pipe.rpush(self._messages_key(key), json.dumps(message, ensure_ascii=False))
+            pipe.ltrim(self._messages_key(key), -self.history_limit, -1)
+            pipe.hincrby(profile_key, 'total_interactions', 1)
+            pipe.hset(profile_key, 'last_interaction', message['timestamp'])
+        elif record['op'] == 'profile':
+            # Counters are left to HINCRBY so another worker's messages are not lost
+            pipe.hset(profile_key, mapping=self._profile_mapping(record['profile'], self.PROFILE_FIELDS))
+
+    @staticmethod
+    def _profile_mapping(profile: Dict[str, Any], fields) -> Dict[str, Any]:
+        mapping = {}
+        for field in fields:
+            value = profile.get(field)
+            if field == 'interests':
+                value = json.dumps(value or [], ensure_ascii=False)
+            mapping[field] = '' if value is None else value
+        return mapping
+
+    def save(self, key: str, snapshot: Dict[str, Any]):
+        self.save_many([(key, snapshot)])
+
+    def save_many(self, entries: Iterable[Tuple[str, Dict[str, Any]]]):
+        pipe = self.client.pipeline(transaction=True)
+        for key, snapshot in entries:
+            mapping = self._profile_mapping(snapshot['user_profile'],
+                                            self.PROFILE_FIELDS + ('last_interaction', 'total_interactions'))
+            for field in ('session_summary', 'created_at', 'updated_at'):
+                mapping[field] = snapshot.get(field) or ''
+            mapping['journal_seq'] = snapshot.get('journal_seq', 0)
+
+            pipe.delete(self._profile_key(key), self._messages_key(key))
+            pipe.hset(self._profile_key(key), mapping=mapping)
+            messages = snapshot['messages'][-self.history_limit:]
+            if messages:
+                pipe.rpush(self._messages_key(key), *[json.dumps(m, ensure_ascii=False) for m in messages])
+            pipe.zadd(self._index_key, {key: 0})
+        pipe.execute()
+
+    def delete(self, key: str):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.delete(self._profile_key(key), self._messages_key(key))
+        pipe.zrem(self._index_key, key)
+        pipe.execute()
+
+    def list_keys(self) -> List[str]:
+        # All scores are 0, so the index is ordered lexicographically
+        return list(self.client.zrange(self._index_key, 0, -1))
+
+    def close(self):
+        self.client.close()
+
+
+def create_storage(backend: Optional[str] = None, storage_dir: str = "data/conversations",
+                   sqlite_path: Optional[str] = None) -> SessionStorage:
+    """Build the configured storage backend (MEMORY_BACKEND / MEMORY_SQLITE_PATH / REDIS_URL)"""
+    backend = (backend or MEMORY_BACKEND).lower()
+    if backend == 'json':
+        return JsonFileStorage(storage_dir, MEMORY_SNAPSHOT_FORMAT)
+    if backend == 'sqlite':
+        return SQLiteStorage(sqlite_path or MEMORY_SQLITE_PATH or os.path.join(storage_dir, "sessions.db"))
+    if backend == 'redis':
+        return RedisStorage.from_url(REDIS_URL)
+    raise ValueError(f"Unknown memory backend: {backend}")
@@ -0,0 +1,80 @@
+"""
+Request coalescing for identical in-flight calls
+Concurrent callers asking for the same key share one upstream call and all receive its result
+"""
+import os
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+# Followers wait this long for the shared call before making their own (seconds)
+SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.getenv('SINGLE_FLIGHT_TIMEOUT_SECONDS', 60))
+
+
+class _Call:
+    """One upstream call and the outcome its followers are waiting for"""
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls by key
+
+    The first caller for a key (the leader) runs the function; callers
+    arriving while it runs (followers) block until it finishes and get the
+    same result, or the same exception. Nothing is remembered once the call
+    completes — caching finished results is the caller's job.
+    """
+
+    def __init__(self, timeout_seconds: float = SINGLE_FLIGHT_TIMEOUT_SECONDS):
+        self.timeout_seconds = timeout_seconds
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timeouts = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run fn once per key at a time; returns (result, shared) where shared is True for followers"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            if not call.done.wait(self.timeout_seconds):
+                with self._lock:
+                    self.timeouts += 1
+                return fn(), False
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "timeouts": self.timeouts,
+        }
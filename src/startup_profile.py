@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Startup Profiler
+Reports per-module import time for an entry point, using a fresh interpreter with -X importtime
+
+Usage: python src/startup_profile.py [module ...] [--top 25] [--budget 1.5]
+"""
+import argparse
+import os
+import subprocess
+import sys
+from typing import List, NamedTuple
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Entry points profiled when none are given
+DEFAULT_MODULES = ["whatsapp_integration", "agent_core", "conversation_memory"]
+
+
+class ImportTiming(NamedTuple):
+    module: str
+    self_us: int  # Time spent in the module body itself
+    cumulative_us: int  # Including everything it imported
+    depth: int  # Nesting level in the import tree (0 = imported by the entry point)
+
+
+def profile_imports(module: str, python: str = sys.executable) -> List[ImportTiming]:
+    """Import module in a fresh interpreter and return one timing per module loaded"""
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import {module}"],
+        cwd=SRC_DIR, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def parse_importtime(output: str) -> List[ImportTiming]:
+    """Parse '-X importtime' lines: 'import time: self [us] | cumulative | name'"""
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # Header line
+        name = fields[2].rstrip()
+        stripped = name.lstrip()
+        depth = (len(name) - len(stripped) - 1) // 2
+        timings.append(ImportTiming(stripped, int(fields[0]), int(fields[1]), depth))
+    return timings
+
+
+def total_seconds(module: str, timings: List[ImportTiming]) -> float:
+    """Time to import the entry point, excluding interpreter startup (site, encodings)"""
+    return sum(t.cumulative_us for t in timings if t.depth == 0 and t.module == module) / 1e6
+
+
+def report(module: str, timings: List[ImportTiming], top: int) -> str:
+    lines = [f"📦 {module}: {total_seconds(module, timings):.3f}s, {len(timings)} modules"]
+    lines.append(f"   {'cumulative':>10} {'self':>8}  module")
+    for timing in sorted(timings, key=lambda t: t.cumulative_us, reverse=True)[:top]:
+        lines.append(f"   {timing.cumulative_us / 1000:>8.1f}ms {timing.self_us / 1000:>6.1f}ms  "
+                     f"{'  ' * timing.depth}{timing.module}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-module import time for entry points")
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--top", type=int, default=25, help="Slowest modules to list per entry point")
+    parser.add_argument("--budget", type=float, help="Fail if any entry point takes longer (seconds)")
+    args = parser.parse_args(argv)
+
+    over_budget = []
+    for module in args.modules:
+        timings = profile_imports(module)
+        print(report(module, timings, args.top))
+        print()
+        if args.budget is not None and total_seconds(module, timings) > args.budget:
+            over_budget.append(module)
+
+    if over_budget:
+        print(f"❌ Over the {args.budget}s budget: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -71,6 +71,7 @@ def test_memory_system():
     print("\n💾 Testing session persistence...")
     
     # Create new memory instance (simulates restart)
+    memory.flush()
     memory2 = ConversationMemory()
     
     # Check if data persisted
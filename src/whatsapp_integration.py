@@ -6,18 +6,27 @@ This module integrates the Sales Agent with WhatsApp using Meta's Cloud API
 
 import os
 import json
-import requests
-from flask import Flask, request, jsonify
+import queue
+import atexit
+from flask import Flask, Response, request, jsonify
 from dotenv import load_dotenv
 import asyncio
 from datetime import datetime
 import logging
 import sys
 import os
+import time
 sys.path.append(os.path.dirname(__file__))
 
-from sales_agent import get_sales_agent, get_ai_response
+import http_client
+from agent_core import get_sales_agent, get_ai_response
 from conversation_memory import ConversationMemory
+from message_queue import MessageWorkerPool
+from message_dedupe import MessageDeduplicator, SQLiteDedupeStore
+from pagination import NDJSON_MIMETYPE, PageRequest, encode_cursor, ndjson_lines
+from response_cache import ResponseCache
+from semantic_cache import LatencyStats, SemanticCache
+from single_flight import SingleFlight
 
 # Load environment variables
 load_dotenv()
@@ -35,10 +44,33 @@ WHATSAPP_PHONE_NUMBER_ID = os.getenv('WHATSAPP_PHONE_NUMBER_ID')
 VERIFY_TOKEN = os.getenv('WHATSAPP_VERIFY_TOKEN', 'sales_agent_verify_token')
 WHATSAPP_API_URL = f"https://graph.facebook.com/v18.0/{WHATSAPP_PHONE_NUMBER_ID}/messages"
 
+# Background processing (webhook returns before the LLM call; 0 workers = process inline)
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))
+WEBHOOK_SHUTDOWN_TIMEOUT = float(os.getenv('WEBHOOK_SHUTDOWN_TIMEOUT', 30))
+
+# Redelivery protection: processed message IDs are remembered for this long
+# (WEBHOOK_DEDUPE_DB persists them across restarts and worker processes)
+WEBHOOK_DEDUPE_TTL_SECONDS = float(os.getenv('WEBHOOK_DEDUPE_TTL_SECONDS', 86400))
+WEBHOOK_DEDUPE_MAX_ENTRIES = int(os.getenv('WEBHOOK_DEDUPE_MAX_ENTRIES', 100000))
+WEBHOOK_DEDUPE_DB = os.getenv('WEBHOOK_DEDUPE_DB')
+
+# Page sizes for /analytics/users and /conversation/<phone> (?limit= can ask for up to the max)
+ANALYTICS_PAGE_SIZE = int(os.getenv('ANALYTICS_PAGE_SIZE', 100))
+ANALYTICS_MAX_PAGE_SIZE = int(os.getenv('ANALYTICS_MAX_PAGE_SIZE', 1000))
+CONVERSATION_PAGE_SIZE = int(os.getenv('CONVERSATION_PAGE_SIZE', 20))
+USER_FIELDS = ("phone_number", "name", "total_interactions", "preferred_currency", "interests",
+               "last_interaction", "total_messages", "session_created")
+MESSAGE_FIELDS = ("timestamp", "role", "content", "message_type", "metadata")
+
 class WhatsAppBot:
     def __init__(self):
         self.sales_agent = None
         self.memory = ConversationMemory()  # Initialize conversation memory system
+        self.response_cache = ResponseCache()  # Replies to repeated FAQs
+        self.semantic_cache = SemanticCache()  # Replies to paraphrased FAQs
+        self.model_latency = LatencyStats()  # Time spent waiting on the agent
+        self.in_flight = SingleFlight()  # Coalesces identical questions already being answered
     
     def get_agent(self):
         """Get or create sales agent instance"""
@@ -61,7 +93,7 @@ class WhatsAppBot:
                 "text": {"body": message}
             }
             
-            response = requests.post(WHATSAPP_API_URL, headers=headers, json=payload)
+            response = http_client.post(WHATSAPP_API_URL, headers=headers, json=payload)
             
             if response.status_code == 200:
                 logger.info(f"Message sent successfully to {phone_number}")
@@ -92,7 +124,7 @@ class WhatsAppBot:
                 }
             }
             
-            response = requests.post(WHATSAPP_API_URL, headers=headers, json=payload)
+            response = http_client.post(WHATSAPP_API_URL, headers=headers, json=payload)
             return response.status_code == 200
             
         except Exception as e:
@@ -137,11 +169,40 @@ class WhatsAppBot:
             Generate a context-aware, personalized response:
             """
 
-            # Get AI response
-            response = get_ai_response(whatsapp_context)
-
-            # Format response for WhatsApp
-            formatted_response = self.format_for_whatsapp(response.content)
+            # Repeated FAQs are answered from cache (exact wording first, then paraphrases);
+            # personal and time-sensitive ones always reach the model. Shareable questions are
+            # coalesced even with the caches turned off
+            formatted_response, cache_key, semantic_scope = None, None, None
+            if self.response_cache.bypass_reason(message, message_type) is not None:
+                self.response_cache.note_bypass()
+            if self.response_cache.uncacheable_reason(message, message_type) is None:
+                profile = self.memory.get_user_summary(phone_number)
+                cache_key = self.response_cache.make_key(message, profile["preferred_currency"],
+                                                         profile["interests"])
+                formatted_response = self.response_cache.get(cache_key)
+                if formatted_response is None:
+                    semantic_scope = self._semantic_scope(message, cache_key)
+                    formatted_response = self.semantic_cache.lookup(message, semantic_scope)
+                    if formatted_response is not None:
+                        logger.info(f"Answered {phone_number} from the semantic cache")
+                        self.response_cache.store(cache_key, formatted_response, profile)
+                else:
+                    logger.info(f"Answered {phone_number} from the response cache")
+
+            if formatted_response is None and cache_key is None:
+                formatted_response = self._ask_agent(whatsapp_context)
+            elif formatted_response is None:
+                # Customers asking the same cacheable question at once share one agent call
+                # Shared replies are written without this user's history so any customer can receive them
+                shared_context = self._shared_context(message, message_type, profile)
+                (formatted_response, shareable), shared = self.in_flight.do(
+                    cache_key,
+                    lambda: self._ask_agent_and_cache(shared_context, message, cache_key, semantic_scope, profile)
+                )
+                if shared and not shareable:
+                    formatted_response = self._ask_agent(whatsapp_context)  # Reply was written for another user
+                elif shared:
+                    logger.info(f"Answered {phone_number} from a coalesced agent call")
 
             # Add assistant response to memory
             self.memory.add_message(phone_number, "assistant", formatted_response, message_type, metadata)
@@ -152,6 +213,48 @@ class WhatsAppBot:
             logger.error(f"Error processing message: {str(e)}")
             return "Sorry, I'm having trouble processing your request. Please try again! 🤖"
     
+    @staticmethod
+    def _shared_context(message: str, message_type: str, profile: dict) -> str:
+        """Prompt for a cacheable question: only what the cache key holds (currency and
+        interests), no name, number or conversation history"""
+        interests = ", ".join(profile["interests"]) or "None specified"
+        return f"""
+            [WhatsApp Sales Agent - General Response]
+
+            CUSTOMER PREFERENCES:
+            Preferred Currency: {profile["preferred_currency"]}
+            Interests: {interests}
+
+            CURRENT MESSAGE:
+            User: {message}
+            Message Type: {message_type}
+
+            RESPONSE GUIDELINES:
+            - Answer the question on its own; do not refer to earlier conversations or address the customer by name
+            - Keep responses WhatsApp-friendly (concise, emojis, clear formatting)
+            - For currency conversions, use their preferred currency when possible
+            - End with a helpful question or suggestion based on their interests
+
+            Generate a helpful response:
+            """
+
+    def _ask_agent(self, whatsapp_context: str) -> str:
+        """Get a WhatsApp-formatted reply from the agent"""
+        started = time.perf_counter()
+        response = get_ai_response(whatsapp_context)
+        self.model_latency.record(time.perf_counter() - started)
+        return self.format_for_whatsapp(response.content)
+
+    def _ask_agent_and_cache(self, whatsapp_context: str, message: str, cache_key, semantic_scope,
+                             profile: dict) -> tuple:
+        """Agent reply for a cacheable question, cached before coalesced callers see it;
+        returns (reply, shareable) where shareable is False for replies naming the user"""
+        formatted_response = self._ask_agent(whatsapp_context)
+        shareable = self.response_cache.store(cache_key, formatted_response, profile)
+        if shareable:
+            self.semantic_cache.store(message, formatted_response, semantic_scope)
+        return formatted_response, shareable
+
     def format_for_whatsapp(self, message: str) -> str:
         """Format message for WhatsApp display"""
         # Remove markdown formatting that doesn't work well in WhatsApp
@@ -205,6 +308,13 @@ class WhatsAppBot:
 
         return currencies
 
+    def _semantic_scope(self, message: str, cache_key) -> tuple:
+        """What a paraphrase must share to reuse an answer: the profile part of the
+        exact cache key, plus the currencies (in the order asked) and products mentioned"""
+        message_upper = message.upper()
+        currencies = sorted(self._extract_currencies(message), key=message_upper.find)
+        return cache_key[1:] + (tuple(currencies), tuple(self._extract_products(message)))
+
     def _extract_products(self, message: str) -> list:
         """Extract product mentions from message"""
         products = []
@@ -262,6 +372,26 @@ class WhatsAppBot:
 
 # Initialize bot
 whatsapp_bot = WhatsAppBot()
+# atexit runs handlers in reverse: this flush happens after the message queue drains
+atexit.register(whatsapp_bot.memory.close)
+
+def reply_to_message(phone_number: str, message_text: str):
+    """Generate and send the agent reply for one inbound message (runs on a worker)"""
+    response = whatsapp_bot.process_message(phone_number, message_text)
+    whatsapp_bot.send_message(phone_number, response)
+
+message_queue = MessageWorkerPool(
+    reply_to_message,
+    num_workers=WEBHOOK_WORKERS,
+    max_queue_size=WEBHOOK_QUEUE_SIZE
+)
+atexit.register(message_queue.shutdown, wait=True, timeout=WEBHOOK_SHUTDOWN_TIMEOUT)
+
+message_deduplicator = MessageDeduplicator(
+    ttl_seconds=WEBHOOK_DEDUPE_TTL_SECONDS,
+    max_entries=WEBHOOK_DEDUPE_MAX_ENTRIES,
+    store=SQLiteDedupeStore(WEBHOOK_DEDUPE_DB) if WEBHOOK_DEDUPE_DB else None
+)
 
 @app.route('/webhook', methods=['GET'])
 def verify_webhook():
@@ -295,18 +425,32 @@ def handle_webhook():
                             for message in messages:
                                 phone_number = message['from']
                                 message_text = message.get('text', {}).get('body', '')
+                                if not message_text:
+                                    continue
+                                
+                                # Skip Meta redeliveries of messages we already accepted; an ID is
+                                # only marked once the message is valid, so a corrected redelivery gets through
+                                message_id = message.get('id')
+                                if message_id and not message_deduplicator.check_and_mark(message_id):
+                                    logger.info(f"Skipping duplicate delivery of message {message_id}")
+                                    continue
                                 
-                                if message_text:
-                                    logger.info(f"Processing message from {phone_number}: {message_text}")
-                                    
-                                    # Process with Sales Agent
-                                    response = whatsapp_bot.process_message(phone_number, message_text)
-                                    
-                                    # Send response
-                                    whatsapp_bot.send_message(phone_number, response)
+                                logger.info(f"Queueing message from {phone_number}: {message_text}")
+                                
+                                # Process with Sales Agent and reply in the background
+                                try:
+                                    message_queue.submit(phone_number, message_text)
+                                except queue.Full:
+                                    # Let the redelivery through once we have capacity again
+                                    if message_id:
+                                        message_deduplicator.forget(message_id)
+                                    raise
         
         return jsonify({"status": "success"}), 200
         
+    except queue.Full:
+        logger.error("Message queue full, asking WhatsApp to redeliver later")
+        return jsonify({"status": "error", "message": "Server busy"}), 503
     except Exception as e:
         logger.error(f"Error handling webhook: {str(e)}")
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -334,13 +478,30 @@ def send_manual_message():
 
 @app.route('/conversation/<phone_number>', methods=['GET'])
 def get_conversation_history(phone_number):
-    """Get conversation history for a specific user"""
+    """Get conversation history for a specific user
+
+    Returns the newest messages first page; pass ?cursor=<next_cursor> for older
+    ones. Supports ?limit=, ?fields= (message fields) and ?format=ndjson.
+    """
     try:
         # Remove URL encoding
         phone_number = phone_number.replace('%2B', '+')
+        memory = whatsapp_bot.memory
+
+        try:
+            page = PageRequest.from_args(request.args, CONVERSATION_PAGE_SIZE,
+                                         memory.max_messages_per_session, MESSAGE_FIELDS)
+            messages, next_before = memory.get_messages_page(phone_number, page.cursor, page.limit)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        messages = [page.select(msg) for msg in messages]
+        next_cursor = encode_cursor(next_before)
 
-        session = whatsapp_bot.memory.get_or_create_session(phone_number)
+        if page.streamed:
+            return _ndjson_response(messages, next_cursor)
 
+        session = memory.get_or_create_session(phone_number)
         conversation_data = {
             "user_profile": {
                 "phone_number": session.user_profile.phone_number,
@@ -350,16 +511,8 @@ def get_conversation_history(phone_number):
                 "total_interactions": session.user_profile.total_interactions,
                 "last_interaction": session.user_profile.last_interaction
             },
-            "messages": [
-                {
-                    "timestamp": msg.timestamp,
-                    "role": msg.role,
-                    "content": msg.content,
-                    "message_type": msg.message_type,
-                    "metadata": msg.metadata
-                }
-                for msg in session.messages[-20:]  # Last 20 messages
-            ],
+            "messages": messages,
+            "next_cursor": next_cursor,
             "session_info": {
                 "created_at": session.created_at,
                 "updated_at": session.updated_at,
@@ -375,38 +528,68 @@ def get_conversation_history(phone_number):
 
 @app.route('/analytics/users', methods=['GET'])
 def get_users_analytics():
-    """Get analytics for all users"""
+    """Get analytics for all users
+
+    Users are paged by ?cursor= and ?limit=, trimmed with ?fields=, and
+    ?format=ndjson streams one user per line (all remaining users unless a
+    limit is given).
+    """
     try:
-        users_summary = whatsapp_bot.memory.get_all_users_summary()
-
-        analytics = {
-            "total_users": len(users_summary),
-            "users": users_summary,
-            "summary": {
-                "total_interactions": sum(user.get("total_interactions", 0) for user in users_summary),
-                "active_users_24h": len([
-                    user for user in users_summary
-                    if user.get("last_interaction") and
-                    (datetime.now() - datetime.fromisoformat(user["last_interaction"])).days < 1
-                ]),
-                "top_interests": _get_top_interests(users_summary)
-            }
-        }
+        memory = whatsapp_bot.memory
 
+        try:
+            page = PageRequest.from_args(request.args, ANALYTICS_PAGE_SIZE, ANALYTICS_MAX_PAGE_SIZE,
+                                         USER_FIELDS, unbounded_stream=True)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if page.streamed and page.limit is None:
+            return _ndjson_response(_iter_user_pages(memory, page), None)
+
+        users, next_after = memory.get_users_page(page.cursor, page.limit)
+        users = [page.select(user) for user in users]
+        next_cursor = encode_cursor(next_after)
+
+        if page.streamed:
+            return _ndjson_response(users, next_cursor)
+
+        # Aggregates are maintained as messages arrive; no per-request scan
+        analytics = memory.get_analytics_summary()
+        analytics["users"] = users
+        analytics["next_cursor"] = next_cursor
         return jsonify(analytics)
 
     except Exception as e:
         logger.error(f"Error getting analytics: {str(e)}")
         return jsonify({"error": "Internal server error"}), 500
 
-def _get_top_interests(users_summary):
-    """Get top user interests"""
-    interest_count = {}
-    for user in users_summary:
-        for interest in user.get("interests", []):
-            interest_count[interest] = interest_count.get(interest, 0) + 1
-
-    return sorted(interest_count.items(), key=lambda x: x[1], reverse=True)[:5]
+def _iter_user_pages(memory, page):
+    """Walk every user from the cursor on, one page at a time"""
+    after = page.cursor
+    while True:
+        users, after = memory.get_users_page(after, ANALYTICS_MAX_PAGE_SIZE)
+        for user in users:
+            yield page.select(user)
+        if after is None:
+            return
+
+def _ndjson_response(rows, next_cursor):
+    """Chunked NDJSON body; the continuation cursor travels in a header"""
+    response = Response(ndjson_lines(rows), mimetype=NDJSON_MIMETYPE)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
+
+@app.route('/metrics/cache', methods=['GET'])
+def cache_metrics():
+    """Hit rates and latency of the reply caches and coalesced agent calls, next to the agent latency they save"""
+    return jsonify({
+        "response_cache": whatsapp_bot.response_cache.stats(),
+        "semantic_cache": whatsapp_bot.semantic_cache.stats(),
+        "agent_latency_ms": whatsapp_bot.model_latency.summary(),
+        "coalescing": whatsapp_bot.in_flight.stats(),
+        "timestamp": datetime.now().isoformat()
+    })
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -0,0 +1,1065 @@
+"""
+Unit tests for Conversation Memory storage
+"""
+import unittest
+import sys
+import os
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+# Add src directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from conversation_memory import ConversationMemory, ConversationMessage, UserProfile
+from analytics_index import AnalyticsIndex
+from retention import ExpiryIndex, RetentionSweeper
+from session_archive import SessionArchive
+from session_storage import JsonFileStorage, SQLiteStorage, RedisStorage, create_storage
+from fake_redis import FakeRedis
+import session_codec
+from migrate_sessions import migrate
+
+
+class TestCompactRepresentation(unittest.TestCase):
+    """Test slotted messages and profiles convert losslessly"""
+
+    def test_message_round_trip(self):
+        """Test to_dict reproduces the stored JSON exactly"""
+        samples = [
+            {"timestamp": "2025-07-22T22:30:00", "role": "user", "content": "Hello",
+             "message_type": "text", "metadata": {}},
+            {"timestamp": "2025-07-22T22:30:00.123456", "role": "assistant", "content": "Hi!",
+             "message_type": "currency_conversion", "metadata": {"currencies": ["USD", "EUR"]}},
+            {"timestamp": "2025-07-22T22:30:00+00:00", "role": "user", "content": "UTC",
+             "message_type": "text", "metadata": {}},
+        ]
+        for data in samples:
+            message = ConversationMessage.from_dict(json.loads(json.dumps(data)))
+            self.assertEqual(message.to_dict(), data)
+
+    def test_message_is_compact(self):
+        """Test timestamps are integers, strings interned and empty metadata unallocated"""
+        message = ConversationMessage.from_dict(json.loads(
+            '{"timestamp": "2025-07-22T22:30:00", "role": "user", "content": "Hi", '
+            '"message_type": "text", "metadata": {}}'
+        ))
+
+        self.assertFalse(hasattr(message, '__dict__'))
+        self.assertIsInstance(message._timestamp, int)
+        self.assertIs(message.role, sys.intern("user"))
+        self.assertIsNone(message._metadata)
+        self.assertEqual(message.time.strftime("%H:%M"), "22:30")
+
+        message.metadata["intent"] = "greeting"
+        self.assertEqual(message.to_dict()["metadata"], {"intent": "greeting"})
+
+    def test_profile_round_trip(self):
+        """Test profiles convert to and from the JSON schema unchanged"""
+        data = {"phone_number": "+1234567890", "name": "Alice", "preferred_currency": "EUR",
+                "interests": ["smartphones"], "last_interaction": "2025-07-22T22:30:00",
+                "total_interactions": 3}
+        profile = UserProfile.from_dict(data)
+
+        self.assertEqual(profile.to_dict(), data)
+        self.assertFalse(hasattr(profile, '__dict__'))
+        self.assertEqual(UserProfile("+1").interests, [])
+
+
+class TestBinarySnapshots(unittest.TestCase):
+    """Test the binary snapshot codec and its use by the file backend"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.phone = "+1234567890"
+        self.snapshot = {
+            "user_profile": {"phone_number": self.phone, "name": "Zoë", "preferred_currency": "EUR",
+                             "interests": ["laptops"], "last_interaction": "2025-07-22T22:31:00",
+                             "total_interactions": 3},
+            "messages": [
+                {"timestamp": "2025-07-22T22:30:00", "role": "user", "content": "Hola 👋",
+                 "message_type": "text", "metadata": {}},
+                {"timestamp": "2025-07-22T22:30:05.250000", "role": "assistant", "content": "",
+                 "message_type": "currency_conversion", "metadata": {"amount": 100}},
+                {"timestamp": "2025-07-22T22:31:00+00:00", "role": "user", "content": "Thanks",
+                 "message_type": "text", "metadata": {}},
+            ],
+            "session_summary": None,
+            "created_at": "2025-07-22T22:30:00",
+            "updated_at": "2025-07-22T22:31:00",
+            "journal_seq": 7
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def test_codec_round_trip(self):
+        """Test decoding restores every field"""
+        data = session_codec.encode(self.snapshot)
+        decoded = session_codec.decode(data)
+
+        self.assertTrue(data.startswith(session_codec.MAGIC))
+        messages = [ConversationMessage.from_dict(m).to_dict() for m in decoded.pop('messages')]
+        self.assertEqual(messages, self.snapshot['messages'])
+        self.assertEqual(decoded, {k: v for k, v in self.snapshot.items() if k != 'messages'})
+
+    def test_codec_rejects_unknown_versions(self):
+        """Test a newer or damaged file is refused rather than misread"""
+        data = bytearray(session_codec.encode(self.snapshot))
+        data[len(session_codec.MAGIC)] = session_codec.VERSION + 1
+
+        with self.assertRaises(session_codec.SnapshotFormatError):
+            session_codec.decode(bytes(data))
+        with self.assertRaises(session_codec.SnapshotFormatError):
+            session_codec.decode(session_codec.encode(self.snapshot)[:-3])
+
+    def test_binary_storage_reads_existing_json(self):
+        """Test switching to binary keeps old JSON sessions readable and converts on save"""
+        json_memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        json_memory.add_message(self.phone, "user", "Stored as JSON")
+        json_memory.close()
+
+        storage = JsonFileStorage(self.storage_dir, snapshot_format="binary")
+        memory = ConversationMemory(storage=storage, flush_interval=0)
+        memory.add_message(self.phone, "assistant", "Now binary")
+        memory.close()
+
+        self.assertTrue(os.path.exists(storage._get_binary_file("1234567890")))
+        self.assertFalse(os.path.exists(storage._get_session_file("1234567890")))
+        self.assertEqual(storage.list_keys(), ["1234567890"])
+
+        reloaded = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        session = reloaded.get_or_create_session(self.phone)
+        self.assertEqual([m.content for m in session.messages], ["Stored as JSON", "Now binary"])
+
+
+class TestSessionJournal(unittest.TestCase):
+    """Test append-only session journal and snapshot compaction"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        self.phone = "+1234567890"
+        self.key = "1234567890"
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def _journal_lines(self):
+        with open(self.memory.storage._get_journal_file(self.key), encoding='utf-8') as f:
+            return f.readlines()
+
+    def test_changes_appended_not_rewritten(self):
+        """Test each change is one journal line and no snapshot is written"""
+        self.memory.add_message(self.phone, "user", "I need a laptop")
+        self.memory.update_user_preferences(self.phone, preferred_currency="EUR")
+        self.memory.add_user_interest(self.phone, "laptop")
+        self.memory.add_message(self.phone, "assistant", "Here are some laptops")
+
+        self.assertFalse(os.path.exists(self.memory.storage._get_session_file(self.key)))
+        records = [json.loads(line) for line in self._journal_lines()]
+        self.assertEqual([r['op'] for r in records], ['message', 'profile', 'profile', 'message'])
+        self.assertEqual([r['seq'] for r in records], [1, 2, 3, 4])
+
+    def test_session_recovered_from_journal(self):
+        """Test a restart replays the journal into the same session"""
+        self.memory.add_message(self.phone, "user", "My name is John")
+        self.memory.update_user_preferences(self.phone, name="John", preferred_currency="GBP")
+        self.memory.add_user_interest(self.phone, "gaming")
+        self.memory.add_message(self.phone, "assistant", "Hello John!")
+
+        reloaded = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        summary = reloaded.get_user_summary(self.phone)
+
+        self.assertEqual(summary['name'], "John")
+        self.assertEqual(summary['preferred_currency'], "GBP")
+        self.assertEqual(summary['interests'], ["gaming"])
+        self.assertEqual(summary['total_interactions'], 2)
+        self.assertEqual(summary['total_messages'], 2)
+        self.assertEqual(summary['session_created'], self.memory.get_user_summary(self.phone)['session_created'])
+
+    def test_compaction_writes_snapshot(self):
+        """Test journal is folded into a snapshot once it reaches the threshold"""
+        self.memory.journal_compact_threshold = 5
+        for i in range(7):
+            self.memory.add_message(self.phone, "user", f"Message {i}")
+
+        with open(self.memory.storage._get_session_file(self.key), encoding='utf-8') as f:
+            snapshot = json.load(f)
+        self.assertEqual(snapshot['journal_seq'], 5)
+        self.assertEqual(len(snapshot['messages']), 5)
+        self.assertEqual(len(self._journal_lines()), 2)
+
+        reloaded = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        session = reloaded.get_or_create_session(self.phone)
+        self.assertEqual([m.content for m in session.messages], [f"Message {i}" for i in range(7)])
+
+    def test_torn_trailing_record_discarded(self):
+        """Test a half-written last line from a crash is cut off on load"""
+        self.memory.add_message(self.phone, "user", "First")
+        self.memory.add_message(self.phone, "user", "Second")
+        with open(self.memory.storage._get_journal_file(self.key), 'a', encoding='utf-8') as f:
+            f.write('{"op": "message", "mess')
+
+        reloaded = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        session = reloaded.get_or_create_session(self.phone)
+        self.assertEqual([m.content for m in session.messages], ["First", "Second"])
+
+        reloaded.add_message(self.phone, "user", "Third")
+        again = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        session = again.get_or_create_session(self.phone)
+        self.assertEqual([m.content for m in session.messages], ["First", "Second", "Third"])
+
+    def test_records_in_snapshot_not_replayed_twice(self):
+        """Test a crash between snapshot and journal truncation does not duplicate messages"""
+        self.memory.add_message(self.phone, "user", "First")
+        self.memory.add_message(self.phone, "user", "Second")
+        journal = self._journal_lines()
+
+        self.memory._save_session(self.phone)
+        with open(self.memory.storage._get_journal_file(self.key), 'w', encoding='utf-8') as f:
+            f.writelines(journal)  # Journal survived the crash
+
+        reloaded = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        session = reloaded.get_or_create_session(self.phone)
+        self.assertEqual([m.content for m in session.messages], ["First", "Second"])
+        self.assertEqual(session.user_profile.total_interactions, 2)
+
+    def test_legacy_snapshot_still_loads(self):
+        """Test pre-journal session files load unchanged"""
+        legacy = {
+            "user_profile": {
+                "phone_number": self.phone, "name": "Alice", "preferred_currency": "USD",
+                "interests": ["smartphones"], "last_interaction": "2025-07-22T22:30:00",
+                "total_interactions": 1
+            },
+            "messages": [{
+                "timestamp": "2025-07-22T22:30:00", "role": "user", "content": "Hello",
+                "message_type": "text", "metadata": {}
+            }],
+            "session_summary": None,
+            "created_at": "2025-07-22T22:30:00",
+            "updated_at": "2025-07-22T22:30:00"
+        }
+        with open(self.memory.storage._get_session_file(self.key), 'w', encoding='utf-8') as f:
+            json.dump(legacy, f)
+
+        reloaded = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        reloaded.add_message(self.phone, "user", "I'm back")
+
+        again = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        session = again.get_or_create_session(self.phone)
+        self.assertEqual(session.user_profile.name, "Alice")
+        self.assertEqual([m.content for m in session.messages], ["Hello", "I'm back"])
+
+
+class TestLazySessionLoading(unittest.TestCase):
+    """Test on-demand loading and the LRU working set"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        seed = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        for i in range(5):
+            seed.add_message(f"+100000000{i}", "user", f"Hello from {i}")
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def test_startup_loads_nothing(self):
+        """Test construction does not read stored sessions"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+
+        self.assertEqual(len(memory.sessions), 0)
+        session = memory.get_or_create_session("+1000000003")
+        self.assertEqual(session.messages[0].content, "Hello from 3")
+        self.assertEqual(len(memory.sessions), 1)
+
+    def test_working_set_is_bounded(self):
+        """Test least recently used sessions are evicted and reload intact"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0, max_resident_sessions=2)
+
+        memory.add_message("+1000000000", "user", "Again")
+        memory.add_message("+1000000001", "user", "Again")
+        memory.add_message("+1000000002", "user", "Again")
+
+        self.assertEqual(len(memory.sessions), 2)
+        self.assertNotIn("1000000000", memory.sessions)
+        self.assertTrue(os.path.exists(memory.storage._get_session_file("1000000000")))
+        self.assertFalse(os.path.exists(memory.storage._get_journal_file("1000000000")))
+
+        session = memory.get_or_create_session("+1000000000")
+        self.assertEqual([m.content for m in session.messages], ["Hello from 0", "Again"])
+
+    def test_phone_formats_share_session(self):
+        """Test '+' and bare numbers resolve to the same session"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+
+        memory.add_message("1000000001", "user", "No plus")
+
+        session = memory.get_or_create_session("+1000000001")
+        self.assertEqual([m.content for m in session.messages], ["Hello from 1", "No plus"])
+
+    def test_summary_covers_non_resident_sessions(self):
+        """Test analytics include users outside the working set"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0, max_resident_sessions=1)
+
+        summaries = memory.get_all_users_summary()
+
+        self.assertEqual(len(summaries), 5)
+        self.assertEqual(len(memory.sessions), 0)
+
+
+class TestSQLiteStorage(unittest.TestCase):
+    """Test the SQLite storage backend and JSON migration"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.storage_dir, "sessions.db")
+        self.phone = "+1234567890"
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def _memory(self, **kwargs):
+        return ConversationMemory(storage=SQLiteStorage(self.db_path), flush_interval=0, **kwargs)
+
+    def test_session_round_trip(self):
+        """Test messages and profile survive a restart"""
+        memory = self._memory()
+        memory.add_message(self.phone, "user", "My name is John", metadata={"intent": "greeting"})
+        memory.update_user_preferences(self.phone, name="John", preferred_currency="EUR")
+        memory.add_user_interest(self.phone, "laptops")
+        memory.add_message(self.phone, "assistant", "Hello John!")
+        memory.close()
+
+        reloaded = self._memory()
+        session = reloaded.get_or_create_session(self.phone)
+        self.assertEqual(session.user_profile.name, "John")
+        self.assertEqual(session.user_profile.preferred_currency, "EUR")
+        self.assertEqual(session.user_profile.interests, ["laptops"])
+        self.assertEqual(session.user_profile.total_interactions, 2)
+        self.assertEqual([m.content for m in session.messages], ["My name is John", "Hello John!"])
+        self.assertEqual(session.messages[0].metadata, {"intent": "greeting"})
+        reloaded.close()
+
+    def test_phone_number_kept_as_given(self):
+        """Test a session first created by a message keeps the number's original form"""
+        memory = self._memory()
+        memory.add_message("+15551234", "user", "Hi")
+        memory.close()
+
+        reloaded = self._memory()
+        self.assertEqual(reloaded.get_or_create_session("+15551234").user_profile.phone_number, "+15551234")
+        self.assertEqual([user["phone_number"] for user in reloaded.get_all_users_summary()], ["+15551234"])
+        reloaded.close()
+
+    def test_load_reads_recent_messages_only(self):
+        """Test history is kept but only the last messages are loaded"""
+        memory = self._memory()
+        memory.max_messages_per_session = 3
+        for i in range(6):
+            memory.add_message(self.phone, "user", f"Message {i}")
+        memory.close()
+
+        reloaded = self._memory()
+        reloaded.max_messages_per_session = 3
+        session = reloaded.get_or_create_session(self.phone)
+        self.assertEqual([m.content for m in session.messages], ["Message 3", "Message 4", "Message 5"])
+        self.assertEqual(session.user_profile.total_interactions, 6)
+        count = reloaded.storage._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+        self.assertEqual(count, 6)
+        reloaded.close()
+
+    def test_wal_mode_and_indexes(self):
+        """Test the database uses WAL and indexes messages by phone and timestamp"""
+        storage = SQLiteStorage(self.db_path)
+        mode = storage._conn.execute("PRAGMA journal_mode").fetchone()[0]
+        indexes = [row[1] for row in storage._conn.execute("PRAGMA index_list(messages)")]
+        storage.close()
+
+        self.assertEqual(mode, "wal")
+        self.assertIn("idx_messages_phone_time", indexes)
+
+    def test_cleanup_and_summaries(self):
+        """Test analytics and cleanup work against the database"""
+        memory = self._memory()
+        memory.add_message("+111", "user", "Hi")
+        memory.add_message("+222", "user", "Hello")
+        memory.update_user_preferences("+222", last_interaction="2000-01-01T00:00:00")
+
+        self.assertEqual(len(memory.get_all_users_summary()), 2)
+        memory.cleanup_old_sessions(days_old=30)
+        self.assertEqual(memory.storage.list_keys(), ["111"])
+        memory.close()
+
+    def test_backend_selected_by_config(self):
+        """Test create_storage honours the backend name"""
+        storage = create_storage("sqlite", storage_dir=self.storage_dir)
+        self.assertIsInstance(storage, SQLiteStorage)
+        self.assertEqual(storage.db_path, self.db_path)
+        storage.close()
+        self.assertIsInstance(create_storage("json", storage_dir=self.storage_dir), JsonFileStorage)
+        with self.assertRaises(ValueError):
+            create_storage("mongo", storage_dir=self.storage_dir)
+
+    def test_migrate_json_sessions(self):
+        """Test the migration tool imports snapshots and replays journals"""
+        source = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        source.journal_compact_threshold = 2
+        source.add_message(self.phone, "user", "First")
+        source.add_message(self.phone, "user", "Second")
+        source.add_message(self.phone, "assistant", "Third")  # Left in the journal
+        source.update_user_preferences("+1999", name="Ann")
+
+        self.assertEqual(migrate(self.storage_dir, self.db_path, batch_size=1), 2)
+
+        memory = self._memory()
+        session = memory.get_or_create_session(self.phone)
+        self.assertEqual([m.content for m in session.messages], ["First", "Second", "Third"])
+        self.assertEqual(memory.get_user_summary("+1999")['name'], "Ann")
+        memory.close()
+
+    def test_migrate_starts_no_background_work(self):
+        """Test the source memory runs no sweeper or flusher and is closed afterwards"""
+        ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0).add_message(
+            self.phone, "user", "Hello")
+
+        with patch('migrate_sessions.ConversationMemory', wraps=ConversationMemory) as memory_class, \
+                patch.object(ConversationMemory, 'close', autospec=True,
+                             side_effect=ConversationMemory.close) as close:
+            self.assertEqual(migrate(self.storage_dir, self.db_path), 1)
+
+        kwargs = memory_class.call_args.kwargs
+        self.assertEqual((kwargs["retention_days"], kwargs["flush_interval"]), (0, 0))
+        close.assert_called_once()
+
+
+class TestWriteBehind(unittest.TestCase):
+    """Test buffered, batched session persistence"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.phone = "+1234567890"
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def _wait_for(self, condition, timeout=2.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.01)
+        return False
+
+    def test_changes_coalesced_into_one_write(self):
+        """Test a full message exchange reaches storage as one batch"""
+        storage = JsonFileStorage(self.storage_dir)
+        memory = ConversationMemory(storage=storage, flush_interval=60)
+
+        with patch.object(storage, 'append_many', wraps=storage.append_many) as append_many:
+            memory.add_message(self.phone, "user", "Convert 100 USD to EUR")
+            memory.update_user_preferences(self.phone, preferred_currency="USD")
+            memory.add_user_interest(self.phone, "laptop")
+            memory.add_message(self.phone, "assistant", "100 USD = 85 EUR")
+            self.assertFalse(os.path.exists(storage._get_journal_file("1234567890")))
+
+            memory.flush()
+            append_many.assert_called_once()
+
+        reloaded = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        session = reloaded.get_or_create_session(self.phone)
+        self.assertEqual(len(session.messages), 2)
+        self.assertEqual(session.user_profile.interests, ["laptop"])
+        memory.close()
+
+    def test_flushed_on_interval(self):
+        """Test the background flusher bounds the durability window"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0.05)
+        memory.add_message(self.phone, "user", "Hello")
+
+        self.assertTrue(self._wait_for(lambda: os.path.exists(memory.storage._get_journal_file("1234567890"))))
+        memory.close()
+
+    def test_flushed_early_when_buffer_fills(self):
+        """Test reaching the pending-record threshold triggers a flush"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir),
+                                    flush_interval=60, flush_max_pending=3)
+        for i in range(3):
+            memory.add_message(self.phone, "user", f"Message {i}")
+
+        self.assertTrue(self._wait_for(lambda: not memory._dirty))
+        memory.close()
+
+    def test_eviction_flushes_buffered_changes(self):
+        """Test an evicted session is persisted before it leaves memory"""
+        db_path = os.path.join(self.storage_dir, "sessions.db")
+        memory = ConversationMemory(storage=SQLiteStorage(db_path), flush_interval=60, max_resident_sessions=1)
+        memory.add_message("+111", "user", "First user")
+        memory.add_message("+222", "user", "Second user")
+
+        session = memory.get_or_create_session("+111")
+        self.assertEqual([m.content for m in session.messages], ["First user"])
+        memory.close()
+
+    def test_eviction_waits_for_in_flight_flush(self):
+        """Test a session is not evicted while a flush still holds its unwritten records"""
+        db_path = os.path.join(self.storage_dir, "sessions.db")
+        storage = SQLiteStorage(db_path)
+        memory = ConversationMemory(storage=storage, flush_interval=60, max_resident_sessions=1)
+        memory.add_message("+111", "user", "Hello")
+        memory.add_message("+111", "assistant", "Hi there")
+
+        real_append_many = storage.append_many
+        def slow_append_many(records):
+            records = list(records)
+            time.sleep(0.2)
+            real_append_many(records)
+
+        with patch.object(storage, 'append_many', side_effect=slow_append_many):
+            flusher = threading.Thread(target=memory.flush)
+            flusher.start()
+            self.assertTrue(self._wait_for(lambda: not memory._dirty))
+            memory.add_message("+222", "user", "Second user")
+            session = memory.get_or_create_session("+111")
+            flusher.join()
+
+        self.assertEqual([m.content for m in session.messages], ["Hello", "Hi there"])
+        self.assertEqual(session.user_profile.total_interactions, 2)
+        memory.close()
+
+    def test_close_flushes(self):
+        """Test shutdown persists everything still buffered"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=60)
+        memory.add_message(self.phone, "user", "Goodbye")
+        memory.close()
+
+        reloaded = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        session = reloaded.get_or_create_session(self.phone)
+        self.assertEqual([m.content for m in session.messages], ["Goodbye"])
+
+
+class TestConcurrentAccess(unittest.TestCase):
+    """Test per-session locking under concurrent use"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def test_no_lost_messages_under_contention(self):
+        """Test concurrent writers with eviction and compaction lose nothing"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir),
+                                    max_resident_sessions=2, flush_interval=0.01)
+        memory.max_messages_per_session = 1000
+        memory.journal_compact_threshold = 7
+        phones = [f"+100{i}" for i in range(4)]
+
+        def writer(worker):
+            for i in range(25):
+                phone = phones[(worker + i) % len(phones)]
+                memory.add_message(phone, "user", f"w{worker}-{i}")
+                memory.add_user_interest(phone, f"topic{worker}")
+
+        threads = [threading.Thread(target=writer, args=(w,)) for w in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        memory.close()
+
+        reloaded = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        reloaded.max_messages_per_session = 1000
+        contents = []
+        for phone in phones:
+            session = reloaded.get_or_create_session(phone)
+            self.assertEqual(session.user_profile.total_interactions, len(session.messages))
+            contents.extend(m.content for m in session.messages)
+        self.assertEqual(sorted(contents), sorted(f"w{w}-{i}" for w in range(8) for i in range(25)))
+
+    def test_busy_session_not_evicted(self):
+        """Test eviction skips a session another request is using"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir),
+                                    max_resident_sessions=1, flush_interval=0)
+        memory.add_message("+111", "user", "Hello")
+
+        with memory._session_lock("+111"):
+            memory.get_or_create_session("+222")
+            self.assertIn("111", memory.sessions)
+
+        memory.get_or_create_session("+333")
+        self.assertNotIn("111", memory.sessions)
+        self.assertEqual(memory._session_locks, {})
+
+    def test_users_do_not_block_each_other(self):
+        """Test a held session lock only blocks that user"""
+        memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        holding = threading.Event()
+        release = threading.Event()
+
+        def hold():
+            with memory._session_lock("+111"):
+                holding.set()
+                release.wait(5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        self.assertTrue(holding.wait(5))
+
+        done = threading.Event()
+        other = threading.Thread(target=lambda: (memory.add_message("+222", "user", "Hi"), done.set()))
+        other.start()
+        self.assertTrue(done.wait(5))
+
+        release.set()
+        holder.join()
+        other.join()
+
+
+class TestContextCache(unittest.TestCase):
+    """Test the incrementally maintained prompt context"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        self.phone = "+1234567890"
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def _expected_context(self, last_n=10):
+        session = self.memory.get_or_create_session(self.phone)
+        profile = session.user_profile
+        lines = [
+            f"User Profile: {profile.name or 'Unknown'} ({self.phone})",
+            f"Preferred Currency: {profile.preferred_currency}",
+            f"Total Interactions: {profile.total_interactions}",
+            f"Interests: {', '.join(profile.interests) if profile.interests else 'None yet'}",
+            "",
+            "Recent Conversation History:"
+        ]
+        for msg in session.messages[-last_n:]:
+            lines.append(f"[{msg.timestamp[11:16]}] {msg.role.upper()}: {msg.content}")
+        return "\n".join(lines)
+
+    def test_context_matches_full_render(self):
+        """Test the cached context stays identical to rendering from scratch"""
+        for i in range(15):
+            self.memory.add_message(self.phone, "user" if i % 2 else "assistant", f"Message {i}")
+            self.assertEqual(self.memory.get_conversation_context(self.phone), self._expected_context())
+
+        self.memory.update_user_preferences(self.phone, name="John")
+        self.memory.add_user_interest(self.phone, "laptops")
+        self.assertEqual(self.memory.get_conversation_context(self.phone), self._expected_context())
+        self.assertEqual(self.memory.get_conversation_context(self.phone, last_n_messages=3),
+                         self._expected_context(last_n=3))
+
+    def test_only_new_messages_rendered(self):
+        """Test each message is rendered once and unchanged sessions reuse the text"""
+        for i in range(30):
+            self.memory.add_message(self.phone, "user", f"Message {i}")
+
+        with patch.object(ConversationMemory, '_render_context_line',
+                          wraps=ConversationMemory._render_context_line) as render:
+            first = self.memory.get_conversation_context(self.phone)
+            self.assertEqual(render.call_count, 10)
+
+            self.assertIs(self.memory.get_conversation_context(self.phone), first)
+            self.assertEqual(render.call_count, 10)
+
+            self.memory.add_message(self.phone, "assistant", "Reply")
+            context = self.memory.get_conversation_context(self.phone)
+            self.assertEqual(render.call_count, 11)
+
+        self.assertTrue(context.endswith("ASSISTANT: Reply"))
+        self.assertNotIn("Message 20", context)
+
+
+class TestAnalyticsIndex(unittest.TestCase):
+    """Test the incrementally maintained user analytics"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def _full_scan(self, memory):
+        """Analytics as computed by walking every session"""
+        users = memory.get_all_users_summary()
+        interests = {}
+        for user in users:
+            for interest in user["interests"]:
+                interests[interest] = interests.get(interest, 0) + 1
+        return {
+            "total_users": len(users),
+            "total_interactions": sum(user["total_interactions"] for user in users),
+            "active_users_24h": len([user for user in users if user["last_interaction"] and
+                                     (datetime.now() - datetime.fromisoformat(user["last_interaction"])).days < 1]),
+            "top_interests": sorted(interests.items(), key=lambda x: (-x[1], x[0]))[:5]
+        }
+
+    def _indexed(self, memory):
+        analytics = memory.get_users_analytics()
+        return dict(analytics["summary"], total_users=analytics["total_users"])
+
+    def test_matches_full_scan(self):
+        """Test incremental updates agree with a scan after every kind of change"""
+        self.memory.add_message("+111", "user", "Hello")
+        self.assertEqual(self._indexed(self.memory), self._full_scan(self.memory))
+
+        self.memory.add_message("+222", "user", "Hi")
+        self.memory.add_user_interest("+111", "laptops")
+        self.memory.add_user_interest("+222", "laptops")
+        self.memory.add_user_interest("+222", "phones")
+        self.memory.update_user_preferences("+111", interests=["tablets"])
+        self.memory.add_message("+333", "user", "Hey")
+        self.memory.update_user_preferences("+333", last_interaction="2000-01-01T00:00:00")
+        self.assertEqual(self._indexed(self.memory), self._full_scan(self.memory))
+        self.assertEqual(self._indexed(self.memory)["active_users_24h"], 2)
+        self.assertEqual(self._indexed(self.memory)["top_interests"][0], ("laptops", 1))
+
+        self.memory.cleanup_old_sessions(days_old=30)
+        self.assertEqual(self._indexed(self.memory), self._full_scan(self.memory))
+        self.assertEqual(self._indexed(self.memory)["total_users"], 2)
+
+    def test_bootstraps_once_from_storage(self):
+        """Test the index is seeded from stored sessions on first read only"""
+        for phone in ("+111", "+222"):
+            self.memory.add_message(phone, "user", "Hello")
+            self.memory.add_user_interest(phone, "laptops")
+
+        restarted = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        with patch.object(restarted, '_iter_all_sessions', wraps=restarted._iter_all_sessions) as scan:
+            first = restarted.get_users_analytics()
+            restarted.add_message("+333", "user", "Hi")
+            second = restarted.get_users_analytics()
+        self.assertEqual(scan.call_count, 1)
+
+        self.assertEqual(first["total_users"], 2)
+        self.assertEqual(first["summary"]["top_interests"], [("laptops", 2)])
+        self.assertEqual(second["total_users"], 3)
+        self.assertEqual(second["summary"]["total_interactions"], 3)
+        self.assertEqual([user["phone_number"] for user in second["users"]], ["+111", "+222", "+333"])
+
+    def test_rebuild_swaps_in_complete_index(self):
+        """Test readers see the old index until a rebuild finishes, and changes made meanwhile are kept"""
+        index = AnalyticsIndex()
+        index.rebuild((f"{i:03d}", {"interests": ["laptops"], "total_interactions": 1}) for i in range(300))
+        seen_during_rebuild = []
+
+        def slow_rows():
+            for i in range(300):
+                if i == 150:
+                    seen_during_rebuild.append((index.summary()["total_users"], len(index.users())))
+                    index.update("new", {"interests": [], "total_interactions": 5})
+                    index.remove("000")
+                yield f"{i:03d}", {"interests": ["phones"], "total_interactions": 2}
+
+        index.rebuild(slow_rows())
+
+        self.assertEqual(seen_during_rebuild, [(300, 300)])
+        summary = index.summary()
+        self.assertEqual((summary["total_users"], summary["total_interactions"]), (300, 603))
+        self.assertEqual(summary["top_interests"], [("phones", 299)])
+
+    def test_concurrent_stale_reads_rebuild_once(self):
+        """Test callers arriving during a rebuild wait for it instead of walking storage again"""
+        index = AnalyticsIndex()
+        walks = []
+
+        def rows():
+            walks.append(1)
+            time.sleep(0.1)
+            return [("a", {"interests": [], "total_interactions": 1})]
+
+        threads = [threading.Thread(target=index.ensure_ready, args=(rows,)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(walks), 1)
+        self.assertEqual(index.summary()["total_users"], 1)
+
+    def test_active_users_window_edges(self):
+        """Test only the bucket straddling the window start is checked per user"""
+        index = AnalyticsIndex()
+        now = time.time()
+        for key, age in (("a", 60), ("b", 23.5 * 3600), ("c", 24 * 3600 + 60), ("d", 3 * 86400)):
+            seen = datetime.fromtimestamp(now - age).isoformat()
+            index.update(key, {"interests": [], "total_interactions": 1, "last_interaction": seen})
+        self.assertEqual(index.active_users(now=now), 2)
+
+        index.remove("a")
+        self.assertEqual(index.active_users(now=now), 1)
+
+
+class TestRetention(unittest.TestCase):
+    """Test the expiry index and background retention sweeper"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def test_expiry_index_lazy_deletion(self):
+        """Test superseded and removed entries are never returned"""
+        index = ExpiryIndex()
+        index.touch("a", "2000-01-01T00:00:00")
+        index.touch("b", "2000-01-02T00:00:00")
+        index.touch("c", "2000-01-03T00:00:00")
+        index.touch("a", datetime.now().isoformat())
+        index.remove("b")
+
+        cutoff = datetime(2001, 1, 1).timestamp()
+        self.assertEqual(index.pop_expired(cutoff, limit=10), ["c"])
+        self.assertEqual(index.pop_expired(cutoff, limit=10), [])
+        self.assertIn("a", index)
+
+        for i in range(500):
+            index.touch("a", f"2020-01-01T00:00:{i % 60:02d}.{i:06d}")
+        self.assertLess(len(index._heap), 200)
+
+    def test_cleanup_only_visits_expired_sessions(self):
+        """Test cleanup walks storage once to seed the index, then loads only stale sessions"""
+        for i in range(6):
+            self.memory.add_message(f"+100{i}", "user", "Hello")
+        for i in range(3):
+            self.memory.update_user_preferences(f"+100{i}", last_interaction=f"2000-01-0{i + 1}T00:00:00")
+
+        with patch.object(self.memory, '_iter_all_sessions', wraps=self.memory._iter_all_sessions) as scan:
+            self.assertEqual(self.memory.cleanup_old_sessions(days_old=30), 3)
+            self.memory.update_user_preferences("+1003", last_interaction="2000-01-01T00:00:00")
+            self.assertEqual(self.memory.cleanup_old_sessions(days_old=30), 1)
+        self.assertEqual(scan.call_count, 1)
+
+        self.assertEqual(sorted(self.memory.storage.list_keys()), ["1004", "1005"])
+        self.assertEqual(self.memory.get_users_analytics()["total_users"], 2)
+
+    def test_recently_active_sessions_survive(self):
+        """Test the index's latest interaction wins over superseded entries"""
+        self.memory.add_message("+111", "user", "Hello")
+        self.memory.update_user_preferences("+111", last_interaction="2000-01-01T00:00:00")
+        self.memory.retention.ensure_ready(lambda: [])
+        self.memory.retention.touch("111", datetime.now().isoformat())
+
+        self.assertEqual(self.memory.cleanup_old_sessions(days_old=30), 0)
+        self.assertEqual(self.memory.storage.list_keys(), ["111"])
+
+    def test_sweeper_runs_after_interval(self):
+        """Test the sweeper waits one interval, then expires in batches until done"""
+        calls = []
+        batches = iter([(2, 2), (2, 1), (1, 1)])
+        sweeper = RetentionSweeper(lambda cutoff, limit: calls.append(limit) or next(batches, (0, 0)),
+                                   max_age_days=30, interval=0.05, batch_size=2)
+        sweeper.start()
+        self.assertEqual(calls, [])
+        time.sleep(0.2)
+        sweeper.stop()
+
+        self.assertEqual(calls[:3], [2, 2, 2])
+        self.assertFalse(sweeper._thread.is_alive())
+
+
+class TestSessionArchive(unittest.TestCase):
+    """Test the compressed cold-storage tier"""
+
+    def setUp(self):
+        self.storage_dir = tempfile.mkdtemp()
+        self.archive_dir = os.path.join(self.storage_dir, "archive")
+        self.memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0,
+                                         archive=SessionArchive(self.archive_dir))
+
+    def tearDown(self):
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+
+    def _snapshot(self, phone, content):
+        return {"user_profile": UserProfile(phone_number=phone).to_dict(),
+                "messages": [{"timestamp": "2025-07-22T22:30:00", "role": "user", "content": content,
+                              "message_type": "text", "metadata": {}}],
+                "session_summary": None, "created_at": None, "updated_at": None, "journal_seq": 0}
+
+    def test_segments_are_append_only(self):
+        """Test entries share a daily segment and the index survives a reopen"""
+        archive = SessionArchive(self.archive_dir)
+        archive.archive("111", self._snapshot("+111", "first"))
+        archive.archive("222", self._snapshot("+222", "second"))
+        archive.archive("111", self._snapshot("+111", "updated"))
+        archive.discard("222")
+
+        segments = [name for name in os.listdir(self.archive_dir) if name.endswith(".gz")]
+        self.assertEqual(len(segments), 1)
+
+        reopened = SessionArchive(self.archive_dir)
+        self.assertEqual(reopened.keys(), ["111"])
+        self.assertEqual(reopened.restore("111")["messages"][0]["content"], "updated")
+        self.assertIsNone(reopened.restore("222"))
+
+    def test_torn_index_line_dropped(self):
+        """Test a crash mid index write loses only that entry"""
+        archive = SessionArchive(self.archive_dir)
+        archive.archive("111", self._snapshot("+111", "kept"))
+        with open(os.path.join(self.archive_dir, "index.jsonl"), "a") as f:
+            f.write('{"key": "222", "segm')
+
+        reopened = SessionArchive(self.archive_dir)
+        self.assertEqual(reopened.keys(), ["111"])
+        reopened.archive("333", self._snapshot("+333", "after"))
+        self.assertEqual(SessionArchive(self.archive_dir).keys(), ["111", "333"])
+
+    def test_entry_survives_index_compaction(self):
+        """Test the entry whose append triggers compaction is kept in the rewritten index"""
+        archive = SessionArchive(self.archive_dir)
+        for i in range(500):
+            archive.archive(str(i), self._snapshot(f"+{i}", "old"))
+            archive.discard(str(i))
+        archive.archive("keep", self._snapshot("+keep", "kept"))
+
+        reopened = SessionArchive(self.archive_dir)
+        self.assertIn("keep", reopened)
+        self.assertEqual(reopened.restore("keep")["messages"][0]["content"], "kept")
+
+    def test_expired_sessions_archived_and_rehydrated(self):
+        """Test cleanup moves sessions to the archive and a returning user gets them back"""
+        self.memory.add_message("+111", "user", "Hello")
+        self.memory.add_user_interest("+111", "laptops")
+        self.memory.update_user_preferences("+111", last_interaction="2000-01-01T00:00:00")
+        self.memory.add_message("+222", "user", "Hi")
+
+        self.assertEqual(self.memory.cleanup_old_sessions(days_old=30), 1)
+        self.assertEqual(self.memory.storage.list_keys(), ["222"])
+        self.assertEqual(self.memory.archive.keys(), ["111"])
+
+        restarted = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0,
+                                       archive=SessionArchive(self.archive_dir))
+        restarted.add_message("+111", "user", "I'm back")
+        session = restarted.get_or_create_session("+111")
+        self.assertEqual([msg.content for msg in session.messages], ["Hello", "I'm back"])
+        self.assertEqual(session.user_profile.interests, ["laptops"])
+        self.assertEqual(restarted.storage.list_keys(), ["111", "222"])
+        self.assertNotIn("111", SessionArchive(self.archive_dir))
+
+
+class TestRedisStorage(unittest.TestCase):
+    """Test the shared Redis backend against the in-process fake"""
+
+    def setUp(self):
+        self.redis = FakeRedis()
+        self.phone = "+1234567890"
+
+    def _worker(self, **kwargs):
+        """A ConversationMemory as seen by one gunicorn worker"""
+        return ConversationMemory(storage=RedisStorage(self.redis, **kwargs))
+
+    def test_workers_share_one_view(self):
+        """Test a change made by one worker is seen by the next request on another"""
+        worker_a, worker_b = self._worker(), self._worker()
+
+        worker_a.add_message(self.phone, "user", "I want a laptop")
+        worker_b.update_user_preferences(self.phone, name="John", preferred_currency="EUR")
+        worker_b.add_message(self.phone, "assistant", "Here are some laptops")
+        worker_a.add_user_interest(self.phone, "laptops")
+
+        for worker in (worker_a, worker_b):
+            session = worker.get_or_create_session(self.phone)
+            self.assertEqual([m.content for m in session.messages], ["I want a laptop", "Here are some laptops"])
+            self.assertEqual(session.user_profile.name, "John")
+            self.assertEqual(session.user_profile.interests, ["laptops"])
+            self.assertEqual(session.user_profile.total_interactions, 2)
+
+    def test_phone_number_kept_as_given(self):
+        """Test a session first created by a message keeps the number's original form"""
+        self._worker().add_message("+15551234", "user", "Hi")
+
+        session = self._worker().get_or_create_session("+15551234")
+        self.assertEqual(session.user_profile.phone_number, "+15551234")
+
+    def test_no_local_cache_or_write_behind(self):
+        """Test shared storage is written through and not kept resident"""
+        memory = self._worker()
+        self.assertEqual(memory.flush_interval, 0)
+
+        memory.add_message(self.phone, "user", "Hello")
+
+        self.assertEqual(len(memory.sessions), 0)
+        self.assertEqual(self.redis.hgetall("wsa:profile:1234567890")['total_interactions'], "1")
+
+    def test_history_is_capped(self):
+        """Test the message list is trimmed to the history limit"""
+        memory = self._worker(history_limit=3)
+        for i in range(5):
+            memory.add_message(self.phone, "user", f"Message {i}")
+
+        self.assertEqual(len(self.redis.lrange("wsa:messages:1234567890", 0, -1)), 3)
+        session = memory.get_or_create_session(self.phone)
+        self.assertEqual([m.content for m in session.messages], ["Message 2", "Message 3", "Message 4"])
+        self.assertEqual(session.user_profile.total_interactions, 5)
+
+    def test_one_pipeline_per_change(self):
+        """Test each change is a single round trip"""
+        memory = self._worker()
+        memory.add_message(self.phone, "user", "Hello")
+
+        with patch.object(self.redis, 'pipeline', wraps=self.redis.pipeline) as pipeline:
+            memory.update_user_preferences(self.phone, name="John")
+
+        # One pipeline to load the session, one to write the change
+        self.assertEqual(pipeline.call_count, 2)
+
+    def test_analytics_refreshed_from_profiles_in_background(self):
+        """Test a stale index is served while profiles (not message lists) are reread off the request"""
+        worker_a, worker_b = self._worker(), self._worker()
+        worker_a.add_message("+111", "user", "Hello")
+        worker_a.add_user_interest("+111", "laptops")
+        self.assertEqual(worker_b.get_analytics_summary()["total_users"], 1)
+
+        worker_a.add_message("+222", "user", "Hi")
+        worker_b.analytics.max_age = 0
+        storage_read = threading.Event()
+        iter_profiles = worker_b.storage.iter_profiles
+
+        def gated_iter_profiles():
+            storage_read.wait(2)
+            yield from iter_profiles()
+
+        with patch.object(self.redis, 'lrange', wraps=self.redis.lrange) as lrange, \
+                patch.object(worker_b.storage, 'iter_profiles', side_effect=gated_iter_profiles):
+            self.assertEqual(worker_b.get_analytics_summary()["total_users"], 1)  # Stale, not blocked
+            storage_read.set()
+            with worker_b.analytics._rebuild_lock:  # Held until the background refresh is done
+                pass
+            worker_b.analytics.max_age = 60
+            analytics = worker_b.get_users_analytics()
+        lrange.assert_not_called()
+
+        self.assertEqual(analytics["total_users"], 2)
+        self.assertEqual(analytics["summary"]["top_interests"], [("laptops", 1)])
+        self.assertEqual([(user["phone_number"], user["total_messages"]) for user in analytics["users"]],
+                         [("+111", 1), ("+222", 1)])
+
+    def test_index_listing_and_cleanup(self):
+        """Test analytics and cleanup walk the session index"""
+        memory = self._worker()
+        memory.add_message("+222", "user", "Hello")
+        memory.add_message("+111", "user", "Hi")
+        self.redis.hset("wsa:profile:222", "last_interaction", "2000-01-01T00:00:00")
+
+        self.assertEqual(memory.storage.list_keys(), ["111", "222"])
+        self.assertEqual(len(memory.get_all_users_summary()), 2)
+
+        memory.cleanup_old_sessions(days_old=30)
+        self.assertEqual(memory.storage.list_keys(), ["111"])
+        self.assertEqual(self.redis.hgetall("wsa:profile:222"), {})
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
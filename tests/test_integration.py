@@ -11,8 +11,9 @@ import time
 # Add src directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
+import whatsapp_integration
 from whatsapp_integration import WhatsAppBot, app
-from sales_agent import CurrencyConverter
+from agent_core import CurrencyConverter
 
 
 class TestEndToEndIntegration(unittest.TestCase):
@@ -23,8 +24,8 @@ class TestEndToEndIntegration(unittest.TestCase):
         self.app.testing = True
         self.bot = WhatsAppBot()
     
-    @patch('requests.post')
-    @patch('requests.get')
+    @patch('requests.Session.post')
+    @patch('requests.Session.get')
     @patch('whatsapp_integration.get_ai_response')
     def test_complete_whatsapp_workflow(self, mock_ai_response, mock_get, mock_post):
         """Test complete WhatsApp message workflow"""
@@ -63,6 +64,7 @@ class TestEndToEndIntegration(unittest.TestCase):
         
         # Verify response
         self.assertEqual(response.status_code, 200)
+        self.assertTrue(whatsapp_integration.message_queue.join(timeout=5))
         
         # Verify AI was called with WhatsApp context
         mock_ai_response.assert_called_once()
@@ -76,7 +78,7 @@ class TestEndToEndIntegration(unittest.TestCase):
         self.assertEqual(sent_payload['to'], '1234567890')
         self.assertIn('85 EUR', sent_payload['text']['body'])
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_currency_converter_real_workflow(self, mock_get):
         """Test currency converter with realistic data"""
         # Mock realistic API response
@@ -117,7 +119,7 @@ class TestEndToEndIntegration(unittest.TestCase):
             result = self.bot.format_for_whatsapp(input_text)
             self.assertIn(expected_part, result)
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_error_handling_workflow(self, mock_post):
         """Test error handling in complete workflow"""
         # Test WhatsApp API failure
@@ -168,7 +170,7 @@ class TestPerformanceAndReliability(unittest.TestCase):
             self.assertEqual(agent2, agent3)
             mock_get_agent.assert_called_once()
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_currency_api_timeout_handling(self, mock_get):
         """Test handling of API timeouts"""
         import requests
@@ -179,6 +181,29 @@ class TestPerformanceAndReliability(unittest.TestCase):
         
         self.assertIn('Error', result)
     
+    def test_http_session_pooled_and_reused(self):
+        """Test outbound calls share one pooled, retrying session"""
+        import http_client
+
+        session = http_client.get_session()
+        self.assertIs(session, http_client.get_session())
+
+        adapter = session.get_adapter('https://graph.facebook.com')
+        self.assertEqual(adapter._pool_maxsize, http_client.HTTP_POOL_SIZE)
+        self.assertEqual(adapter.max_retries.total, http_client.HTTP_MAX_RETRIES)
+        self.assertNotIn('POST', adapter.max_retries.allowed_methods)
+
+    @patch('requests.Session.post')
+    def test_send_message_uses_default_timeouts(self, mock_post):
+        """Test WhatsApp sends go through the shared client with timeouts"""
+        import http_client
+        mock_post.return_value.status_code = 200
+
+        self.bot.send_message("1234567890", "Test message")
+
+        self.assertEqual(mock_post.call_args[1]['timeout'],
+                         (http_client.HTTP_CONNECT_TIMEOUT, http_client.HTTP_READ_TIMEOUT))
+
     def test_concurrent_message_processing(self):
         """Test handling of multiple concurrent messages"""
         import threading
@@ -253,7 +278,7 @@ class TestSecurityAndValidation(unittest.TestCase):
         ]
         
         for number in test_numbers:
-            with patch('requests.post') as mock_post:
+            with patch('requests.Session.post') as mock_post:
                 mock_post.return_value.status_code = 200
                 # Should not crash with any input
                 result = bot.send_message(number, "Test message")
@@ -9,7 +9,8 @@ import os
 # Add src directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from sales_agent import get_sales_agent, get_ai_response, CurrencyConverter
+import agent_core
+from agent_core import get_sales_agent, get_ai_response, reset_sales_agent, CurrencyConverter
 
 
 class TestCurrencyConverter(unittest.TestCase):
@@ -18,7 +19,7 @@ class TestCurrencyConverter(unittest.TestCase):
     def setUp(self):
         self.converter = CurrencyConverter()
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_convert_currency_success(self, mock_get):
         """Test successful currency conversion"""
         # Mock API response
@@ -36,7 +37,7 @@ class TestCurrencyConverter(unittest.TestCase):
         self.assertIn('100.00 USD', result)
         self.assertIn('0.8500', result)
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_convert_currency_invalid_currency(self, mock_get):
         """Test conversion with invalid currency"""
         mock_response = Mock()
@@ -51,7 +52,7 @@ class TestCurrencyConverter(unittest.TestCase):
         
         self.assertIn('not supported', result)
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_convert_currency_api_error(self, mock_get):
         """Test API error handling"""
         mock_response = Mock()
@@ -62,7 +63,7 @@ class TestCurrencyConverter(unittest.TestCase):
         
         self.assertIn('Error fetching', result)
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_get_exchange_rates_success(self, mock_get):
         """Test getting exchange rates"""
         mock_response = Mock()
@@ -79,6 +80,143 @@ class TestCurrencyConverter(unittest.TestCase):
         self.assertIn('0.8500', result)
         self.assertIn('2025-07-22', result)
     
+    @patch('requests.Session.get')
+    def test_rate_table_cached_across_tools(self, mock_get):
+        """Test repeat conversions and rate lookups reuse one fetch"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            'rates': {'EUR': 0.85, 'GBP': 0.75},
+            'date': '2025-07-22'
+        }
+        mock_get.return_value = mock_response
+
+        self.converter.convert_currency(100, 'USD', 'EUR')
+        self.converter.convert_currency(200, 'usd', 'GBP')
+        self.converter.get_exchange_rates('USD')
+
+        mock_get.assert_called_once()
+        self.assertEqual(self.converter.rate_cache.stats()['hits'], 2)
+
+    @patch('requests.Session.get')
+    def test_rate_cache_expires(self, mock_get):
+        """Test stale rate tables are refetched after the TTL"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'rates': {'EUR': 0.85}, 'date': '2025-07-22'}
+        mock_get.return_value = mock_response
+
+        converter = CurrencyConverter(cache_ttl=0)
+        converter.convert_currency(100, 'USD', 'EUR')
+        converter.convert_currency(100, 'USD', 'EUR')
+
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('requests.Session.get')
+    def test_rate_errors_not_cached(self, mock_get):
+        """Test failed fetches are retried on the next call"""
+        mock_response = Mock()
+        mock_response.status_code = 500
+        mock_get.return_value = mock_response
+
+        self.converter.convert_currency(100, 'USD', 'EUR')
+        self.converter.convert_currency(100, 'USD', 'EUR')
+
+        self.assertEqual(mock_get.call_count, 2)
+
+    @patch('requests.Session.get')
+    def test_cross_rates_from_single_table(self, mock_get):
+        """Test any currency pair is triangulated from the USD table"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            'rates': {'USD': 1.0, 'EUR': 0.8, 'GBP': 0.5, 'JPY': 150.0, 'INR': 80.0},
+            'date': '2025-07-22'
+        }
+        mock_get.return_value = mock_response
+
+        result_gbp = self.converter.convert_currency(10, 'GBP', 'JPY')
+        result_inr = self.converter.convert_currency(1000, 'INR', 'EUR')
+        rates_eur = self.converter.get_exchange_rates('EUR')
+
+        self.assertIn('3,000.00 JPY', result_gbp)
+        self.assertIn('1 GBP = 300.0000 JPY', result_gbp)
+        self.assertIn('10.00 EUR', result_inr)
+        self.assertIn('| GBP | 0.6250 |', rates_eur)
+        mock_get.assert_called_once()
+        self.assertTrue(mock_get.call_args[0][0].endswith('/latest/USD'))
+
+    @patch('requests.Session.get')
+    def test_convert_currency_invalid_source_currency(self, mock_get):
+        """Test conversion from a currency missing in the rate table"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {'rates': {'EUR': 0.85}, 'date': '2025-07-22'}
+        mock_get.return_value = mock_response
+
+        result = self.converter.convert_currency(100, 'XYZ', 'EUR')
+
+        self.assertIn("'XYZ' not supported", result)
+
+    @patch('requests.Session.get')
+    def test_convert_to_currencies(self, mock_get):
+        """Test one amount converted into several currencies in one call"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            'rates': {'EUR': 0.85, 'GBP': 0.75, 'INR': 80.0},
+            'date': '2025-07-22'
+        }
+        mock_get.return_value = mock_response
+
+        result = self.converter.convert_to_currencies(1200, 'usd', ['EUR', 'gbp', 'INR', 'XYZ'])
+
+        self.assertIn('1,020.00 EUR', result)
+        self.assertIn('900.00 GBP', result)
+        self.assertIn('96,000.00 INR', result)
+        self.assertIn("'XYZ' not supported", result)
+        mock_get.assert_called_once()
+
+    @patch('requests.Session.get')
+    def test_convert_currency_batch(self, mock_get):
+        """Test many amounts converted between mixed pairs in one call"""
+        mock_response = Mock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            'rates': {'EUR': 0.8, 'GBP': 0.5, 'JPY': 150.0},
+            'date': '2025-07-22'
+        }
+        mock_get.return_value = mock_response
+
+        result = self.converter.convert_currency_batch([
+            {'amount': 100, 'from_currency': 'USD', 'to_currency': 'EUR'},
+            ('10', 'GBP', 'JPY'),
+        ])
+
+        self.assertIn('80.00 EUR', result)
+        self.assertIn('3,000.00 JPY', result)
+        mock_get.assert_called_once()
+
+    def test_convert_currency_batch_invalid_entry(self):
+        """Test malformed batch entries are reported, not raised"""
+        result = self.converter.convert_currency_batch([{'amount': 100, 'from_currency': 'USD'}])
+
+        self.assertIn('Invalid conversion entry', result)
+
+    def test_rate_cache_evicts_least_recently_used(self):
+        """Test rate cache stays within its size bound"""
+        from ttl_cache import TTLCache
+
+        cache = TTLCache(ttl_seconds=60, max_entries=2)
+        cache.set('USD', 1)
+        cache.set('EUR', 2)
+        cache.get('USD')
+        cache.set('GBP', 3)
+
+        self.assertIn('USD', cache)
+        self.assertNotIn('EUR', cache)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
     def test_get_supported_currencies(self):
         """Test getting supported currencies list"""
         result = self.converter.get_supported_currencies()
@@ -92,8 +230,12 @@ class TestCurrencyConverter(unittest.TestCase):
 class TestSalesAgent(unittest.TestCase):
     """Test Sales Agent core functionality"""
     
-    @patch('sales_agent.Gemini')
-    @patch('sales_agent.Agent')
+    def setUp(self):
+        reset_sales_agent()
+        self.addCleanup(reset_sales_agent)
+    
+    @patch('agent_core.Gemini')
+    @patch('agent_core.Agent')
     def test_get_sales_agent_creation(self, mock_agent, mock_gemini):
         """Test sales agent creation"""
         mock_agent_instance = Mock()
@@ -105,7 +247,43 @@ class TestSalesAgent(unittest.TestCase):
         mock_gemini.assert_called_once()
         self.assertEqual(agent, mock_agent_instance)
     
-    @patch('sales_agent.get_sales_agent')
+    @patch('agent_core.Gemini')
+    @patch('agent_core.Agent')
+    def test_agent_cached_per_process(self, mock_agent, mock_gemini):
+        """Test the agent is built once, even with concurrent first calls"""
+        import threading
+        
+        agents = []
+        threads = [threading.Thread(target=lambda: agents.append(get_sales_agent())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        mock_agent.assert_called_once()
+        self.assertEqual(len(set(map(id, agents))), 1)
+    
+    def test_core_import_has_no_ui_side_effects(self):
+        """Test importing the agent core pulls in neither Streamlit nor phi/Gemini"""
+        import subprocess
+        
+        src_dir = os.path.dirname(agent_core.__file__)
+        probe = ("import sys, agent_core; agent_core.CurrencyConverter(); "
+                 "print(sorted(m for m in ('streamlit', 'phi', 'google.generativeai') if m in sys.modules))")
+        result = subprocess.run([sys.executable, "-c", probe],
+                                cwd=src_dir, capture_output=True, text=True, timeout=120)
+        self.assertEqual(result.stdout.strip(), "[]", result.stderr)
+    
+    def test_currency_tools_wrapped_as_toolkit(self):
+        """Test the plain converter registers every tool when handed to the agent"""
+        converter = CurrencyConverter()
+        toolkit = converter.as_toolkit()
+        
+        self.assertEqual(toolkit.name, "currency_converter")
+        self.assertEqual(list(toolkit.functions), [tool.__name__ for tool in converter.tools])
+        self.assertIn("convert_currency", toolkit.functions)
+    
+    @patch('agent_core.get_sales_agent')
     def test_get_ai_response(self, mock_get_agent):
         """Test AI response generation"""
         mock_agent = Mock()
@@ -121,7 +299,7 @@ class TestSalesAgent(unittest.TestCase):
     
     def test_product_catalog_exists(self):
         """Test that product catalog is defined"""
-        from sales_agent import PRODUCT_CATALOG
+        from agent_core import PRODUCT_CATALOG
         
         self.assertIsInstance(PRODUCT_CATALOG, str)
         self.assertIn('Laptops', PRODUCT_CATALOG)
@@ -129,7 +307,7 @@ class TestSalesAgent(unittest.TestCase):
     
     def test_sales_system_prompt_exists(self):
         """Test that system prompt is properly configured"""
-        from sales_agent import SALES_SYSTEM_PROMPT
+        from agent_core import SALES_SYSTEM_PROMPT
         
         self.assertIsInstance(SALES_SYSTEM_PROMPT, str)
         self.assertIn('Sales Analyst', SALES_SYSTEM_PROMPT)
@@ -139,7 +317,7 @@ class TestSalesAgent(unittest.TestCase):
 class TestIntegration(unittest.TestCase):
     """Integration tests for Sales Agent components"""
     
-    @patch('requests.get')
+    @patch('requests.Session.get')
     def test_currency_conversion_integration(self, mock_get):
         """Test full currency conversion workflow"""
         # Mock successful API response
@@ -10,7 +10,14 @@ import json
 # Add src directory to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
+import whatsapp_integration
 from whatsapp_integration import WhatsAppBot, app
+from message_queue import MessageWorkerPool
+from message_dedupe import MessageDeduplicator, SQLiteDedupeStore
+from response_cache import ResponseCache, normalize_prompt
+from semantic_cache import SemanticCache
+from single_flight import SingleFlight
+from pagination import encode_cursor
 
 
 class TestWhatsAppBot(unittest.TestCase):
@@ -40,7 +47,7 @@ class TestWhatsAppBot(unittest.TestCase):
         self.assertEqual(agent2, mock_agent)
         mock_get_sales_agent.assert_called_once()
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_send_message_success(self, mock_post):
         """Test successful message sending"""
         mock_response = Mock()
@@ -59,7 +66,7 @@ class TestWhatsAppBot(unittest.TestCase):
         self.assertEqual(payload['to'], '+1234567890')
         self.assertEqual(payload['text']['body'], 'Test message')
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_send_message_failure(self, mock_post):
         """Test message sending failure"""
         mock_response = Mock()
@@ -71,7 +78,7 @@ class TestWhatsAppBot(unittest.TestCase):
         
         self.assertFalse(result)
     
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_send_template_message(self, mock_post):
         """Test template message sending"""
         mock_response = Mock()
@@ -173,9 +180,113 @@ class TestWebhookEndpoints(unittest.TestCase):
                                content_type='application/json')
         
         self.assertEqual(response.status_code, 200)
+        self.assertTrue(whatsapp_integration.message_queue.join(timeout=5))
         mock_bot.process_message.assert_called_once_with("1234567890", "Hello")
         mock_bot.send_message.assert_called_once_with("1234567890", "Test response")
     
+    @patch('whatsapp_integration.whatsapp_bot')
+    def test_webhook_acknowledges_before_processing(self, mock_bot):
+        """Test webhook returns while the reply is still being generated"""
+        import threading
+        release = threading.Event()
+        mock_bot.process_message.side_effect = lambda phone, text: release.wait(5) and "Test response"
+        
+        webhook_data = {
+            "entry": [{"changes": [{"value": {"messages": [{
+                "from": "1234567890",
+                "text": {"body": "Hello"}
+            }]}}]}]
+        }
+        
+        response = self.app.post('/webhook',
+                               data=json.dumps(webhook_data),
+                               content_type='application/json')
+        
+        self.assertEqual(response.status_code, 200)
+        mock_bot.send_message.assert_not_called()
+        
+        release.set()
+        self.assertTrue(whatsapp_integration.message_queue.join(timeout=5))
+        mock_bot.send_message.assert_called_once_with("1234567890", "Test response")
+    
+    @patch('whatsapp_integration.message_deduplicator', new_callable=MessageDeduplicator)
+    @patch('whatsapp_integration.message_queue')
+    def test_webhook_skips_redelivered_message(self, mock_queue, mock_dedupe):
+        """Test a redelivered message ID is not processed twice"""
+        webhook_data = {
+            "entry": [{"changes": [{"value": {"messages": [{
+                "id": "wamid.TEST123",
+                "from": "1234567890",
+                "text": {"body": "Hello"}
+            }]}}]}]
+        }
+        
+        for _ in range(3):
+            response = self.app.post('/webhook',
+                                   data=json.dumps(webhook_data),
+                                   content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        
+        mock_queue.submit.assert_called_once_with("1234567890", "Hello")
+        self.assertEqual(mock_dedupe.duplicates, 2)
+    
+    @patch('whatsapp_integration.message_deduplicator', new_callable=MessageDeduplicator)
+    @patch('whatsapp_integration.message_queue')
+    def test_webhook_queue_full_allows_redelivery(self, mock_queue, mock_dedupe):
+        """Test a message rejected with 503 is accepted when redelivered"""
+        import queue
+        mock_queue.submit.side_effect = [queue.Full, None]
+        
+        webhook_data = {
+            "entry": [{"changes": [{"value": {"messages": [{
+                "id": "wamid.TEST456",
+                "from": "1234567890",
+                "text": {"body": "Hello"}
+            }]}}]}]
+        }
+        
+        first = self.app.post('/webhook', data=json.dumps(webhook_data), content_type='application/json')
+        second = self.app.post('/webhook', data=json.dumps(webhook_data), content_type='application/json')
+        
+        self.assertEqual(first.status_code, 503)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(mock_queue.submit.call_count, 2)
+    
+    @patch('whatsapp_integration.message_deduplicator', new_callable=MessageDeduplicator)
+    @patch('whatsapp_integration.message_queue')
+    def test_webhook_invalid_message_not_marked(self, mock_queue, mock_dedupe):
+        """Test a delivery missing its sender or text does not block the corrected redelivery"""
+        def webhook(message):
+            message = dict(message, id="wamid.TEST789")
+            data = {"entry": [{"changes": [{"value": {"messages": [message]}}]}]}
+            return self.app.post('/webhook', data=json.dumps(data), content_type='application/json')
+        
+        webhook({"text": {"body": "Hello"}})
+        webhook({"from": "1234567890", "type": "image"})
+        self.assertEqual(webhook({"from": "1234567890", "text": {"body": "Hello"}}).status_code, 200)
+        
+        mock_queue.submit.assert_called_once_with("1234567890", "Hello")
+        self.assertEqual(mock_dedupe.duplicates, 0)
+    
+    @patch('whatsapp_integration.message_queue')
+    def test_webhook_queue_full(self, mock_queue):
+        """Test webhook asks for redelivery when the queue is saturated"""
+        import queue
+        mock_queue.submit.side_effect = queue.Full
+        
+        webhook_data = {
+            "entry": [{"changes": [{"value": {"messages": [{
+                "from": "1234567890",
+                "text": {"body": "Hello"}
+            }]}}]}]
+        }
+        
+        response = self.app.post('/webhook',
+                               data=json.dumps(webhook_data),
+                               content_type='application/json')
+        
+        self.assertEqual(response.status_code, 503)
+    
     def test_send_manual_message_endpoint(self):
         """Test manual message sending endpoint"""
         with patch('whatsapp_integration.whatsapp_bot') as mock_bot:
@@ -205,6 +316,575 @@ class TestWebhookEndpoints(unittest.TestCase):
         self.assertEqual(response.status_code, 400)
 
 
+class TestMessageWorkerPool(unittest.TestCase):
+    """Test background message processing pool"""
+    
+    def test_workers_drain_queue(self):
+        """Test every submitted message reaches the handler"""
+        handled = []
+        pool = MessageWorkerPool(lambda phone, text: handled.append((phone, text)), num_workers=3)
+        
+        for i in range(20):
+            pool.submit(f"12345{i}", f"Message {i}")
+        
+        self.assertTrue(pool.join(timeout=5))
+        self.assertEqual(len(handled), 20)
+        self.assertEqual(pool.pending(), 0)
+        pool.shutdown()
+    
+    def test_handler_errors_do_not_stop_workers(self):
+        """Test a failing message does not kill its worker"""
+        handled = []
+        
+        def handler(phone, text):
+            if text == "boom":
+                raise RuntimeError("LLM failure")
+            handled.append(text)
+        
+        pool = MessageWorkerPool(handler, num_workers=1)
+        pool.submit("1", "boom")
+        pool.submit("1", "ok")
+        
+        self.assertTrue(pool.join(timeout=5))
+        self.assertEqual(handled, ["ok"])
+        pool.shutdown()
+    
+    def test_same_user_messages_processed_in_order(self):
+        """Test one user's messages never overlap and keep arrival order"""
+        import threading
+        import time
+
+        handled = {}
+        active = set()
+        overlaps = []
+        lock = threading.Lock()
+
+        def handler(phone, text):
+            with lock:
+                if phone in active:
+                    overlaps.append(phone)
+                active.add(phone)
+            time.sleep(0.002)
+            with lock:
+                active.discard(phone)
+                handled.setdefault(phone, []).append(text)
+
+        pool = MessageWorkerPool(handler, num_workers=4)
+        for i in range(10):
+            for phone in ("111", "222", "333"):
+                pool.submit(phone, f"{phone}-{i}")
+
+        self.assertTrue(pool.join(timeout=5))
+        self.assertEqual(overlaps, [])
+        for phone in ("111", "222", "333"):
+            self.assertEqual(handled[phone], [f"{phone}-{i}" for i in range(10)])
+        pool.shutdown()
+
+    def test_different_users_processed_in_parallel(self):
+        """Test a slow user does not block other users"""
+        import threading
+
+        release = threading.Event()
+        fast_done = threading.Event()
+
+        def handler(phone, text):
+            if phone == "slow":
+                release.wait(5)
+            else:
+                fast_done.set()
+
+        pool = MessageWorkerPool(handler, num_workers=2)
+        pool.submit("slow", "first")
+        pool.submit("slow", "second")
+        pool.submit("fast", "hello")
+
+        self.assertTrue(fast_done.wait(5))
+        release.set()
+        self.assertTrue(pool.join(timeout=5))
+        pool.shutdown()
+
+    def test_bounded_queue_rejects_overflow(self):
+        """Test submit raises queue.Full past the configured bound"""
+        import queue
+        import threading
+
+        release = threading.Event()
+        pool = MessageWorkerPool(lambda phone, text: release.wait(5), num_workers=1, max_queue_size=2)
+        pool.submit("1", "a")
+        pool.submit("2", "b")
+
+        with self.assertRaises(queue.Full):
+            pool.submit("3", "c")
+
+        release.set()
+        self.assertTrue(pool.join(timeout=5))
+        pool.shutdown()
+
+    def test_inline_mode(self):
+        """Test zero workers processes messages synchronously"""
+        handled = []
+        pool = MessageWorkerPool(lambda phone, text: handled.append(text), num_workers=0)
+        
+        pool.submit("1", "Hello")
+        
+        self.assertEqual(handled, ["Hello"])
+
+
+class TestMessageDeduplicator(unittest.TestCase):
+    """Test processed message-ID index"""
+    
+    def test_duplicates_detected(self):
+        """Test only the first sighting of an ID is processed"""
+        dedupe = MessageDeduplicator(ttl_seconds=60, max_entries=10)
+        
+        self.assertTrue(dedupe.check_and_mark("wamid.1"))
+        self.assertFalse(dedupe.check_and_mark("wamid.1"))
+        self.assertTrue(dedupe.check_and_mark("wamid.2"))
+        self.assertEqual(dedupe.duplicates, 1)
+    
+    def test_ids_expire(self):
+        """Test IDs are forgotten after the TTL"""
+        dedupe = MessageDeduplicator(ttl_seconds=0, max_entries=10)
+        
+        self.assertTrue(dedupe.check_and_mark("wamid.1"))
+        self.assertTrue(dedupe.check_and_mark("wamid.1"))
+    
+    def test_persistent_store_survives_restart(self):
+        """Test IDs recorded in SQLite are seen by a fresh deduplicator"""
+        import tempfile
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "dedupe.db")
+            first = MessageDeduplicator(ttl_seconds=60, store=SQLiteDedupeStore(db_path))
+            self.assertTrue(first.check_and_mark("wamid.1"))
+            first.store.close()
+            
+            second = MessageDeduplicator(ttl_seconds=60, store=SQLiteDedupeStore(db_path))
+            self.assertFalse(second.check_and_mark("wamid.1"))
+            self.assertTrue(second.check_and_mark("wamid.2"))
+            second.store.close()
+
+
+class TestPaginatedEndpoints(unittest.TestCase):
+    """Test cursor pagination, field selection and NDJSON streaming"""
+    
+    def setUp(self):
+        import tempfile
+        from conversation_memory import ConversationMemory
+        from session_storage import JsonFileStorage
+        
+        self.storage_dir = tempfile.mkdtemp()
+        self.memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        patcher = patch('whatsapp_integration.whatsapp_bot')
+        self.addCleanup(patcher.stop)
+        patcher.start().memory = self.memory
+        self.app = app.test_client()
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+    
+    def _walk(self, url):
+        """Follow next_cursor until the last page"""
+        pages, cursor = [], None
+        while True:
+            response = self.app.get(url + (f"&cursor={cursor}" if cursor else ""))
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            pages.append(data)
+            cursor = data["next_cursor"]
+            if cursor is None:
+                return pages
+    
+    def test_users_paged_by_cursor(self):
+        """Test pages cover every user once, with summaries and field selection"""
+        for i in range(5):
+            self.memory.add_message(f"+100{i}", "user", "Hello")
+        
+        pages = self._walk('/analytics/users?limit=2&fields=phone_number,total_interactions')
+        
+        self.assertEqual([len(page["users"]) for page in pages], [2, 2, 1])
+        users = [user for page in pages for user in page["users"]]
+        self.assertEqual([user["phone_number"] for user in users], [f"+100{i}" for i in range(5)])
+        self.assertEqual(set(users[0]), {"phone_number", "total_interactions"})
+        self.assertEqual(pages[0]["total_users"], 5)
+        self.assertEqual(pages[0]["summary"]["total_interactions"], 5)
+    
+    def test_users_streamed_as_ndjson(self):
+        """Test NDJSON streams every user, or one page with the cursor in a header"""
+        for i in range(5):
+            self.memory.add_message(f"+100{i}", "user", "Hello")
+        
+        with patch('whatsapp_integration.ANALYTICS_MAX_PAGE_SIZE', 2):
+            response = self.app.get('/analytics/users?format=ndjson&fields=phone_number')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual(lines, [{"phone_number": f"+100{i}"} for i in range(5)])
+        
+        response = self.app.get('/analytics/users?format=ndjson&limit=3')
+        self.assertEqual(len(response.data.decode().splitlines()), 3)
+        rest = self.app.get('/analytics/users?format=ndjson&cursor=' + response.headers['X-Next-Cursor'])
+        self.assertEqual(len(rest.data.decode().splitlines()), 2)
+        self.assertNotIn('X-Next-Cursor', rest.headers)
+    
+    def test_conversation_paged_backwards(self):
+        """Test conversation pages run from newest to oldest, oldest first within a page"""
+        for i in range(7):
+            self.memory.add_message("+1234567890", "user", f"Message {i}")
+        
+        pages = self._walk('/conversation/+1234567890?limit=3&fields=content')
+        
+        self.assertEqual([[msg["content"] for msg in page["messages"]] for page in pages],
+                         [["Message 4", "Message 5", "Message 6"],
+                          ["Message 1", "Message 2", "Message 3"],
+                          ["Message 0"]])
+        self.assertEqual(pages[0]["session_info"]["total_messages"], 7)
+        
+        response = self.app.get('/conversation/+1234567890?format=ndjson&limit=2')
+        lines = [json.loads(line) for line in response.data.decode().splitlines()]
+        self.assertEqual([line["content"] for line in lines], ["Message 5", "Message 6"])
+        self.assertIn('X-Next-Cursor', response.headers)
+    
+    def test_conversation_pages_keep_equal_timestamps(self):
+        """Test messages sharing a timestamp are all returned across page boundaries"""
+        from conversation_memory import ConversationMessage
+        
+        session = self.memory.get_or_create_session("+1234567890")
+        timestamps = ["2025-07-22T22:30:00"] * 4 + ["2025-07-22T22:31:00"] * 3 + ["2025-07-22T22:32:00"] * 2
+        session.messages = [ConversationMessage(timestamp, "user", f"Message {i}")
+                            for i, timestamp in enumerate(timestamps)]
+        
+        for limit in (1, 2, 3, 4):
+            pages = self._walk(f'/conversation/+1234567890?limit={limit}&fields=content')
+            contents = [msg["content"] for page in reversed(pages) for msg in page["messages"]]
+            self.assertEqual(contents, [f"Message {i}" for i in range(9)], limit)
+    
+    def test_invalid_parameters_rejected(self):
+        """Test bad limits, fields, formats and cursors get a 400"""
+        for url in ('/analytics/users?limit=0', '/analytics/users?limit=abc',
+                    '/analytics/users?fields=password', '/analytics/users?format=xml',
+                    '/analytics/users?cursor=%%%', '/conversation/+1?limit=1000',
+                    '/conversation/+1?cursor=' + encode_cursor('2025-07-22T22:30:00#x')):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, 400, url)
+            self.assertIn("error", json.loads(response.data))
+
+
+class TestResponseCache(unittest.TestCase):
+    """Test repeated questions are answered without another model call"""
+    
+    def setUp(self):
+        import tempfile
+        from conversation_memory import ConversationMemory
+        from session_storage import JsonFileStorage
+        
+        self.storage_dir = tempfile.mkdtemp()
+        self.bot = WhatsAppBot()
+        self.bot.memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        self.bot.response_cache = ResponseCache(ttl_seconds=60, max_entries=10)
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+    
+    def test_prompt_normalization(self):
+        """Test case, punctuation and spacing differences share one key"""
+        self.assertEqual(normalize_prompt("What are the current exchange rates?"),
+                         normalize_prompt("  what ARE the current   exchange-rates "))
+        self.assertNotEqual(normalize_prompt("Convert 1.5 USD"), normalize_prompt("Convert 15 USD"))
+        self.assertNotEqual(ResponseCache.make_key("Show gaming laptops", "USD", ["laptop"]),
+                            ResponseCache.make_key("Show gaming laptops", "EUR", ["laptop"]))
+    
+    def test_personal_and_time_sensitive_bypass(self):
+        """Test questions tied to the user or the moment are never cached"""
+        cache = self.bot.response_cache
+        self.assertIsNone(cache.bypass_reason("Show me gaming laptops", "product_inquiry"))
+        self.assertEqual(cache.bypass_reason("Hello there friend", "greeting"), "greeting")
+        self.assertEqual(cache.bypass_reason("What did I buy last time?"), "personal")
+        self.assertEqual(cache.bypass_reason("Any laptop deals today?"), "time_sensitive")
+        self.assertEqual(cache.bypass_reason("Tell me more about that"), "follow_up")
+        self.assertEqual(cache.bypass_reason("yes please"), "follow_up")
+    
+    @patch('whatsapp_integration.get_ai_response')
+    def test_repeated_question_served_from_cache(self, mock_get_ai_response):
+        """Test a second customer with the same preferences gets the cached reply"""
+        mock_get_ai_response.return_value = Mock(content="**Rates**: 1 USD = 0.85 EUR")
+        
+        first = self.bot.process_message("+111", "What are the current exchange rates?")
+        second = self.bot.process_message("+222", "what are the current exchange rates")
+        self.assertEqual(first, second)
+        self.assertEqual(mock_get_ai_response.call_count, 1)
+        
+        # Cached replies are still recorded in each user's history
+        history = self.bot.memory.get_or_create_session("+222").messages
+        self.assertEqual(history[-1].content, second)
+        
+        self.bot.process_message("+333", "What did I ask last time about exchange rates?")
+        self.assertEqual(mock_get_ai_response.call_count, 2)
+    
+    @patch('whatsapp_integration.get_ai_response')
+    def test_replies_naming_the_user_not_cached(self, mock_get_ai_response):
+        """Test a reply addressed to one customer is never served to another"""
+        self.bot.memory.update_user_preferences("+111", name="Alice")
+        mock_get_ai_response.return_value = Mock(content="Alice, here are our gaming laptops")
+        
+        self.bot.process_message("+111", "Show gaming laptops available")
+        self.bot.process_message("+111", "Show gaming laptops available")
+        
+        self.assertEqual(mock_get_ai_response.call_count, 2)
+        self.assertEqual(self.bot.response_cache.stats()["rejected"], 2)
+
+    
+    @patch('whatsapp_integration.get_ai_response')
+    def test_cached_reply_not_built_from_user_history(self, mock_get_ai_response):
+        """Test a reply to a cacheable question never draws on the asker's conversation"""
+        def reply(prompt):
+            if "Dell XPS" in prompt:
+                return Mock(content="Since you liked the Dell XPS, here are our gaming laptops")
+            return Mock(content="Here are our gaming laptops")
+        mock_get_ai_response.side_effect = reply
+        self.bot.memory.add_message("+111", "user", "I had a look at the Dell XPS yesterday")
+        
+        first = self.bot.process_message("+111", "Show gaming laptops available")
+        second = self.bot.process_message("+222", "Show gaming laptops available")
+        
+        self.assertEqual(mock_get_ai_response.call_count, 1)
+        self.assertNotIn("Dell XPS", mock_get_ai_response.call_args[0][0])
+        self.assertNotIn("Dell XPS", second)
+        self.assertEqual(first, second)
+
+class TestSemanticCache(unittest.TestCase):
+    """Test paraphrased questions reuse answers without another model call"""
+    
+    def setUp(self):
+        import tempfile
+        from conversation_memory import ConversationMemory
+        from session_storage import JsonFileStorage
+        
+        self.storage_dir = tempfile.mkdtemp()
+        self.bot = WhatsAppBot()
+        self.bot.memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        self.bot.response_cache = ResponseCache(ttl_seconds=60, max_entries=10)
+        self.bot.semantic_cache = SemanticCache(threshold=0.82, ttl_seconds=60, max_entries=10)
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+    
+    @patch('whatsapp_integration.get_ai_response')
+    def test_paraphrase_served_from_semantic_cache(self, mock_get_ai_response):
+        """Test a reworded question gets the answer to the original"""
+        mock_get_ai_response.return_value = Mock(content="The gaming laptop is $1299")
+        
+        first = self.bot.process_message("+111", "What is the price of the gaming laptop?")
+        second = self.bot.process_message("+222", "gaming laptop price please")
+        self.assertEqual(first, second)
+        self.assertEqual(mock_get_ai_response.call_count, 1)
+        
+        stats = self.bot.semantic_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["lookup_latency_ms"]["count"], 2)
+    
+    def test_amounts_and_currency_direction_never_match(self):
+        """Test near-identical wording with different amounts or currency order misses"""
+        bot, cache = self.bot, self.bot.semantic_cache
+        question = "Convert 100 USD to EUR for the laptop"
+        cache.store(question, "100 USD = 85 EUR", bot._semantic_scope(question, ("", "", ())))
+        
+        def lookup(message):
+            return cache.lookup(message, bot._semantic_scope(message, ("", "", ())))
+        
+        self.assertEqual(lookup("convert 100 usd to eur for laptop"), "100 USD = 85 EUR")
+        self.assertIsNone(lookup("Convert 200 USD to EUR for the laptop"))
+        self.assertIsNone(lookup("Convert 100 EUR to USD for the laptop"))
+        self.assertIsNone(cache.lookup(question, ("EUR", (), ("USD", "EUR"), ("laptop",))))
+    
+    def test_model_variants_never_match(self):
+        """Test questions naming different models of one product miss despite similar wording"""
+        cache = self.bot.semantic_cache
+        cache.store("is the macbook pro available", "The MacBook Pro is in stock")
+        cache.store("do you sell the iphone 15 pro", "Yes, the iPhone 15 Pro is $999")
+        
+        self.assertIsNone(cache.lookup("is the macbook air available"))
+        self.assertIsNone(cache.lookup("do you sell the iphone 15"))
+        self.assertEqual(cache.lookup("Is the MacBook Pro available?"), "The MacBook Pro is in stock")
+        self.assertEqual(cache.lookup("Do you sell iPhone 15 Pro?"), "Yes, the iPhone 15 Pro is $999")
+        
+        cache.store("is the macbook air available", "The MacBook Air ships next week")
+        self.assertEqual(len(cache), 3)  # A variant is a new entry, not a refresh of the other model
+        self.assertEqual(cache.lookup("is the macbook pro available"), "The MacBook Pro is in stock")
+    
+    def test_expiry_and_eviction(self):
+        """Test expired answers are not served and a full index replaces the oldest entry"""
+        now = [0.0]
+        cache = SemanticCache(threshold=0.82, ttl_seconds=10, max_entries=2, clock=lambda: now[0])
+        cache.store("laptop warranty length", "1 year")
+        now[0] = 1.0
+        cache.store("international shipping options", "We ship worldwide")
+        now[0] = 2.0
+        cache.store("warranty length for laptop", "2 years")  # Near-duplicate refreshes in place
+        self.assertEqual((len(cache), cache.stats()["refreshed"]), (2, 1))
+        
+        cache.store("store opening hours", "9 to 5")
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertIsNone(cache.lookup("international shipping options"))
+        self.assertEqual(cache.lookup("laptop warranty length"), "2 years")
+        
+        now[0] = 20.0
+        self.assertIsNone(cache.lookup("laptop warranty length"))
+    
+    def test_cache_metrics_endpoint(self):
+        """Test hit rates and latencies are exposed for monitoring"""
+        with patch.object(whatsapp_integration, 'whatsapp_bot', self.bot):
+            self.bot.semantic_cache.lookup("gaming laptop price")
+            response = app.test_client().get('/metrics/cache')
+        
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data["semantic_cache"]["misses"], 1)
+        self.assertIn("hit_rate", data["semantic_cache"])
+        self.assertIn("p95", data["agent_latency_ms"])
+        self.assertIn("hits", data["response_cache"])
+
+
+class TestRequestCoalescing(unittest.TestCase):
+    """Test bursts of the same question share one agent call"""
+    
+    def setUp(self):
+        import tempfile
+        from conversation_memory import ConversationMemory
+        from session_storage import JsonFileStorage
+        
+        self.storage_dir = tempfile.mkdtemp()
+        self.bot = WhatsAppBot()
+        self.bot.memory = ConversationMemory(storage=JsonFileStorage(self.storage_dir), flush_interval=0)
+        self.bot.response_cache = ResponseCache(ttl_seconds=60, max_entries=10)
+        self.bot.semantic_cache = SemanticCache(ttl_seconds=60, max_entries=10)
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.storage_dir, ignore_errors=True)
+    
+    def _burst(self, target, count):
+        """Start count threads running target(i) while the leader's call is held open"""
+        import threading
+        threads = [threading.Thread(target=target, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads
+    
+    def test_followers_share_result_and_errors(self):
+        """Test concurrent callers get the leader's result, or its exception"""
+        import threading
+        import time
+        flight = SingleFlight(timeout_seconds=5)
+        release, calls, results = threading.Event(), [], []
+        
+        def slow_call():
+            calls.append(1)
+            release.wait(5)
+            return "answer"
+        
+        threads = self._burst(lambda i: results.append(flight.do("key", slow_call)), 5)
+        while flight.stats()["coalesced"] < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [("answer", False)] + [("answer", True)] * 4)
+        self.assertEqual(len(flight), 0)
+        
+        def failing_call():
+            raise RuntimeError("quota exceeded")
+        with self.assertRaises(RuntimeError):
+            flight.do("key", failing_call)
+    
+    @patch('whatsapp_integration.get_ai_response')
+    def test_burst_of_same_question_makes_one_agent_call(self, mock_get_ai_response):
+        """Test customers asking the same question at once trigger a single agent call"""
+        import threading
+        import time
+        release = threading.Event()
+        
+        def slow_response(context):
+            release.wait(5)
+            return Mock(content="Our gaming laptops start at $999")
+        mock_get_ai_response.side_effect = slow_response
+        
+        replies = {}
+        threads = self._burst(lambda i: replies.__setitem__(
+            i, self.bot.process_message(f"+10{i}", "Which gaming laptops do you sell?")), 5)
+        while self.bot.in_flight.stats()["coalesced"] < 4:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(mock_get_ai_response.call_count, 1)
+        self.assertEqual(set(replies.values()), {"Our gaming laptops start at $999"})
+        history = self.bot.memory.get_or_create_session("+104").messages
+        self.assertEqual(history[-1].content, "Our gaming laptops start at $999")
+    
+    @patch('whatsapp_integration.get_ai_response')
+    def test_burst_coalesced_with_caches_disabled(self, mock_get_ai_response):
+        """Test coalescing still protects the agent when the reply caches are turned off"""
+        import threading
+        import time
+        self.bot.response_cache = ResponseCache(ttl_seconds=0)
+        self.bot.semantic_cache = SemanticCache(ttl_seconds=0)
+        release = threading.Event()
+        
+        def slow_response(context):
+            release.wait(5)
+            return Mock(content="Our gaming laptops start at $999")
+        mock_get_ai_response.side_effect = slow_response
+        
+        threads = self._burst(lambda i: self.bot.process_message(f"+10{i}", "Which gaming laptops do you sell?"), 5)
+        deadline = time.monotonic() + 2
+        while self.bot.in_flight.stats()["coalesced"] < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(mock_get_ai_response.call_count, 1)
+        self.assertEqual(len(self.bot.response_cache.cache), 0)
+        
+        self.bot.process_message("+200", "Which gaming laptops do you sell?")
+        self.assertEqual(mock_get_ai_response.call_count, 2)  # Nothing was cached
+    
+    @patch('whatsapp_integration.get_ai_response')
+    def test_reply_naming_leader_not_shared(self, mock_get_ai_response):
+        """Test followers ask the agent themselves when the shared reply names another user"""
+        import threading
+        import time
+        self.bot.memory.update_user_preferences("+100", name="Alice")
+        release = threading.Event()
+        
+        def slow_response(context):
+            release.wait(5)
+            return Mock(content="Alice, our gaming laptops start at $999")
+        mock_get_ai_response.side_effect = slow_response
+        
+        def ask(i):
+            self.bot.process_message(f"+10{i}", "Which gaming laptops do you sell?")
+        
+        # Alice leads; the others join her call while it is in flight
+        threads = self._burst(ask, 1)
+        while mock_get_ai_response.call_count < 1:
+            time.sleep(0.01)
+        threads += self._burst(lambda i: ask(i + 1), 2)
+        while self.bot.in_flight.stats()["coalesced"] < 2:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(mock_get_ai_response.call_count, 3)
+
+
 class TestEnvironmentConfiguration(unittest.TestCase):
     """Test environment configuration"""
     
@@ -232,6 +912,12 @@ if __name__ == '__main__':
     # Add test cases
     test_suite.addTest(unittest.makeSuite(TestWhatsAppBot))
     test_suite.addTest(unittest.makeSuite(TestWebhookEndpoints))
+    test_suite.addTest(unittest.makeSuite(TestMessageWorkerPool))
+    test_suite.addTest(unittest.makeSuite(TestMessageDeduplicator))
+    test_suite.addTest(unittest.makeSuite(TestPaginatedEndpoints))
+    test_suite.addTest(unittest.makeSuite(TestResponseCache))
+    test_suite.addTest(unittest.makeSuite(TestSemanticCache))
+    test_suite.addTest(unittest.makeSuite(TestRequestCoalescing))
     test_suite.addTest(unittest.makeSuite(TestEnvironmentConfiguration))
     
     # Run tests